@@ -0,0 +1,195 @@
+# ====================================================================
+# Shared data access for the exercises
+
+# Every exercise reads its data from a Google Sheets CSV export.
+# Instead of downloading and parsing the CSV on every run
+# (and on every new Bokeh server session),
+# `read_csv_cached` keeps a columnar snapshot of each URL on disk
+# and loads the snapshot directly on later calls.
+# ====================================================================
+
+# The snapshot of a URL is only revalidated against the server
+# when it is asked for, either with `revalidate=True`
+# or by setting the environment variable DVC_REVALIDATE=1.
+# Revalidation is a conditional request (ETag / Last-Modified),
+# so an unchanged sheet costs one empty 304 response instead of a download.
+# If the server cannot be reached, the snapshot is used as it is,
+# so the scripts also work fully offline once the cache is filled
+# (set DVC_OFFLINE=1 to never touch the network).
+# reference:
+# https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+
+# The snapshots are written as Feather files if pyarrow is installed,
+# otherwise as pickles. Both keep the dtypes of the parsed frame.
+# The cache directory defaults to `.dvc_cache` in the repository root
+# and can be moved with the environment variable DVC_CACHE_DIR.
+
+import hashlib
+import io
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401 (only needed by to_feather / read_feather)
+
+    SNAPSHOT_FORMAT = "feather"
+except ImportError:
+    SNAPSHOT_FORMAT = "pickle"
+
+CACHE_DIR = os.environ.get(
+    "DVC_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dvc_cache"),
+)
+TIMEOUT = 30  # seconds
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+# The snapshot of a URL is stored under a key derived from the URL
+# and the keyword arguments passed to `pd.read_csv`,
+# since different arguments give different frames.
+def _cache_key(url, read_csv_kwargs):
+    ident = json.dumps([url, sorted(read_csv_kwargs.items())], default=repr)
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+
+def _paths(key, cache_dir):
+    base = os.path.join(cache_dir, key)
+    return base + ".meta.json", base + "." + SNAPSHOT_FORMAT
+
+
+# The metadata only stores the file name of the snapshot,
+# so that the cache directory can be moved around as a whole.
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    meta["path"] = os.path.join(os.path.dirname(meta_path), meta["file"])
+    if not os.path.exists(meta["path"]):
+        return None
+    return meta
+
+
+def _load_snapshot(meta):
+    path = meta["path"]
+    if meta["format"] == "feather":
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+# Write to a temporary file first and rename it afterwards,
+# so that a concurrent reader never sees a half written snapshot.
+def _replace_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _store_snapshot(df, url, headers, meta_path, data_path):
+    fmt = SNAPSHOT_FORMAT
+    if fmt == "feather":
+        try:
+            _replace_atomic(data_path, df.to_feather)
+        except Exception:
+            # e.g. object columns with mixed types that arrow can't convert
+            fmt = "pickle"
+            data_path = os.path.splitext(data_path)[0] + ".pickle"
+    if fmt == "pickle":
+        _replace_atomic(data_path, df.to_pickle)
+
+    meta = {
+        "url": url,
+        "file": os.path.basename(data_path),
+        "format": fmt,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "fetched": time.time(),
+    }
+
+    def write_meta(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    _replace_atomic(meta_path, write_meta)
+
+
+# Send a GET request for the URL.
+# With the validators of a snapshot the request is conditional,
+# and None is returned if the server answers 304 Not Modified.
+def _fetch(url, meta=None):
+    request = urllib.request.Request(url)
+    if meta is not None:
+        if meta.get("etag"):
+            request.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            request.add_header("If-Modified-Since", meta["last_modified"])
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            return response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta is not None:
+            return None
+        raise
+
+
+def read_csv_cached(url, revalidate=None, offline=None, cache_dir=None, **read_csv_kwargs):
+    # Read the CSV at `url` like `pd.read_csv(url, **read_csv_kwargs)`,
+    # using the local snapshot when there is one.
+    if revalidate is None:
+        revalidate = _env_flag("DVC_REVALIDATE")
+    if offline is None:
+        offline = _env_flag("DVC_OFFLINE")
+    cache_dir = cache_dir or CACHE_DIR
+
+    key = _cache_key(url, read_csv_kwargs)
+    meta_path, data_path = _paths(key, cache_dir)
+    meta = _read_meta(meta_path)
+
+    # Serve the snapshot without any network access
+    if meta is not None and (offline or not revalidate):
+        return _load_snapshot(meta)
+    if offline:
+        raise FileNotFoundError(f"No cached snapshot of {url} in {cache_dir} (offline mode)")
+
+    try:
+        fetched = _fetch(url, meta)
+    except (urllib.error.URLError, OSError):
+        # The server can't be reached, fall back to the snapshot if there is one
+        if meta is None:
+            raise
+        return _load_snapshot(meta)
+
+    # 304 Not Modified: the snapshot is still up to date
+    if fetched is None:
+        return _load_snapshot(meta)
+
+    body, headers = fetched
+    df = pd.read_csv(io.BytesIO(body), **read_csv_kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    _store_snapshot(df, url, headers, meta_path, data_path)
+    return df
+
+
+def clear_cache(cache_dir=None):
+    # Remove all snapshots, e.g. to force a fresh download on the next run.
+    # Subdirectories (e.g. the map tiles of ex04/tile_cache.py in `tiles/`) are kept.
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isdir(path):
+            os.remove(path)
@@ -0,0 +1,364 @@
+# ====================================================================
+# Helpers for the callbacks of Bokeh server apps
+
+# FrameScheduler: runs an animation callback at a target frame rate
+# without piling up frames when the server or the browser can't keep up.
+# Debounced, on_settled_change: coalesce the events of a widget or a plot,
+# so that a fast interaction costs one recompute per settled input.
+# BackgroundWork: computes the updates of the plots in a thread pool,
+# so that a slow update doesn't block the other sessions of the server process.
+# ====================================================================
+
+# `doc.add_periodic_callback` runs the callback at a fixed interval,
+# no matter how long the callback itself takes
+# or whether the browser has drawn the last frame yet.
+# When either takes longer than the interval, the updates queue up
+# (in the server or in the websocket) and the app lags further and further behind.
+# The FrameScheduler instead
+# - schedules the next frame only after the current one is computed
+#   (a timeout callback that reschedules itself), shortened by the compute time,
+# - sends a "ping" after every frame, which the browser acknowledges
+#   once it has drawn the frame, and measures this round-trip time,
+# - drops a frame while the previous one is not yet acknowledged,
+#   so that at most one frame is in flight,
+#   and computes the next frame as soon as the acknowledgement arrives, and
+# - reports the configured and the achieved frame rate.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/document.html#bokeh.document.Document.add_timeout_callback
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from bokeh.io import curdoc
+from bokeh.models import ColumnDataSource, CustomJS
+
+# The browser acknowledges the ping after the next animation frame,
+# i.e. after the changes of the frame have been drawn.
+_ACK_CODE = """
+const [kind, seq] = probe.tags
+if (kind !== 'ping')
+    return
+requestAnimationFrame(() => requestAnimationFrame(() => { probe.tags = ['ack', seq] }))
+"""
+
+
+def _ewma(old, new, alpha=0.2):
+    return new if old is None else (1 - alpha) * old + alpha * new
+
+
+class FrameScheduler:
+    # `callback()` is called about every `interval_ms` milliseconds between `start` and `stop`.
+    # `on_stats(stats)` (optional) is called after every frame with the dict of `stats()`.
+    # A frame that is not acknowledged within `ack_timeout_ms`
+    # (e.g. the browser tab is in the background) no longer holds back the next ones.
+
+    def __init__(self, doc, callback, interval_ms=1000, on_stats=None, ack_timeout_ms=5000):
+        self.doc = doc
+        self.callback = callback
+        self.interval_ms = interval_ms
+        self.on_stats = on_stats
+        self.ack_timeout_ms = ack_timeout_ms
+
+        # a model that only carries the ping and the acknowledgement in its tags
+        self.probe = ColumnDataSource(tags=["ack", 0])
+        self.probe.js_on_change("tags", CustomJS(args=dict(probe=self.probe), code=_ACK_CODE))
+        self.probe.on_change("tags", self._on_ack)
+
+        self._timeout = None
+        self._deferred = False
+        self._seq = 0
+        self._acked = 0
+        self._sent_at = None
+        self._frame_times = deque(maxlen=20)
+        self.frames = 0
+        self.dropped = 0
+        self.compute_ms = None
+        self.rtt_ms = None
+
+    @property
+    def running(self):
+        return self._timeout is not None
+
+    def start(self):
+        if self.running:
+            return
+        if self.probe.document is None:
+            self.doc.add_root(self.probe)
+        self._frame_times.clear()
+        self._schedule(self.interval_ms)
+
+    def stop(self):
+        if not self.running:
+            return
+        try:
+            self.doc.remove_timeout_callback(self._timeout)
+        except ValueError:
+            # the callback has already run
+            pass
+        self._timeout = None
+
+    def _schedule(self, delay_ms):
+        self._deferred = False
+        self._timeout = self.doc.add_timeout_callback(self._tick, max(delay_ms, 1))
+
+    def _in_flight(self, now):
+        if self._acked == self._seq or self._sent_at is None:
+            return False
+        return (now - self._sent_at) * 1000 < self.ack_timeout_ms
+
+    def _tick(self):
+        start = time.perf_counter()
+        if self._in_flight(start):
+            # the browser hasn't drawn the last frame yet, skip this one,
+            # the acknowledgement (or the next interval) triggers the next frame
+            self.dropped += 1
+            self._schedule(self.interval_ms)
+            self._deferred = True
+            return
+
+        self.callback()
+        now = time.perf_counter()
+        self.compute_ms = _ewma(self.compute_ms, (now - start) * 1000)
+        self.frames += 1
+        self._frame_times.append(now)
+        self._seq += 1
+        self._sent_at = now
+        self.probe.tags = ["ping", self._seq]
+
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
+        # the time spent in the callback counts towards the interval
+        if self.running:
+            self._schedule(self.interval_ms - (time.perf_counter() - start) * 1000)
+
+    def _on_ack(self, attr, old, new):
+        if len(new) != 2 or new[0] != "ack" or new[1] != self._seq:
+            return
+        self._acked = new[1]
+        self.rtt_ms = _ewma(self.rtt_ms, (time.perf_counter() - self._sent_at) * 1000)
+        if self._deferred and self.running:
+            self.stop()
+            self._schedule(0)
+
+    def achieved_fps(self):
+        times = self._frame_times
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def stats(self):
+        return {
+            "configured_fps": 1000 / self.interval_ms,
+            "achieved_fps": self.achieved_fps(),
+            "compute_ms": self.compute_ms,
+            "rtt_ms": self.rtt_ms,
+            "frames": self.frames,
+            "dropped": self.dropped,
+        }
+
+
+def format_stats(stats):
+    # A short HTML summary of `FrameScheduler.stats()`, e.g. for a Div
+    def fmt(value, unit):
+        return "-" if value is None else f"{value:.1f} {unit}"
+
+    return (
+        f"Frame rate: {fmt(stats['achieved_fps'], 'fps')} "
+        f"(configured {fmt(stats['configured_fps'], 'fps')})<br>"
+        f"Compute: {fmt(stats['compute_ms'], 'ms')}, "
+        f"round trip: {fmt(stats['rtt_ms'], 'ms')}, "
+        f"dropped frames: {stats['dropped']}"
+    )
+
+
+# ====================================================================
+# Coalescing of callbacks
+# ====================================================================
+
+# Dragging a slider, scrolling through the options of a select,
+# drawing a lasso or panning a plot sends a burst of events,
+# and a plain `on_change` / `on_event` callback recomputes the plots for every one of them,
+# although only the last value is still on screen when the work is done.
+# - Widgets with a `value_throttled` property (sliders) report it
+#   only when the user releases the widget, so the callback is attached to it.
+# - For the others, the callback is wrapped in a `Debounced`:
+#   every event replaces the pending one (latest wins),
+#   and the callback runs once no new event has arrived for `delay_ms`.
+#   With `max_wait_ms`, a long continuous interaction (e.g. panning)
+#   still runs the callback at least that often.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/models/widgets/sliders.html#bokeh.models.Slider.value_throttled
+
+DEBOUNCE_MS = 150
+
+
+class Debounced:
+    # The coalesced `callback` of a document:
+    # `Debounced(doc, callback).change` is attached with `on_change` (callback(attr, old, new)),
+    # `Debounced(doc, callback).event` with `on_event` (callback(event)).
+    # For `change`, `old` is the value before the first of the coalesced changes,
+    # so that the callback sees the change from what is on screen to the latest value.
+
+    def __init__(self, doc, callback, delay_ms=DEBOUNCE_MS, max_wait_ms=None):
+        self.doc = doc
+        self.callback = callback
+        self.delay_ms = delay_ms
+        self.max_wait_ms = max_wait_ms
+        self._pending = None
+        self._timeout = None
+        self._first_at = None
+        self._due = None
+        self.events = 0
+        self.calls = 0
+
+    def change(self, attr, old, new):
+        if self._pending is not None:
+            old = self._pending[1]
+        self._push((attr, old, new))
+
+    def event(self, event):
+        self._push((event,))
+
+    def _push(self, args):
+        now = time.perf_counter()
+        self.events += 1
+        if self._pending is None:
+            self._first_at = now
+        self._pending = args
+        self._due = now + self.delay_ms / 1000
+        if self.max_wait_ms is not None:
+            self._due = min(self._due, self._first_at + self.max_wait_ms / 1000)
+        # a single timeout is kept, it is moved forward when it fires too early
+        if self._timeout is None:
+            self._timeout = self.doc.add_timeout_callback(self._fire, self.delay_ms)
+
+    @property
+    def pending(self):
+        return self._pending is not None
+
+    def _fire(self):
+        self._timeout = None
+        if self._pending is None:
+            return
+        wait_ms = (self._due - time.perf_counter()) * 1000
+        if wait_ms > 1:
+            self._timeout = self.doc.add_timeout_callback(self._fire, wait_ms)
+            return
+        self.flush()
+
+    def flush(self):
+        # Run the callback with the pending arguments now (e.g. before another change depends on them)
+        args, self._pending = self._pending, None
+        if args is None:
+            return
+        self.calls += 1
+        self.callback(*args)
+
+    def cancel(self):
+        # Drop the pending arguments, the timeout then runs without effect
+        self._pending = None
+
+
+def on_settled_change(widget, callback, doc=None, delay_ms=DEBOUNCE_MS):
+    # Attach `callback(attr, old, new)` to the value of `widget`,
+    # called once per settled value instead of once per intermediate value.
+    # Returns the Debounced wrapper, or None if the widget throttles itself.
+    if "value_throttled" in widget.properties():
+        widget.on_change("value_throttled", callback)
+        return None
+    debounced = Debounced(doc or curdoc(), callback, delay_ms)
+    widget.on_change("value", debounced.change)
+    return debounced
+
+
+# ====================================================================
+# Background work
+# ====================================================================
+
+# All the sessions of a server process share one event loop (Tornado),
+# and a callback holds the lock of its document while it runs.
+# A callback that recomputes the data of a plot for a second
+# blocks every other session of the process for that second.
+# BackgroundWork splits an update into
+# - `compute()`, which only works on data (numpy, pandas) and creates no Bokeh models,
+#   and runs in a thread pool shared by all the sessions of the process, and
+# - `apply(result)`, which changes the models of the document,
+#   and runs on the event loop with the lock of the document,
+#   scheduled with `add_next_tick_callback` (which may be called from any thread).
+# Each update has a key (e.g. the plot it changes) with a generation counter:
+# a result is only applied if no newer update of the same key has been submitted since,
+# so a slow result of an old selection never overwrites the result of a newer one.
+# Threads are used rather than processes, because the data (shared frames, indexes,
+# caches) lives in the server process, and numpy releases the GIL in its loops.
+# Environment variable:
+# - DVC_WORKERS: the number of threads of the pool (the number of CPUs, at most 8)
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/server/app.html#updating-from-threads
+# https://docs.bokeh.org/en/3.1.0/docs/reference/document.html#bokeh.document.Document.add_next_tick_callback
+
+WORKERS = int(os.environ.get("DVC_WORKERS", min(8, os.cpu_count() or 1)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # The thread pool of the process, created on the first use
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="dvc-work")
+    return _executor
+
+
+class BackgroundWork:
+    # The background updates of one document (session).
+    # `submit(key, compute, apply)` must be called on the event loop, e.g. in a callback.
+
+    def __init__(self, doc, executor=None):
+        self.doc = doc
+        self.executor = executor
+        self._generation = {}
+        self._closed = False
+        self.applied = 0
+        self.discarded = 0
+        doc.on_session_destroyed(self._on_session_destroyed)
+
+    def submit(self, key, compute, apply):
+        generation = self._generation.get(key, 0) + 1
+        self._generation[key] = generation
+        future = (self.executor or get_executor()).submit(compute)
+        future.add_done_callback(partial(self._done, key, generation, apply))
+        return future
+
+    def cancel(self, *keys):
+        # Discard the results of the updates of `keys` that are still running,
+        # e.g. when the plot has been updated synchronously in the meantime
+        for key in keys:
+            self._generation[key] = self._generation.get(key, 0) + 1
+
+    def _current(self, key, generation):
+        return not self._closed and self._generation.get(key) == generation
+
+    def _done(self, key, generation, apply, future):
+        # in the worker thread (or on the loop if the future is already done)
+        if not self._current(key, generation):
+            self.discarded += 1
+            return
+        self.doc.add_next_tick_callback(partial(self._apply, key, generation, apply, future))
+
+    def _apply(self, key, generation, apply, future):
+        # a newer update may have been submitted while this one waited for the loop
+        if not self._current(key, generation):
+            self.discarded += 1
+            return
+        self.applied += 1
+        # an exception of `compute` is raised (and logged by the server) here
+        apply(future.result())
+
+    def _on_session_destroyed(self, session_context):
+        self._closed = True
@@ -0,0 +1,193 @@
+# ====================================================================
+# Shared memory data frames for multi-process Bokeh servers
+
+# With `bokeh serve --num-procs N` every worker process runs its own copy
+# of the apps, so every worker would hold its own copy of the data.
+# `shared_frame` publishes the numeric columns of a data frame once
+# into a block of shared memory, and every worker maps this block
+# as a NumPy array without copying it.
+# ====================================================================
+
+# Sharing is switched on with the environment variable DVC_SHARED_MEMORY=1.
+# Without it `shared_frame` simply returns the frame built by `build`,
+# which is the right thing for a single server process.
+# reference:
+# https://docs.python.org/3/library/multiprocessing.shared_memory.html
+
+# Layout of a published frame with the key `key`:
+# - "<name>_data": the values as float64, one row per column of the frame
+#   (so that every column is a contiguous array)
+# - "<name>_meta": the column names and the shape as JSON.
+#   It is written last and marks the data block as complete.
+# - "<name>_lock": an empty block that the publishing process creates
+#   to tell the other processes that the frame is being built.
+
+import atexit
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+WAIT_TIMEOUT = 300  # seconds to wait for another process to publish a frame
+POLL_INTERVAL = 0.1
+
+# The SharedMemory objects have to stay alive as long as their arrays are used,
+# since closing them unmaps the memory.
+_segments = {}
+_created = []
+# The frame of each key, mapped once per process and shared by all its sessions
+# (attaching again to the segments created by this process would also drop
+# their registration with the resource tracker, see _attach)
+_frames = {}
+_frames_lock = threading.Lock()
+
+
+def enabled():
+    return os.environ.get("DVC_SHARED_MEMORY", "").lower() in ("1", "true", "yes")
+
+
+# Segment names are limited in length on some platforms (31 characters on macOS),
+# so they are derived from a hash of the key.
+def _segment_name(key, part):
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return f"dvc_{digest}_{part}"
+
+
+def _attach(name):
+    # Before Python 3.13, attaching to a segment also registers it with the
+    # resource tracker of this process, which would unlink the segment
+    # (for all the other workers too) as soon as this worker exits.
+    try:
+        segment = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(segment._name, "shared_memory")
+        except Exception:
+            pass
+    _segments[name] = segment
+    return segment
+
+
+def _create(name, size):
+    # The creating process owns the segment and unlinks it when it exits.
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    _segments[name] = segment
+    _created.append(segment)
+    return segment
+
+
+def _remove_created(key):
+    # Unlink the segments of `key` created by this process (e.g. after a failed build),
+    # so that another worker can publish the frame
+    for part in ("data", "meta", "lock"):
+        segment = _segments.pop(_segment_name(key, part), None)
+        if segment is None or not any(segment is s for s in _created):
+            continue
+        _created[:] = [s for s in _created if s is not segment]
+        try:
+            segment.unlink()
+            segment.close()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+@atexit.register
+def _unlink_created():
+    # Remove the names of the segments published by this process.
+    # Workers that are still attached keep their mapping until they exit as well.
+    for segment in _created:
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _read_meta(segment):
+    (length,) = struct.unpack_from("<Q", segment.buf, 0)
+    return json.loads(bytes(segment.buf[8 : 8 + length]).decode("utf-8"))
+
+
+def _frame_from_segments(data, meta):
+    n_cols, n_rows = meta["shape"]
+    values = np.ndarray((n_cols, n_rows), dtype=np.float64, buffer=data.buf)
+    # The workers only read the shared values
+    values.flags.writeable = False
+    # The transpose is a view, and pandas keeps the 2D array as the block of the frame,
+    # so every column of the frame is a view into the shared memory
+    return pd.DataFrame(values.T, columns=meta["columns"], copy=False)
+
+
+def _publish(key, df):
+    columns = [str(c) for c in df.columns]
+    values = np.ascontiguousarray(df.to_numpy(dtype=np.float64).T)
+
+    data = _create(_segment_name(key, "data"), values.nbytes)
+    np.ndarray(values.shape, dtype=np.float64, buffer=data.buf)[:] = values
+
+    payload = json.dumps({"columns": columns, "shape": list(values.shape)}).encode("utf-8")
+    meta = _create(_segment_name(key, "meta"), 8 + len(payload))
+    meta.buf[8 : 8 + len(payload)] = payload
+    # the length is written last, a reader that sees it also sees the payload
+    struct.pack_into("<Q", meta.buf, 0, len(payload))
+    return data, meta
+
+
+def _try_attach(key):
+    try:
+        meta = _attach(_segment_name(key, "meta"))
+    except (FileNotFoundError, ValueError):
+        # ValueError: the block exists but has no size yet (it can't be mapped)
+        return None
+    # the block may exist but not be filled in yet
+    if struct.unpack_from("<Q", meta.buf, 0)[0] == 0:
+        return None
+    data = _attach(_segment_name(key, "data"))
+    return _frame_from_segments(data, _read_meta(meta))
+
+
+def shared_frame(key, build):
+    # Return the frame published under `key`, as float64 columns in shared memory.
+    # `build()` is only called by the first process that asks for the key,
+    # the other processes wait for it and map the published frame.
+    # The frame returned by `build` must only have numeric columns.
+    if not enabled():
+        return build()
+
+    with _frames_lock:
+        if key not in _frames:
+            _frames[key] = _shared_frame(key, build)
+        return _frames[key]
+
+
+def _shared_frame(key, build):
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        frame = _try_attach(key)
+        if frame is not None:
+            return frame
+        try:
+            _create(_segment_name(key, "lock"), 1)
+            break
+        except FileExistsError:
+            # Another worker is building the frame, wait until it is published
+            # (or until it fails and removes the lock, then this process builds it)
+            if time.monotonic() >= deadline:
+                # The other worker didn't finish (e.g. it crashed), don't share the frame
+                return build()
+            time.sleep(POLL_INTERVAL)
+
+    try:
+        df = build()
+        data, meta = _publish(key, df)
+    except BaseException:
+        # don't keep the other workers waiting for a frame that never comes
+        _remove_created(key)
+        raise
+    return _frame_from_segments(data, _read_meta(meta))
@@ -3,6 +3,9 @@
 
 """
 
+import os
+import sys
+
 import pandas as pd
 from bokeh.plotting import figure
 from bokeh.io import output_file, save, show, output_notebook
@@ -11,8 +14,13 @@ from bokeh.layouts import gridplot
 from bokeh.transform import factor_cmap
 from bokeh.models.annotations import Label
 from bokeh.palettes import Blues
+
+# The shared helpers (e.g. dvc_data) live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_data import read_csv_cached
+
 url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQdNgN-88U31tk1yQytaJdmoLrxuFn1LnbwTubwCd8se2aHh8656xLLHzxHSoiaXMUu8rIcu6gMj5Oq/pub?gid=1242961990&single=true&output=csv"
-MAGMA_financials = pd.read_csv(url)
+MAGMA_financials = read_csv_cached(url)
 
 subset = ["Net Income", "Revenue", "Cost of Revenue"]
 
@@ -2,6 +2,9 @@
 """DVC_ex02.ipynb
 """
 
+import os
+import sys
+
 import pandas as pd
 from bokeh.plotting import figure
 from bokeh.io import output_file, save, show, output_notebook
@@ -17,19 +20,64 @@ from bokeh.models import (
     RangeTool,
 )
 
+# The shared helpers (e.g. dvc_data) live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_data import read_csv_cached
+
 # Task 1: Prepare the Data
 stock_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTiM1scE44za7xyuheW_FrUkdSdOKipDgDOWa_03ixmJCWK_ReSqhjzax66nNHyDKARXWIXgFI_EW9X/pub?gid=1661368486&single=true&output=csv"
-stock = pd.read_csv(stock_url)
+stock = read_csv_cached(stock_url)
 
 metrics_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRDaf4y17OWjQqxODuxA4q4hsvXRkSqN0na1KtTIpvOZUdc7xHbrkhcygFfDIyVQWI2UbC3YcKUbser/pub?gid=981872466&single=true&output=csv"
-metrics = pd.read_csv(metrics_url)
+metrics = read_csv_cached(metrics_url)
 
 ## 1.1: Convert the data type of time columns to datetime using to_datatime()
 stock["Date"] = pd.to_datetime(stock["Date"])
 metrics["Quarter Ended"] = pd.to_datetime(metrics["Quarter Ended"])
 
+## 1.2: Split the data by symbol
+
+# Group the data by 'Symbol' once,
+# instead of filtering the whole frame with a boolean mask for every chart
+stock_by_symbol = dict(tuple(stock.groupby("Symbol", sort=False)))
+metrics_by_symbol = dict(tuple(metrics.groupby("Symbol", sort=False)))
+
+
+## 2.0 Create the data source and the views of a candlestick chart
+
+# The views split the candlesticks into
+# 'inc' (the close price is higher than the open price) and
+# 'dec' (the close price is lower than the open price).
+# The masks are computed on whole columns at once
+# instead of iterating over the rows of the data frame.
+# https://docs.bokeh.org/en/latest/docs/user_guide/basic/data.html#filtering-data
+
+# The source only carries the columns used by the glyphs and the hover tool (2.3 - 2.6),
+# 'Symbol', 'Adj Close' and the index of the frame are not sent to the browser.
+CANDLESTICK_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume"]
+
+
+def create_candlestick_source(data_stock):
+    source = ColumnDataSource(data={col: data_stock[col].to_numpy() for col in CANDLESTICK_COLUMNS})
+    inc = (data_stock["Close"] > data_stock["Open"]).to_numpy()
+    dec = (data_stock["Close"] < data_stock["Open"]).to_numpy()
+    inc_view = CDSView(filter=BooleanFilter(inc))
+    dec_view = CDSView(filter=BooleanFilter(dec))
+    return source, inc_view, dec_view
+
+
+# Create the sources and views for many symbols (all symbols by default)
+# in one pass over the grouped data
+def create_candlestick_sources(symbols=None):
+    if symbols is None:
+        symbols = stock_by_symbol.keys()
+    return {symbol: create_candlestick_source(stock_by_symbol[symbol]) for symbol in symbols}
+
+
 # Define a function that create a candlestick chart for a company
-def create_candlestick_chart(symbol):
+# (the source and views can be passed in if they are already created,
+# see create_candlestick_sources)
+def create_candlestick_chart(symbol, source_views=None):
 
     ## 2.1 Create the data source and set the basic properties of the figure
 
@@ -37,8 +85,10 @@ def create_candlestick_chart(symbol):
     # The dataframe is not directly used as source here
     # because you'll use CDSView filter later
     # which works with ColumnDataSource
-    data_stock = stock[stock.Symbol == symbol]
-    source = ColumnDataSource(data_stock)
+    data_stock = stock_by_symbol[symbol]
+    if source_views is None:
+        source_views = create_candlestick_source(data_stock)
+    source, inc_view, dec_view = source_views
 
     p = figure(
         width=800,
@@ -74,22 +124,7 @@ def create_candlestick_chart(symbol):
 
     # 'inc' keeps the data where the close price is higher than the open price
     # 'dec' does the opposite of 'inc'
-    # https://docs.bokeh.org/en/latest/docs/user_guide/basic/data.html#filtering-data
-    inc_bf = BooleanFilter(
-        [True if row["Close"] > row["Open"] else False for _, row in data_stock.iterrows()]
-    )
-    dec_bf = BooleanFilter(
-        [True if row["Close"] < row["Open"] else False for _, row in data_stock.iterrows()]
-    )
-    inc_view = CDSView(filter=inc_bf)
-    dec_view = CDSView(filter=dec_bf)
-
-    # Deprecated
-    # inc = source.data["Close"] > source.data["Open"]
-    # dec = source.data["Close"] < source.data["Open"]
-    #
-    # inc_view = CDSView(source=source, filters=[BooleanFilter(inc)])
-    # dec_view = CDSView(source=source, filters=[BooleanFilter(dec)])
+    # The views are created with the source in create_candlestick_source (2.0)
 
     ## 2.4: Draw the glyphs in the candlesticks
 
@@ -187,8 +222,20 @@ def create_candlestick_chart(symbol):
     return p
 
 
+# Build the candlestick charts of many symbols (all symbols by default).
+# The data is grouped by symbol only once (1.2), so building the charts
+# of hundreds of symbols is dominated by creating the Bokeh models.
+def create_candlestick_charts(symbols=None):
+    sources = create_candlestick_sources(symbols)
+    return {symbol: create_candlestick_chart(symbol, sources[symbol]) for symbol in sources}
+
+
 # Task 3: Add Metrics Plot to the Candlestick Chart
 
+# Like the candlestick source (2.0), the source of the metrics
+# only carries the columns used by the glyphs below (3.2).
+METRICS_COLUMNS = ["Quarter Ended", "PE Ratio", "EPS Growth"]
+
 
 def add_metrics_plot(main_plot):
 
@@ -198,8 +245,9 @@ def add_metrics_plot(main_plot):
     # See how bokeh deals with data source containing nan values
     # https://docs.bokeh.org/en/latest/docs/user_guide/basic/lines.html#missing-points
     # Note that this might not work if the source is created from ColumnDataSource
-    data_metrics = metrics[metrics.Symbol == symbol]
-    source = ColumnDataSource(data_metrics)
+    # (an empty frame for a symbol without metrics, like the mask `metrics.Symbol == symbol`)
+    data_metrics = metrics_by_symbol.get(symbol, metrics.iloc[:0])
+    source = ColumnDataSource(data={col: data_metrics[col].to_numpy() for col in METRICS_COLUMNS})
 
     ## 3.1: Set the y axes for the metrics
 
@@ -0,0 +1,166 @@
+# ====================================================================
+# Goal: Live candlestick charts with Bokeh server
+
+# Ticks from a feed (see tick_feed.py) are aggregated into bars
+# of BAR_SECONDS seconds. On every update of the chart
+# - the bar that is still in progress is updated with ColumnDataSource.patch,
+# - the bars that were started since the last update are appended
+#   with ColumnDataSource.stream, which drops the oldest bars
+#   beyond ROLLOVER (a bounded rolling buffer).
+# Only the changed and the new bars are sent to the browser,
+# and the ticks are coalesced per symbol in every update,
+# so the cost doesn't grow with the number of ticks per second.
+# ====================================================================
+
+# To see the app, run this script in the terminal with the command:
+#   bokeh serve --show dvc_ex2_live.py
+# By default the app connects to a stand-in tick server started in the same process.
+# Other feeds are chosen with the environment variable DVC_TICK_FEED, e.g.
+#   DVC_TICK_FEED=file:ticks.csv bokeh serve --show dvc_ex2_live.py
+#   DVC_TICK_FEED=tcp:127.0.0.1:9000 bokeh serve --show dvc_ex2_live.py
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/basic/data.html#streaming-data
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/basic/data.html#patching-data
+
+import os
+from collections import defaultdict
+
+from bokeh.io import curdoc
+from bokeh.layouts import column
+from bokeh.models import (
+    ColumnDataSource,
+    DataRange1d,
+    HoverTool,
+    LinearAxis,
+    NumeralTickFormatter,
+)
+from bokeh.plotting import figure
+
+from live_bars import ROLLOVER, LiveBars
+from ohlc import BAR_WIDTH
+from tick_feed import DEFAULT_SYMBOLS, open_feed
+
+symbols = os.environ.get("DVC_TICK_SYMBOLS", ",".join(DEFAULT_SYMBOLS)).split(",")
+
+BAR_SECONDS = 5
+# the period of the updates in milliseconds
+UPDATE_MS = 100
+
+COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume", "color"]
+
+
+# Define a function that creates a live candlestick chart for a company.
+# Like the chart of create_candlestick_chart in dvc_ex2.py,
+# but the source starts empty and the candles are colored by a 'color' column,
+# since the filters of a CDSView are not updated by stream and patch.
+# Returns the figure and the LiveBars that update its source.
+
+
+def create_live_candlestick_chart(symbol, bar_seconds=BAR_SECONDS, rollover=ROLLOVER, width=800, height=300):
+    bar_ms = bar_seconds * 1000
+    source = ColumnDataSource({col: [] for col in COLUMNS})
+
+    p = figure(
+        width=width,
+        height=height,
+        title=symbol,
+        # show the latest `rollover` bars
+        x_range=DataRange1d(follow="end", follow_interval=rollover * bar_ms, range_padding=0.02),
+        y_range=DataRange1d(),
+        x_axis_type="datetime",
+        x_axis_location="above",
+        background_fill_color="#fbfbfb",
+        tools="pan,wheel_zoom,box_zoom,reset, save",
+        toolbar_location="right",
+    )
+
+    p.xgrid.grid_line_color = "#e5e5e5"
+    p.ygrid.grid_line_alpha = 0.5
+    p.xaxis.major_label_text_font_size = "10px"
+    p.yaxis.axis_label = "Stock Price in USD"
+    p.yaxis.formatter = NumeralTickFormatter(format="(0.00a)")
+
+    wicks = p.segment(
+        x0="Date", x1="Date", y0="High", y1="Low", width=2, color="black", source=source
+    )
+    candles = p.vbar(
+        x="Date",
+        width=BAR_WIDTH * bar_ms,
+        top="Open",
+        bottom="Close",
+        fill_color="color",
+        line_color="color",
+        name="price",
+        source=source,
+    )
+    # the price range ignores the volume bars
+    p.y_range.renderers = [wicks, candles]
+
+    p.extra_y_ranges["volume"] = DataRange1d(start=0)
+    p.add_layout(
+        LinearAxis(
+            y_range_name="volume",
+            axis_label="Volume",
+            formatter=NumeralTickFormatter(format="0.0a"),
+        ),
+        "right",
+    )
+    volume = p.vbar(
+        source=source,
+        x="Date",
+        y_range_name="volume",
+        top="Volume",
+        width=BAR_WIDTH * bar_ms,
+        alpha=0.2,
+        line_color="grey",
+    )
+    p.extra_y_ranges["volume"].renderers = [volume]
+
+    hover_stock = HoverTool()
+    hover_stock.tooltips = [
+        ("Date", "@Date{%H:%M:%S}"),
+        ("Open", "@Open{($0.00)}"),
+        ("Close", "@Close{($0.00)}"),
+        ("High", "@High{($0.00)}"),
+        ("Low", "@Low{($0.00)}"),
+        ("Volume", "@Volume{($0.00a)}"),
+    ]
+    hover_stock.formatters = {
+        "@Date": "datetime",
+    }
+    hover_stock.renderers = [candles]
+    p.add_tools(hover_stock)
+
+    return p, LiveBars(source, bar_ms, rollover)
+
+
+# Group the drained ticks by symbol and update the bars of each symbol once
+def apply_ticks(ticks, bars_by_symbol):
+    by_symbol = defaultdict(list)
+    for tick in ticks:
+        if tick[0] in bars_by_symbol:
+            by_symbol[tick[0]].append(tick[1:])
+    for symbol, rows in by_symbol.items():
+        times, prices, sizes = zip(*rows)
+        bars_by_symbol[symbol].update(times, prices, sizes)
+
+
+charts = {symbol: create_live_candlestick_chart(symbol) for symbol in symbols}
+bars_by_symbol = {symbol: bars for symbol, (p, bars) in charts.items()}
+
+# every session reads its own feed, which is stopped when the session ends
+feed = open_feed(os.environ.get("DVC_TICK_FEED"))
+
+
+def update():
+    apply_ticks(feed.drain(), bars_by_symbol)
+
+
+def stop_feed(session_context):
+    feed.stop()
+
+
+curdoc().add_root(column([p for p, bars in charts.values()]))
+curdoc().add_periodic_callback(update, UPDATE_MS)
+curdoc().on_session_destroyed(stop_feed)
+curdoc().title = "Live Candlesticks"
@@ -0,0 +1,173 @@
+# ====================================================================
+# Goal: Level-of-detail candlestick chart with Bokeh server
+
+# The static chart in dvc_ex2.py ships every bar to the browser.
+# This app precomputes an OHLC pyramid (see ohlc.py) and,
+# whenever the visible date range changes,
+# swaps in the finest level that still fits the width of the plot,
+# restricted to the visible window (plus a margin for panning).
+# The price and volume axes are scaled to the bars in the visible window.
+# ====================================================================
+
+# To see the app, run this script in the terminal with the command:
+#   bokeh serve --show dvc_ex2_server.py
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/events.html#bokeh.events.RangesUpdate
+
+from bokeh.core.property.descriptors import UnsetValueError
+from bokeh.events import RangesUpdate
+from bokeh.io import curdoc
+from bokeh.models import (
+    ColumnDataSource,
+    HoverTool,
+    LinearAxis,
+    NumeralTickFormatter,
+    Range1d,
+)
+from bokeh.plotting import figure
+
+# the data is read and grouped by symbol in dvc_ex2.py
+from dvc_ex2 import add_metrics_plot, stock_by_symbol
+from dvc_server import Debounced
+from ohlc import get_pyramid, to_ms
+
+symbol = "AAPL"
+
+# the minimal width of a candle in pixels,
+# a level with more candles than fit into the plot is too fine
+MIN_CANDLE_PX = 4
+
+
+# The width of the plot area in pixels, as reported by the browser
+def plot_width(p):
+    try:
+        return p.inner_width or p.width
+    except UnsetValueError:
+        # not rendered yet
+        return p.width
+
+
+# Define a function that creates a candlestick chart
+# which shows a level of the OHLC pyramid of the symbol.
+# Unlike create_candlestick_chart in dvc_ex2.py,
+# the candles are colored by a 'color' column instead of two filtered views,
+# so that the data of the source can be swapped in a single update.
+
+
+def create_lod_candlestick_chart(symbol, width=800, height=400):
+
+    pyramid = get_pyramid(symbol, stock_by_symbol[symbol])
+    base = pyramid.levels[0]
+    start, end = float(base.dates_ms[0]), float(base.dates_ms[-1])
+    level = pyramid.level_for(start, end, width // MIN_CANDLE_PX)
+    data, covered = pyramid.window(level, start, end)
+    source = ColumnDataSource(data)
+    data_stock = base.df
+
+    p = figure(
+        width=width,
+        height=height,
+        title=symbol,
+        x_range=(data_stock["Date"].min(), data_stock["Date"].max()),
+        y_range=Range1d(data_stock.Low.min() * 0.9, data_stock.High.max() * 1.1),
+        x_axis_type="datetime",
+        x_axis_location="above",
+        background_fill_color="#fbfbfb",
+        tools="pan,wheel_zoom,box_zoom,reset, save",
+        toolbar_location="right",
+    )
+
+    p.xgrid.grid_line_color = "#e5e5e5"
+    p.ygrid.grid_line_alpha = 0.5
+    p.xaxis.major_label_text_font_size = "10px"
+    p.yaxis.axis_label = "Stock Price in USD"
+    p.yaxis.formatter = NumeralTickFormatter(format="(0.0a)")
+
+    p.segment(
+        x0="Date", x1="Date", y0="High", y1="Low", width=2, color="black", source=source
+    )
+    candles = p.vbar(
+        x="Date",
+        width=level.bar_width,
+        top="Open",
+        bottom="Close",
+        fill_color="color",
+        line_color="color",
+        name="price",
+        source=source,
+    )
+
+    y_volume = data_stock.Volume
+    p.extra_y_ranges["volume"] = Range1d(start=y_volume.min() * 0.9, end=y_volume.max() * 1.1)
+    p.add_layout(
+        LinearAxis(
+            y_range_name="volume",
+            axis_label="Volume",
+            formatter=NumeralTickFormatter(format="0.0a"),
+        ),
+        "right",
+    )
+    p.vbar(
+        source=source,
+        x="Date",
+        y_range_name="volume",
+        top="Volume",
+        width=4,
+        alpha=0.2,
+        line_color="grey",
+    )
+
+    hover_stock = HoverTool()
+    hover_stock.tooltips = [
+        ("Date", "@Date{%Y-%m-%d}"),
+        ("Open", "@Open{($0.00)}"),
+        ("Close", "@Close{($0.00)}"),
+        ("High", "@High{($0.00)}"),
+        ("Low", "@Low{($0.00)}"),
+        ("Volume", "@Volume{($0.00a)}"),
+    ]
+    hover_stock.formatters = {
+        "@Date": "datetime",
+    }
+    hover_stock.renderers = [candles]
+    p.add_tools(hover_stock)
+
+    # The level and the dates covered by the data in the source,
+    # a range update inside the covered dates with the same level needs no new data
+    loaded = {"level": level, "covered": covered}
+
+    def update_level(event):
+        start, end = to_ms(event.x0), to_ms(event.x1)
+        level = pyramid.level_for(start, end, max(plot_width(p) // MIN_CANDLE_PX, 1))
+        autoscale(level, start, end)
+        lo, hi = loaded["covered"]
+        if level is loaded["level"] and lo <= start and end <= hi:
+            return
+        data, covered = pyramid.window(level, start, end)
+        source.data = data
+        candles.glyph.width = level.bar_width
+        loaded.update(level=level, covered=covered)
+
+    # Scale the price and volume axes to the bars between `start` and `end`,
+    # the min/max come from the sparse tables of the level (see ohlc.py)
+    # instead of a scan over the bars
+    def autoscale(level, start, end):
+        extent = level.extent(start, end)
+        if extent is None:
+            return
+        low, high, volume_min, volume_max = extent
+        p.y_range.update(start=low * 0.9, end=high * 1.1)
+        p.extra_y_ranges["volume"].update(start=volume_min * 0.9, end=volume_max * 1.1)
+
+    # the range updates of a pan or zoom are coalesced,
+    # a long pan still loads new bars twice a second
+    p.on_event(RangesUpdate, Debounced(curdoc(), update_level, max_wait_ms=500).event)
+
+    return p
+
+
+p = create_lod_candlestick_chart(symbol)
+p = add_metrics_plot(p)
+
+curdoc().add_root(p)
+curdoc().title = f"{symbol} Candlesticks"
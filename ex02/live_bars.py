@@ -0,0 +1,93 @@
+# ====================================================================
+# Bars of the live candlestick chart (dvc_ex2_live.py)
+
+# The ticks of a symbol are aggregated into bars of `bar_ms` milliseconds
+# in the data source of a chart:
+# - the bar that is still in progress is updated with ColumnDataSource.patch,
+# - the bars that were started since the last update are appended
+#   with ColumnDataSource.stream, which drops the oldest bars
+#   beyond `rollover` (a bounded rolling buffer).
+# ====================================================================
+
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/basic/data.html#streaming-data
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/basic/data.html#patching-data
+
+import numpy as np
+
+from ohlc import candle_colors
+
+# the number of bars kept in the browser per symbol
+ROLLOVER = 500
+
+
+# Aggregate the ticks of a symbol into the bars of a live chart.
+# The ticks of an update are aggregated with NumPy at once,
+# then merged into the bar that is in progress.
+
+
+class LiveBars:
+    def __init__(self, source, bar_ms, rollover=ROLLOVER):
+        self.source = source
+        self.bar_ms = bar_ms
+        self.rollover = rollover
+        # the bar in progress (the last row of the source) as a dict, None before the first tick
+        self.current = None
+        self.rows = 0
+
+    def update(self, times, prices, sizes):
+        times = np.asarray(times, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        sizes = np.asarray(sizes, dtype=np.float64)
+        order = np.argsort(times, kind="stable")
+        times, prices, sizes = times[order], prices[order], sizes[order]
+        keys = np.floor_divide(times, self.bar_ms)
+        if self.current is not None:
+            # late ticks of bars that are already closed are dropped
+            late = keys < self.current["key"]
+            if late.any():
+                keys, prices, sizes = keys[~late], prices[~late], sizes[~late]
+        if len(keys) == 0:
+            return
+
+        # one group of ticks per bar
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)] - 1
+        bars = {
+            "key": keys[starts],
+            "Open": prices[starts],
+            "High": np.maximum.reduceat(prices, starts),
+            "Low": np.minimum.reduceat(prices, starts),
+            "Close": prices[ends],
+            "Volume": np.add.reduceat(sizes, starts),
+        }
+
+        if self.current is not None and bars["key"][0] == self.current["key"]:
+            self._patch_current(bars)
+            bars = {col: values[1:] for col, values in bars.items()}
+        if len(bars["key"]):
+            self._stream(bars)
+
+    def _patch_current(self, bars):
+        current = self.current
+        current["High"] = max(current["High"], bars["High"][0])
+        current["Low"] = min(current["Low"], bars["Low"][0])
+        current["Close"] = bars["Close"][0]
+        current["Volume"] += bars["Volume"][0]
+        current["color"] = str(candle_colors(current["Open"], current["Close"]))
+        i = self.rows - 1
+        self.source.patch(
+            {col: [(i, current[col])] for col in ["High", "Low", "Close", "Volume", "color"]}
+        )
+
+    def _stream(self, bars):
+        new = {col: bars[col] for col in ["Open", "High", "Low", "Close", "Volume"]}
+        new["Date"] = bars["key"] * self.bar_ms
+        new["color"] = candle_colors(new["Open"], new["Close"])
+        self.source.stream(new, rollover=self.rollover)
+        self.rows = min(self.rows + len(bars["key"]), self.rollover)
+        self.current = {col: new[col][-1] for col in new}
+        self.current["key"] = bars["key"][-1]
+        for col in ["Open", "High", "Low", "Close", "Volume"]:
+            self.current[col] = float(self.current[col])
+        self.current["color"] = str(self.current["color"])
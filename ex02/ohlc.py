@@ -0,0 +1,171 @@
+# ====================================================================
+# OHLC pyramid for level-of-detail candlestick charts
+
+# The stock data of a symbol is resampled once into coarser bars
+# (e.g. week -> month -> quarter -> year).
+# When the chart is zoomed out, a coarser level is shown,
+# so that the number of candles sent to the browser
+# is bounded by the width of the chart, not by the length of the history.
+# Each level also keeps sparse tables over Low, High and Volume,
+# which answer the min/max of any window of bars in constant time
+# for auto-scaling the y axes to the visible dates.
+# ====================================================================
+
+# Resampling OHLC data:
+# Open is the first open, High the highest high, Low the lowest low,
+# Close the last close, and Volume the total volume of the bars in a period.
+# reference:
+# https://pandas.pydata.org/docs/reference/api/pandas.core.resample.Resampler.ohlc.html
+# https://pandas.pydata.org/docs/user_guide/timeseries.html#offset-aliases
+
+import numpy as np
+import pandas as pd
+
+# The candidate levels, from fine to coarse: (name, pandas rule, approximate length in days).
+# The periods are labelled by their first day.
+LEVELS = [
+    ("day", "D", 1),
+    ("week", "W-MON", 7),
+    ("month", "MS", 30.44),
+    ("quarter", "QS", 91.31),
+    ("year", "YS", 365.25),
+]
+MS_PER_DAY = 24 * 60 * 60 * 1000
+# the width of a candle as a fraction of its period
+BAR_WIDTH = 0.9
+
+
+def resample_ohlc(df, rule):
+    ohlc = (
+        df.set_index("Date")
+        .resample(rule, label="left", closed="left")
+        .agg({"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"})
+        .dropna(subset=["Open"])
+    )
+    return ohlc.reset_index()
+
+
+def to_ms(value):
+    # Bokeh sends the ranges of a datetime axis as milliseconds since epoch,
+    # but they may also be set from Python as datetimes
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return pd.Timestamp(value).value / 1e6
+
+
+# A sparse table answers range minimum (or maximum) queries in O(1)
+# after O(n log n) preprocessing:
+# table[j][i] is the min of values[i : i + 2**j],
+# and any range [lo, hi) is covered by two (overlapping) ranges of length 2**j.
+# np.fmin / np.fmax ignore missing values.
+# reference:
+# https://cp-algorithms.com/data_structures/sparse-table.html
+
+
+class SparseTable:
+    def __init__(self, values, op=np.fmin):
+        self.op = op
+        self.table = [np.asarray(values, dtype=np.float64)]
+        k = 1
+        while 2 * k <= len(self.table[0]):
+            prev = self.table[-1]
+            self.table.append(op(prev[:-k], prev[k:]))
+            k *= 2
+
+    def query(self, lo, hi):
+        # the min (or max) of values[lo:hi], nan for an empty range
+        if hi <= lo:
+            return np.nan
+        lo, hi = int(lo), int(hi)
+        j = (hi - lo).bit_length() - 1
+        t = self.table[j]
+        return self.op(t[lo], t[hi - (1 << j)])
+
+
+# inc candles are green, dec candles are red
+def candle_colors(open_, close):
+    return np.select([close > open_, close < open_], ["green", "red"], "black")
+
+
+class Level:
+    def __init__(self, name, df, period_days):
+        self.name = name
+        self.df = df.reset_index(drop=True)
+        self.dates_ms = self.df["Date"].to_numpy("datetime64[ms]").astype(np.int64)
+        self.bar_width = BAR_WIDTH * period_days * MS_PER_DAY
+        self.low_min = SparseTable(self.df["Low"], np.fmin)
+        self.high_max = SparseTable(self.df["High"], np.fmax)
+        self.volume_min = SparseTable(self.df["Volume"], np.fmin)
+        self.volume_max = SparseTable(self.df["Volume"], np.fmax)
+
+    def __len__(self):
+        return len(self.df)
+
+    def count(self, start, end):
+        # the number of bars between `start` and `end` (ms)
+        lo, hi = self.rows(start, end)
+        return hi - lo
+
+    def rows(self, start, end):
+        # the row indices of the bars between `start` and `end` (ms)
+        lo = np.searchsorted(self.dates_ms, start)
+        hi = np.searchsorted(self.dates_ms, end, side="right")
+        return int(lo), int(hi)
+
+    def extent(self, start, end):
+        # (min Low, max High, min Volume, max Volume) of the bars between `start` and `end` (ms),
+        # None if there are no bars
+        lo, hi = self.rows(start, end)
+        if hi <= lo:
+            return None
+        return (
+            self.low_min.query(lo, hi),
+            self.high_max.query(lo, hi),
+            self.volume_min.query(lo, hi),
+            self.volume_max.query(lo, hi),
+        )
+
+
+class OHLCPyramid:
+    def __init__(self, df, levels=LEVELS):
+        df = df.sort_values("Date")
+        # the finest level is the data itself,
+        # its period is estimated from the spacing of the dates
+        dates_ms = df["Date"].to_numpy("datetime64[ms]").astype(np.int64)
+        spacing = np.median(np.diff(dates_ms)) if len(df) > 1 else MS_PER_DAY
+        base_days = max(spacing / MS_PER_DAY, 1)
+        base_name = min(levels, key=lambda level: abs(level[2] - base_days))[0]
+        self.levels = [Level(base_name, df[["Date", "Open", "High", "Low", "Close", "Volume"]], base_days)]
+        # only the levels that are coarser than the data are useful
+        for name, rule, days in levels:
+            if days > 1.5 * base_days:
+                self.levels.append(Level(name, resample_ohlc(df, rule), days))
+
+    def level_for(self, start, end, max_candles):
+        # The finest level that shows at most `max_candles` candles between `start` and `end`
+        for level in self.levels:
+            if level.count(start, end) <= max_candles:
+                return level
+        return self.levels[-1]
+
+    def window(self, level, start, end, margin=1.0):
+        # The bars of `level` between `start` and `end`, with a margin of
+        # `margin` times the width of the window on each side,
+        # so that small pans don't need new data.
+        # Returns the data for a ColumnDataSource and the covered (start, end).
+        pad = margin * (end - start)
+        lo, hi = level.rows(start - pad, end + pad)
+        data = {col: level.df[col].to_numpy()[lo:hi] for col in level.df.columns}
+        data["color"] = candle_colors(data["Open"], data["Close"])
+        return data, (start - pad, end + pad)
+
+
+# The pyramids don't change, so they are computed once per server process
+# and shared by all the sessions (this module outlives the sessions)
+_pyramids = {}
+
+
+def get_pyramid(key, df):
+    if key not in _pyramids:
+        _pyramids[key] = OHLCPyramid(df)
+    return _pyramids[key]
@@ -0,0 +1,283 @@
+# ====================================================================
+# Tick feeds for the live candlestick chart (dvc_ex2_live.py)
+
+# A feed reads trades ("ticks") in a background thread
+# and puts them into a queue, which the Bokeh app drains
+# in a periodic callback, so reading never blocks the document.
+# A tick is a line of text:
+#   SYMBOL,TIME,PRICE,SIZE
+# with TIME in milliseconds since epoch, e.g.
+#   AAPL,1680000000000,164.25,100
+# ====================================================================
+
+# Available feeds:
+# - FileTailFeed: follows a file that another process appends ticks to
+#   (like `tail -f`)
+# - SocketFeed: reads ticks from a TCP connection
+# - TickServer: a local stand-in for a market data server,
+#   which sends random-walk ticks to every client (for tests and demos).
+#   Run it on its own with:
+#     python tick_feed.py --port 9000 --rate 500
+# reference:
+# https://docs.python.org/3/library/socketserver.html
+
+import argparse
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+POLL_INTERVAL = 0.05  # seconds between reads of a file that has no new ticks
+RECONNECT_INTERVAL = 1.0
+
+log = logging.getLogger(__name__)
+
+
+def parse_tick(line):
+    # (symbol, time in ms, price, size), None for a malformed line
+    parts = line.strip().split(",")
+    if len(parts) != 4:
+        return None
+    try:
+        return parts[0], float(parts[1]), float(parts[2]), float(parts[3])
+    except ValueError:
+        return None
+
+
+def format_tick(symbol, time_ms, price, size):
+    return f"{symbol},{time_ms:.0f},{price:.4f},{size:.0f}\n"
+
+
+class Feed(ABC):
+    # The base class of the feeds, subclasses implement `_run`,
+    # which reads lines until `self._stop` is set and passes them to `_put_line`
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def drain(self, max_ticks=100_000):
+        # All the ticks received since the last call (at most `max_ticks`)
+        ticks = []
+        try:
+            while len(ticks) < max_ticks:
+                ticks.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return ticks
+
+    def _put_line(self, line):
+        tick = parse_tick(line)
+        if tick is not None:
+            self.queue.put(tick)
+
+    def _put_lines(self, buffer):
+        # Put the complete lines of `buffer`, return the incomplete rest
+        *lines, rest = buffer.split("\n")
+        for line in lines:
+            self._put_line(line)
+        return rest
+
+    @abstractmethod
+    def _run(self):
+        pass
+
+
+class FileTailFeed(Feed):
+    # Follow `path` from its end (or from its start with `from_start=True`).
+    # A file that is missing or can't be read is opened again every RECONNECT_INTERVAL
+    # (like SocketFeed reconnects): a file created later is read from its start,
+    # a file that was already read is read on from the last position.
+    # A file that is truncated (e.g. by `> ticks.csv`) is read again from its start,
+    # and a file that is replaced (e.g. rotated) is opened again and read from its start.
+
+    def __init__(self, path, from_start=False):
+        super().__init__()
+        self.path = path
+        self.from_start = from_start
+        self._position = None
+        self._failing = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._follow()
+            except OSError as e:
+                # only the first failure of a run of failures is logged
+                if not self._failing:
+                    log.warning("can't read ticks from %s (%s), retrying", self.path, e)
+                self._failing = True
+                if self._position is None:
+                    self._position = 0
+                self._stop.wait(RECONNECT_INTERVAL)
+
+    def _follow(self):
+        with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+            self._failing = False
+            inode = os.fstat(f.fileno()).st_ino
+            if self._position is not None:
+                # start over if the file was truncated or replaced by a shorter one
+                size = f.seek(0, 2)
+                f.seek(self._position if self._position <= size else 0)
+            elif not self.from_start:
+                f.seek(0, 2)
+            self._position = f.tell()
+            buffer = ""
+            while not self._stop.is_set():
+                chunk = f.read()
+                if chunk:
+                    buffer = self._put_lines(buffer + chunk)
+                    # (the position of the complete lines, the rest is read again)
+                    self._position = f.tell() - len(buffer.encode("utf-8"))
+                    continue
+                stat = os.stat(self.path)
+                if stat.st_ino != inode:
+                    # another file at the path, the next one is read from its start
+                    self._position = 0
+                    return
+                if stat.st_size < f.tell():
+                    # truncated while it is open
+                    f.seek(0)
+                    self._position = 0
+                    buffer = ""
+                    continue
+                self._stop.wait(POLL_INTERVAL)
+
+
+class SocketFeed(Feed):
+    # Read ticks from a TCP server, reconnecting when the connection drops
+
+    def __init__(self, host, port):
+        super().__init__()
+        self.address = (host, int(port))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with socket.create_connection(self.address, timeout=RECONNECT_INTERVAL) as conn:
+                    # a timeout lets the thread notice `stop` while no ticks arrive
+                    conn.settimeout(0.5)
+                    self._read(conn)
+            except OSError:
+                self._stop.wait(RECONNECT_INTERVAL)
+
+    def _read(self, conn):
+        buffer = ""
+        while not self._stop.is_set():
+            try:
+                chunk = conn.recv(65536)
+            except socket.timeout:
+                continue
+            if not chunk:
+                return
+            buffer = self._put_lines(buffer + chunk.decode("utf-8"))
+
+
+# ====================================================================
+# Stand-in tick server
+# ====================================================================
+
+DEFAULT_SYMBOLS = ["AAPL", "MSFT", "GOOGL", "AMZN"]
+
+
+class _TickHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        rng = np.random.default_rng()
+        symbols = np.array(server.symbols)
+        prices = np.full(len(symbols), 100.0)
+        # the ticks are sent in batches of about 10 ms
+        interval = 0.01
+        per_batch = max(int(server.rate * interval), 1)
+        while not server.stopped.is_set():
+            which = rng.integers(0, len(symbols), per_batch)
+            steps = rng.normal(0, 0.05, per_batch)
+            now = time.time() * 1000
+            lines = []
+            for i, step in zip(which, steps):
+                prices[i] = max(prices[i] + step, 0.01)
+                lines.append(format_tick(symbols[i], now, prices[i], rng.integers(1, 50) * 10))
+            try:
+                self.request.sendall("".join(lines).encode("utf-8"))
+            except OSError:
+                return
+            server.stopped.wait(interval)
+
+
+class TickServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, symbols=DEFAULT_SYMBOLS, rate=500):
+        # `rate` is the number of ticks per second (over all the symbols) sent to each client,
+        # port 0 picks a free port, see `self.server_address`
+        self.symbols = list(symbols)
+        self.rate = rate
+        self.stopped = threading.Event()
+        super().__init__((host, port), _TickHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="TickServer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
+# One stand-in server per process, shared by all the sessions
+_standin = None
+_standin_lock = threading.Lock()
+
+
+def get_standin_server(**kwargs):
+    global _standin
+    with _standin_lock:
+        if _standin is None:
+            _standin = TickServer(**kwargs).start()
+    return _standin
+
+
+def open_feed(spec=None):
+    # Create and start a feed from a spec:
+    # - "file:PATH" follows a file of ticks,
+    # - "tcp:HOST:PORT" connects to a tick server,
+    # - None (or "") connects to the stand-in server of this process
+    if not spec:
+        host, port = get_standin_server().server_address
+        return SocketFeed(host, port).start()
+    kind, _, rest = spec.partition(":")
+    if kind == "file":
+        return FileTailFeed(rest).start()
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return SocketFeed(host or "127.0.0.1", port).start()
+    raise ValueError(f"unknown tick feed {spec!r}, expected 'file:PATH' or 'tcp:HOST:PORT'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve random-walk ticks over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--rate", type=int, default=500, help="ticks per second")
+    parser.add_argument("--symbols", nargs="+", default=DEFAULT_SYMBOLS)
+    args = parser.parse_args()
+    server = TickServer(args.host, args.port, args.symbols, args.rate)
+    print(f"serving ticks on {args.host}:{args.port}")
+    server.serve_forever()
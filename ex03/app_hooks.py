@@ -0,0 +1,13 @@
+# Server lifecycle hooks of the PCA app.
+# They are used when the app is run as a directory application:
+#   bokeh serve --show ex03
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/server/app.html#lifecycle-hooks
+
+import pca_state
+
+
+def on_server_loaded(server_context):
+    # Compute the data, the PCA and the clustering once per server process,
+    # before the first session is opened
+    pca_state.on_server_loaded(server_context)
@@ -0,0 +1,111 @@
+# ====================================================================
+# Crossfilter over the binned features of the PCA app
+
+# A histogram only depends on which bin each point falls into.
+# Each numeric feature is binned once into a compact array of bin codes
+# (uint8, or uint16 for more than 254 bins), so that
+# - the counts of all the points are computed once and cached, and
+# - the counts of the selected points are a single np.bincount
+#   over the codes of the selected points,
+#   which costs O(number of selected points) per lasso selection.
+# The Crossfilter keeps the bin codes of all the numeric features in one matrix,
+# so that the selected counts of many features (e.g. for a dashboard
+# of linked histograms) are computed in one vectorized pass.
+# ====================================================================
+
+# reference:
+# https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+# https://numpy.org/doc/stable/reference/generated/numpy.histogram_bin_edges.html
+
+import numpy as np
+
+MAX_BINS = 200
+
+
+# Choose the number of bins like numpy's 'auto' rule
+# (the larger of the Sturges and the Freedman-Diaconis estimates),
+# but never more than `max_bins`, since a few outliers
+# can make the Freedman-Diaconis bins arbitrarily narrow.
+def bin_edges(values, max_bins=MAX_BINS):
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return np.array([0.0, 1.0])
+    low, high = finite.min(), finite.max()
+    if low == high:
+        return np.array([low - 0.5, high + 0.5])
+
+    n_bins = int(np.ceil(np.log2(finite.size))) + 1
+    q25, q75 = np.percentile(finite, [25, 75])
+    width = 2.0 * (q75 - q25) * finite.size ** (-1 / 3)
+    if width > 0:
+        n_bins = max(n_bins, int(np.ceil((high - low) / width)))
+    n_bins = min(n_bins, max_bins)
+    return np.linspace(low, high, n_bins + 1)
+
+
+# The code of a value is the index of its bin.
+# Missing values get the extra code `n_bins`, which is left out of the counts.
+def bin_codes(values, edges):
+    n_bins = len(edges) - 1
+    codes = np.searchsorted(edges, values, side="right") - 1
+    # like np.histogram, the last bin includes its right edge
+    codes[values == edges[-1]] = n_bins - 1
+    codes[~np.isfinite(values)] = n_bins
+    dtype = np.uint8 if n_bins < np.iinfo(np.uint8).max else np.uint16
+    return codes.astype(dtype)
+
+
+class BinnedFeature:
+    def __init__(self, values, max_bins=MAX_BINS, edges=None, codes=None):
+        # The edges and codes can be passed in if they are already computed
+        if edges is None:
+            values = np.asarray(values, dtype=np.float64)
+            edges = bin_edges(values, max_bins)
+            codes = bin_codes(values, edges)
+        self.edges = edges
+        self.n_bins = len(edges) - 1
+        self.codes = codes
+        # the counts of all the points never change
+        self.counts_all = self.counts()
+
+    def counts(self, indices=None):
+        # The counts per bin of the points with the given row indices (all points by default)
+        codes = self.codes if indices is None else self.codes[np.asarray(indices, dtype=np.intp)]
+        return np.bincount(codes, minlength=self.n_bins + 1)[: self.n_bins]
+
+
+class Crossfilter:
+    def __init__(self, df, columns, max_bins=MAX_BINS):
+        self.columns = list(columns)
+        self.rows = {col: i for i, col in enumerate(self.columns)}
+        edges = [bin_edges(df[col].to_numpy(dtype=np.float64), max_bins) for col in self.columns]
+        self.n_bins = np.array([len(e) - 1 for e in edges])
+        # one row of bin codes per feature,
+        # uint8 unless a feature has too many bins for it
+        dtype = np.uint8 if self.n_bins.max(initial=0) < np.iinfo(np.uint8).max else np.uint16
+        self.codes = np.empty((len(self.columns), len(df)), dtype=dtype)
+        for i, col in enumerate(self.columns):
+            self.codes[i] = bin_codes(df[col].to_numpy(dtype=np.float64), edges[i])
+        # the bins of all the features are numbered consecutively,
+        # feature i uses the numbers offsets[i] ... offsets[i] + n_bins[i] (missing values)
+        self.offsets = np.concatenate([[0], np.cumsum(self.n_bins + 1)])
+        self.features = {
+            col: BinnedFeature(None, edges=edges[i], codes=self.codes[i])
+            for i, col in enumerate(self.columns)
+        }
+
+    def feature(self, col):
+        return self.features[col]
+
+    def selected_counts(self, columns, indices):
+        # The counts per bin of the selected points for each of the `columns`,
+        # with a single np.bincount over the codes of all these features
+        rows = np.array([self.rows[col] for col in columns], dtype=np.intp)
+        indices = np.asarray(indices, dtype=np.intp)
+        codes = self.codes[rows[:, None], indices[None, :]].astype(np.intp)
+        codes += self.offsets[rows][:, None]
+        counts = np.bincount(codes.ravel(), minlength=self.offsets[-1])
+        return {
+            col: counts[self.offsets[row] : self.offsets[row] + self.n_bins[row]]
+            for col, row in zip(columns, rows)
+        }
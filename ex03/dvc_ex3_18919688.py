@@ -25,84 +25,55 @@
 # https://scikit-learn.org/stable/install.html
 
 # import packages for processing data
+import os
+import sys
+from functools import partial
+
 import numpy as np
 import pandas as pd
 from pandas.api.types import is_numeric_dtype, is_object_dtype
 
-# import packages for principal component analysis and clustering
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import MinMaxScaler
-from sklearn import cluster
-from sklearn.impute import SimpleImputer
-
 # import packages for visualization
+from bokeh.core.property.descriptors import UnsetValueError
+from bokeh.events import DocumentReady, RangesUpdate, SelectionGeometry
 from bokeh.io import curdoc
 from bokeh.plotting import figure
-from bokeh.layouts import column, row
-from bokeh.models import ColumnDataSource, HoverTool, LassoSelectTool, Select
+from bokeh.layouts import column, gridplot, row
+from bokeh.models import (
+    BoxSelectTool,
+    ColorBar,
+    ColumnDataSource,
+    HoverTool,
+    LassoSelectTool,
+    LegendItem,
+    MultiChoice,
+    Select,
+)
 from bokeh.palettes import TolRainbow, Turbo256
+from bokeh.core.properties import field
 from bokeh.transform import factor_cmap, linear_cmap, log_cmap
 
+# import the process-wide state of the app
+# (the data, the principal components and the cluster labels)
+from pca_state import get_shared_state
+
+# The shared server helpers live in the repository root.
+# (pca_state.py adds it to sys.path too, but only when it is first imported:
+# Bokeh restores sys.path after running app_hooks.py, and later sessions
+# find pca_state in sys.modules without importing it again.)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_server import BackgroundWork, Debounced, on_settled_change
+from raster import Rasterizer
+
 # ====================================================================
 # Task 1: Dimension Reduction
 # ====================================================================
 
-# Read the raw data and inspect the rows and columns.
-# There are 5 categorical columns (Country, Industry, Company, Symbol, Recommendation)
-# and 102 numerical columns (i.e. features).
-
-pca_data_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQFGt2FAUh_Fb7XAtYasA95ut8X_4a6sqizwcF-QFHdxULsPCf0kXhqn3wJdxNE2Ogf-f1qwyeOIySw/pub?gid=1323235&single=true&output=csv"
-pca_data = pd.read_csv(pca_data_url)
-
-## 1.1 Principal component analysis (PCA)
-
-# You'll project the 102 numeric features to 2 dimensions using PCA.
-# Reference:
-# https://scikit-learn.org/stable/modules/generated/sklearn.decomposition.PCA.html
-
-
-def pca(df):
-
-    # select the numeric features
-    X = df.iloc[:, 5:]  # 5th to last cols
-    # use MinMaxScaler to scale the features
-    X_scaled = MinMaxScaler().fit_transform(X)
-    # use SimpleImputer to fill in the missing values with the mean value
-    imp = SimpleImputer(strategy="mean")
-    X_imp = imp.fit_transform(X_scaled)
-    # perform PCA to project the features into 2 components
-    pca = PCA(n_components=2)
-    X_pca = pca.fit_transform(X_imp)
-    # append the 2 principal components to the dataframe
-    df["PCA 1"] = X_pca[:, 0]
-    df["PCA 2"] = X_pca[:, 1]
-
-    return df
-
-
-# 1.2 Clustering
-
-# You'll divide the data points into 2 (or more) clusters
-# based on the principal components and assign a cluster label to each point.
-# Reference:
-# https://scikit-learn.org/stable/modules/clustering.html#clustering
-# https://github.com/bokeh/bokeh/tree/branch-3.1/examples/server/app/clustering
-
-
-def clustering(df, n_clusters=2):
-
-    # select the principal components
-    X_pca = df[["PCA 1", "PCA 2"]]
-    # sets the random seed to 0 so that the result is reproducible
-    np.random.seed(0)
-    # use MiniBatchKMeans to perform the clustering
-    model = cluster.MiniBatchKMeans(n_clusters=n_clusters, n_init=2)
-    model.fit(X_pca)
-    # append the cluster labels to the dataframe
-    y_pred = model.labels_.astype(str)
-    df["Cluster"] = y_pred
-
-    return df
+# The data is read and the principal component analysis (1.1)
+# and the clustering (1.2) are done in pca_state.py.
+# Bokeh server runs this script for every new session,
+# while pca_state.py is imported only once per server process,
+# so all the sessions share the result instead of repeating the work.
 
 
 # ====================================================================
@@ -214,6 +185,127 @@ def plot_pca(source, df, ft_selected):
     return p
 
 
+## 2.2.1 Define a function to update the color map of an existing PCA plot.
+
+# Instead of drawing a new PCA plot, only the properties that depend on
+# the selected feature are changed: the color mapper of the glyphs,
+# the color bar or the legend, and the title.
+# The glyphs, the tools and the data source stay in the browser,
+# so only these small changes are sent over the websocket.
+
+
+def restyle_pca(p, source, df, ft_selected):
+
+    c = ft_selected
+    r = p.renderers[0]
+    mapper, _ = create_cmap(df, c)
+    # the renderer keeps copies of the glyph for the (non)selected and muted points
+    for glyph in (r.glyph, r.selection_glyph, r.nonselection_glyph, r.muted_glyph):
+        if glyph not in (None, "auto"):
+            glyph.fill_color = mapper
+    p.title.text = f"PCA with Color Map on {c}"
+
+    # keep a single legend on the left of the plot
+    legend = p.legend[0]
+    if legend in p.center:
+        p.center = [m for m in p.center if m is not legend]
+    if legend not in p.left:
+        p.add_layout(legend, "left")
+    color_bars = [m for m in p.left if isinstance(m, ColorBar)]
+
+    if is_numeric_dtype(df[c]):
+        if color_bars:
+            color_bars[0].color_mapper = mapper["transform"]
+            color_bars[0].visible = True
+        else:
+            p.add_layout(r.construct_color_bar(padding=5), "left")
+        legend.items = []
+        legend.visible = False
+    elif is_object_dtype(df[c]):
+        # the legend is generated from the 'label' column in the browser,
+        # which is only needed (and sent) for categorical features
+        source.data["label"] = source.data[c]
+        for color_bar in color_bars:
+            color_bar.visible = False
+        legend.items = [LegendItem(label=field("label"), renderers=[r])]
+        legend.visible = True
+
+
+## 2.2.2 Define functions to draw the PCA plot as an image.
+
+# With many points (see RASTER_MODE below), the points are not drawn as circles,
+# instead the server renders the visible part of the plot into an image (see raster.py),
+# which is rendered again when the plot is panned or zoomed (see 3.4).
+# A pixel has the color of the mean of a numeric feature (or the most frequent category)
+# of its points under the color map of create_cmap, and its opacity grows with the number of points.
+# A categorical feature gets a color bar of its categories instead of a legend,
+# since there are no glyphs of the categories to show in a legend.
+# The image is placed at the (x, y, dw, dh) of the part of the plot it covers,
+# the visible part plus a margin of RASTER_MARGIN times its size on each side,
+# so that a small pan shows the image at once (and the server renders the new view).
+
+
+def plot_pca_raster(source, df, ft_selected):
+
+    c = ft_selected
+    x0, x1, y0, y1 = rasterizer.bounds()
+    p = figure(
+        title=f"PCA with Color Map on {c}",
+        tools="pan, wheel_zoom, lasso_select, box_select, reset",
+        toolbar_location="below",
+        width=500,
+        height=450,
+        x_range=(x0, x1),
+        y_range=(y0, y1),
+    )
+    mapper, _ = create_cmap(df, c)
+    p.image_rgba(image="image", x="x", y="y", dw="dw", dh="dh", source=source)
+    p.add_layout(ColorBar(color_mapper=mapper["transform"], padding=5), "left")
+    p.background_fill_color = "#fafafa"
+    p.xaxis.axis_label = "PCA component 1"
+    p.yaxis.axis_label = "PCA component 2"
+    # select once the lasso is closed, the points are selected on the server
+    p.select(LassoSelectTool).continuous = False
+    p.select(BoxSelectTool).continuous = False
+    return p
+
+
+# The color mapper of the image is the one of its color bar
+def raster_color_mapper(p):
+    return [m for m in p.left if isinstance(m, ColorBar)][0].color_mapper
+
+
+def restyle_pca_raster(p, df, ft_selected):
+    mapper, _ = create_cmap(df, ft_selected)
+    [m for m in p.left if isinstance(m, ColorBar)][0].color_mapper = mapper["transform"]
+    p.title.text = f"PCA with Color Map on {ft_selected}"
+
+
+# The size of the plot area in pixels, as reported by the browser
+def plot_size(p):
+    try:
+        return p.inner_width or p.width, p.inner_height or p.height
+    except UnsetValueError:
+        # not rendered yet
+        return p.width, p.height
+
+
+def raster_view(p):
+    # The (x0, x1, y0, y1, width, height) of the image of the visible part of `p`
+    # plus the margin, with one pixel per RASTER_PIXEL screen pixels
+    width, height = plot_size(p)
+    x0, x1, y0, y1 = p.x_range.start, p.x_range.end, p.y_range.start, p.y_range.end
+    dx, dy = RASTER_MARGIN * (x1 - x0), RASTER_MARGIN * (y1 - y0)
+    scale = (1 + 2 * RASTER_MARGIN) / RASTER_PIXEL
+    return x0 - dx, x1 + dx, y0 - dy, y1 + dy, round(width * scale), round(height * scale)
+
+
+def raster_data(view, values, mapper, points_selected):
+    x0, x1, y0, y1, width, height = view
+    image = rasterizer.render(x0, x1, y0, y1, width, height, values, mapper, points_selected)
+    return dict(image=[image], x=[x0], y=[y0], dw=[x1 - x0], dh=[y1 - y0])
+
+
 ## 2.3 Define a function to draw the histogram for a numeric feature.
 
 # The histogram has two sets of bins:
@@ -224,26 +316,40 @@ def plot_pca(source, df, ft_selected):
 # https://github.com/bokeh/bokeh/blob/branch-3.1/examples/server/app/selection_histogram.py
 
 
-def draw_hist(df, col, points_selected):
-    # get the corresponding rows in the dataframe for the selected points
-    s = df.iloc[points_selected]
-    # compute the tops and edges of the bins in the histogram
+# The features are binned once per server process (see crossfilter.py):
+# the counts of all the points are cached,
+# and the counts of the selected points are a single np.bincount
+# over the bin codes of the selected points.
+# While the rows are loaded progressively (see 3.5),
+# 'all' are the rows loaded into the PCA plot so far.
+
+
+def all_counts(binned):
+    if n_loaded >= len(row_order):
+        return binned.counts_all
+    return binned.counts(row_order[:n_loaded])
+
+
+def hist_data(df, col, points_selected):
+    binned = get_shared_state().binned(col)
+    # the tops and edges of the bins in the histogram
     # for all the points and the selected points respectively
-    hist_values, bin_edges = np.histogram(
-        df[col].dropna().reset_index(drop=True), bins=len(df[col])
-    )
-    hist_value_selected, _ = np.histogram(
-        s[col].dropna().reset_index(drop=True), bins=bin_edges
+    bin_edges = binned.edges
+    hist_values = all_counts(binned)
+    hist_value_selected = binned.counts(points_selected)
+    return dict(
+        range_start=bin_edges[:-1],
+        range_end=bin_edges[1:],
+        hist_v=hist_values,
+        hist_vs=hist_value_selected,
     )
+
+
+def draw_hist(df, col, points_selected):
     # create a data source for both sets of bins
-    source = ColumnDataSource(
-        data=dict(
-            range_start=bin_edges[:-1],
-            range_end=bin_edges[1:],
-            hist_v=hist_values,
-            hist_vs=hist_value_selected,
-        )
-    )
+    data = hist_data(df, col, points_selected)
+    source = ColumnDataSource(data=data)
+    hist_values = data["hist_v"]
 
     ph = figure(
         width=400,
@@ -302,6 +408,28 @@ def draw_hist(df, col, points_selected):
     return ph
 
 
+## 2.3.1 Define functions to update an existing histogram.
+
+# When the feature changes, the bins, the title and the y range are replaced.
+# When only the selection changes, the bins of all the points stay the same
+# and only the 'hist_vs' column of the data source is sent to the browser.
+# The `data` of `hist_data` can be passed in if it has been computed already.
+
+
+def update_hist(ph, df, col, points_selected, data=None):
+    if data is None:
+        data = hist_data(df, col, points_selected)
+    ph.renderers[0].data_source.data = data
+    ph.y_range.end = 1.1 * data["hist_v"].max()
+    ph.title.text = f"Histogram of {col}"
+    ph.xaxis.axis_label = f"{col}"
+
+
+def update_hist_selection(ph, df, col, points_selected):
+    source = ph.renderers[0].data_source
+    source.data["hist_vs"] = get_shared_state().binned(col).counts(points_selected)
+
+
 ## 2.4 (Optional) Define a function to draw a bar chart for a categorical feature.
 
 # The bar chart has two sets of bars:
@@ -326,11 +454,101 @@ def draw_subplot(df, ft_selected, points_selected):
     return sub_p
 
 
+## 2.5 Define functions to draw a dashboard of linked histograms.
+
+# The dashboard shows a small histogram for each of several features.
+# Like the subplot, each histogram has the bins of all the points
+# and the bins of the selected points.
+# The counts of the selected points of all the histograms
+# are computed together in one pass by the crossfilter (see crossfilter.py).
+
+
+def draw_dashboard(features, points_selected, ncols=3):
+    cf = get_shared_state().crossfilter
+    selected = cf.selected_counts(features, points_selected)
+    plots = []
+    for col in features:
+        binned = cf.feature(col)
+        hist_values = all_counts(binned)
+        source = ColumnDataSource(
+            data=dict(
+                range_start=binned.edges[:-1],
+                range_end=binned.edges[1:],
+                hist_v=hist_values,
+                hist_vs=selected[col],
+            )
+        )
+        ph = figure(
+            width=220,
+            height=160,
+            y_range=(0, 1.1 * max(hist_values.max(), 1)),
+            title=col,
+            tools="",
+            toolbar_location=None,
+        )
+        ph.xgrid.grid_line_color = None
+        ph.yaxis.visible = False
+        ph.background_fill_color = "#fafafa"
+        ph.quad(
+            bottom=0,
+            left="range_start",
+            right="range_end",
+            top="hist_v",
+            source=source,
+            color="silver",
+            line_color="silver",
+        )
+        ph.quad(
+            bottom=0,
+            left="range_start",
+            right="range_end",
+            top="hist_vs",
+            source=source,
+            color="purple",
+            line_color=None,
+            alpha=0.5,
+        )
+        plots.append(ph)
+    return gridplot(plots, ncols=ncols, toolbar_location=None)
+
+
+def update_dashboard(dashboard, features, points_selected, selected=None):
+    # only the 'hist_vs' column of each histogram is sent to the browser
+    # (`selected` are the counts of `selected_counts` if they have been computed already)
+    if selected is None:
+        selected = get_shared_state().crossfilter.selected_counts(features, points_selected)
+    plots = [child[0] for child in dashboard.children]
+    for col, ph in zip(features, plots):
+        ph.renderers[0].data_source.data["hist_vs"] = selected[col]
+
+
 # Plotting
 
-# Get the dataframe with principal components and cluster labels
-df_pca = pca(pca_data)
-df = clustering(df_pca, 2)
+# Update the existing plots in place in the callbacks (see 2.2.1 and 2.3.1)
+# instead of drawing new plots and replacing them in the layout.
+IN_PLACE_UPDATES = True
+# Show the dashboard of linked histograms (see 2.5) next to the subplot.
+SHOW_DASHBOARD = True
+# RASTER_MODE = 'auto': draw the PCA plot as an image rendered on the server (see 2.2.2)
+# when there are at least RASTER_MIN_ROWS points, as circles otherwise,
+# RASTER_MODE = 'always' / 'never': always / never as an image.
+RASTER_MODE = "auto"
+RASTER_MIN_ROWS = 50_000
+# the size of a pixel of the image in screen pixels
+RASTER_PIXEL = 2
+# the part of the plot outside of the visible part that is rendered, on each side
+RASTER_MARGIN = 0.5
+# Load the points of the PCA plot progressively (see 3.5):
+# first a sample of PROGRESSIVE_SAMPLE rows (stratified by 'Cluster'),
+# then the other rows in chunks of PROGRESSIVE_CHUNK rows
+PROGRESSIVE_LOADING = True
+PROGRESSIVE_SAMPLE = 5_000
+PROGRESSIVE_CHUNK = 25_000
+
+# Get the dataframe with principal components and cluster labels.
+# It is a view of the shared frame, so the columns added below
+# belong to this session only.
+df = get_shared_state().session_view()
 # Select a initial feature for the PCA plot
 pca_ft_selected = "Market Cap"
 # Select a initial feature for the subplot
@@ -343,12 +561,63 @@ points_selected = []
 # It will be updated when you choose a different feature
 # in the selection widget for the PCA plot.
 df["label"] = df[pca_ft_selected]
+# the points of the PCA plot for the image (see 2.2.2)
+raster = RASTER_MODE == "always" or (RASTER_MODE == "auto" and len(df) >= RASTER_MIN_ROWS)
+rasterizer = Rasterizer(df["PCA 1"], df["PCA 2"])
+# The rows of `df` in the order of the rows of the data source of the PCA plot,
+# the first `n_loaded` of them are in the data source (see 3.5).
+# The indices of the lasso selection are positions in the data source,
+# `row_order[indices]` are the rows of `df`.
+progressive = PROGRESSIVE_LOADING and not raster and len(df) > PROGRESSIVE_SAMPLE
+if progressive:
+    row_order = get_shared_state().load_order(PROGRESSIVE_SAMPLE)
+    n_loaded = PROGRESSIVE_SAMPLE
+    loaded = row_order[:n_loaded]
+else:
+    row_order = np.arange(len(df))
+    n_loaded = len(df)
+    # all the rows, the columns stay views of the shared frame
+    loaded = slice(None)
 # create the data source for the PCA plot using ColumnDataSource
-p_pca_source = ColumnDataSource(data=df)
+# (ColumnDataSource(data=df) would make a deep copy of the frame for every session,
+# the column arrays share their memory with the shared frame instead)
+# The source only carries the columns the plot uses: the coordinates, the tooltip,
+# the legend and the color feature. Every column of the source is sent to the browser,
+# so the other features are added when they are selected (see add_pca_column).
+PCA_COLUMNS = ["PCA 1", "PCA 2", "Symbol", "label"]
+p_pca_source = ColumnDataSource(
+    data={c: df[c].to_numpy()[loaded] for c in dict.fromkeys(PCA_COLUMNS + [pca_ft_selected])}
+)
+
+
+def add_pca_column(col):
+    # Add the feature `col` (of the loaded rows) to the data source of the PCA plot
+    if col not in p_pca_source.data:
+        rows = row_order[:n_loaded] if progressive else slice(None)
+        p_pca_source.data[col] = df[col].to_numpy()[rows]
+
+# Select the initial features for the dashboard
+dashboard_features = [
+    "Market Cap",
+    "Mean Recommendation",
+    "Target Price",
+    "RSI",
+    "Enterprise To Revenue",
+    "Investment Score",
+]
 
 # Create the initial PCA plot and the subplot
-p_pca = plot_pca(p_pca_source, df, pca_ft_selected)
+if raster:
+    # (the data source of the points is not part of the document, it is not sent to the browser)
+    p_pca_raster_source = ColumnDataSource()
+    p_pca = plot_pca_raster(p_pca_raster_source, df, pca_ft_selected)
+    p_pca_raster_source.data = raster_data(
+        raster_view(p_pca), df[pca_ft_selected].to_numpy(), raster_color_mapper(p_pca), points_selected
+    )
+else:
+    p_pca = plot_pca(p_pca_source, df, pca_ft_selected)
 p_sub = draw_subplot(df, sub_ft_selected, points_selected)
+p_dashboard = draw_dashboard(dashboard_features, points_selected)
 
 # ====================================================================
 # Task 3: Interaction
@@ -379,6 +648,15 @@ select_col_sub = Select(
     margin=(10, 10, 10, 20),
 )
 
+# To select the features shown in the dashboard
+choice_dashboard = MultiChoice(
+    title="Select the features to show in the dashboard:",
+    value=dashboard_features,
+    options=get_shared_state().numeric_columns,
+    width=660,
+    margin=(20, 10, 10, 20),
+)
+
 # arrange the plots and widgets in a layout
 layout = row(
     column(
@@ -392,6 +670,47 @@ layout = row(
         width=350,
     ),
 )
+if SHOW_DASHBOARD:
+    layout.children.append(column(choice_dashboard, p_dashboard, width=680))
+
+# 3.1.1 Compute the updates in the background
+
+# The counts of the selected points of the subplot and the dashboard
+# are computed in a thread pool (see dvc_server.py), not in the callbacks,
+# so a large lasso selection of one session doesn't hold up the other sessions.
+# The results are applied to the plots on the event loop,
+# unless a newer update of the same plot has been submitted in the meantime.
+# The plots drawn from scratch (without IN_PLACE_UPDATES) are still drawn in the callbacks,
+# since Bokeh models are only created and changed with the lock of the document.
+work = BackgroundWork(curdoc())
+# the feature shown in the subplot (`sub_ft_selected` changes before the update is applied)
+sub_ft_shown = sub_ft_selected
+
+
+def submit_hist_update(col, points_selected):
+    work.submit("sub", partial(hist_data, df, col, points_selected), partial(apply_hist_update, col))
+
+
+def apply_hist_update(col, data):
+    global sub_ft_shown
+    if col == sub_ft_shown:
+        p_sub.renderers[0].data_source.data["hist_vs"] = data["hist_vs"]
+    else:
+        # the counts of all the points are taken again from the rows loaded by now,
+        # a chunk may have been applied while `data` was computed (see 3.5)
+        data["hist_v"] = all_counts(get_shared_state().binned(col))
+        update_hist(p_sub, df, col, None, data)
+        sub_ft_shown = col
+
+
+def submit_dashboard_update(features, points_selected):
+    crossfilter = get_shared_state().crossfilter
+    work.submit(
+        "dashboard",
+        partial(crossfilter.selected_counts, features, points_selected),
+        partial(update_dashboard, p_dashboard, features, points_selected),
+    )
+
 
 # 3.2 Define the callback functions for the selection widgets
 
@@ -405,6 +724,7 @@ layout = row(
 # when you select a new feature
 # the 'label' column in the data source will be updated to the new feature
 # a new PCA plot will be drawn to replace the previous one in the layout
+# (with IN_PLACE_UPDATES, the color map of the existing plot is changed instead)
 
 # (Please note that replacing the whole plot is the simple way for updating a plot.
 # The better practice is making the minimal changes to the properties of the existing plot,
@@ -414,6 +734,15 @@ layout = row(
 
 def update_pca_col(attrname, old, new):
 
+    global p_pca
+    if raster:
+        restyle_pca_raster(p_pca, df, new)
+        update_raster()
+        return
+    add_pca_column(new)
+    if IN_PLACE_UPDATES:
+        restyle_pca(p_pca, p_pca_source, df, new)
+        return
     p_pca_source.data["label"] = p_pca_source.data[new]
     p_pca = plot_pca(p_pca_source, df, new)
     layout.children[0].children[0] = p_pca
@@ -423,35 +752,197 @@ def update_pca_col(attrname, old, new):
 # when you select a new feature
 # a new subplot of this feature will be drawn to replace the previous one in the layout
 # the new subplot will keep the previous selection of points by the lasso selection tool
+# (with IN_PLACE_UPDATES, the bins of the existing histogram are replaced instead)
 
 
 def update_sub_col(attrname, old, new):
 
-    global sub_ft_selected
+    global sub_ft_selected, sub_ft_shown, p_sub
     sub_ft_selected = new
-    layout.children[1].children[2] = draw_subplot(df, new, points_selected)
+    # a histogram can be updated in place if it stays a histogram
+    if IN_PLACE_UPDATES and is_numeric_dtype(df[old]) and is_numeric_dtype(df[new]):
+        submit_hist_update(new, points_selected)
+        return
+    work.cancel("sub")
+    sub_ft_shown = new
+    p_sub = draw_subplot(df, new, points_selected)
+    layout.children[1].children[2] = p_sub
 
 
-select_col_pca.on_change("value", update_pca_col)
-select_col_sub.on_change("value", update_sub_col)
+# Callback function of the MultiChoice widget for the dashboard:
+# when you select other features, a new dashboard will be drawn
+
+
+def update_dashboard_cols(attrname, old, new):
+
+    global dashboard_features, p_dashboard
+    dashboard_features = new
+    # the new dashboard has the counts of the current selection
+    work.cancel("dashboard")
+    p_dashboard = draw_dashboard(dashboard_features, points_selected)
+    layout.children[2].children[1] = p_dashboard
+
+
+# Scrolling through the options with the keyboard changes the value for every option,
+# the changes are coalesced so that only the last one is drawn (see dvc_server.py)
+on_settled_change(select_col_pca, update_pca_col)
+on_settled_change(select_col_sub, update_sub_col)
+on_settled_change(choice_dashboard, update_dashboard_cols)
 
 ## 3.3 Define the callback functions for the lasso selection tool in the PCA plot
 
 # when you select some points with the lasso selection tool,
 # a new subplot will be drawn to replace the previous one in the layout
 # with the new selection of points reflected in the bins / bars of the selected points
+# (with IN_PLACE_UPDATES, only the counts of the selected points are replaced)
 # Example:
 # https://github.com/bokeh/bokeh/blob/branch-3.1/examples/server/app/selection_histogram.py
 
 
 def lasso_update(attr, old, new):
 
-    global points_selected
-    points_selected = new
-    layout.children[1].children[2] = draw_subplot(df, sub_ft_selected, points_selected)
+    global points_selected, sub_ft_shown, p_sub
+    points_selected = row_order[np.asarray(new, dtype=np.int64)]
+    if SHOW_DASHBOARD:
+        submit_dashboard_update(dashboard_features, points_selected)
+    if IN_PLACE_UPDATES and is_numeric_dtype(df[sub_ft_selected]):
+        submit_hist_update(sub_ft_selected, points_selected)
+        return
+    work.cancel("sub")
+    sub_ft_shown = sub_ft_selected
+    p_sub = draw_subplot(df, sub_ft_selected, points_selected)
+    layout.children[1].children[2] = p_sub
+
+
+# the lasso updates the selection while it is drawn, only the last selection is drawn
+if not raster:
+    p_pca.renderers[0].data_source.selected.on_change("indices", Debounced(curdoc(), lasso_update).change)
+
+## 3.4 Define the callback functions of the PCA plot drawn as an image (see 2.2.2)
+
+# The image is rendered again in the background (see 3.1.1)
+# when the plot is panned, zoomed or resized (coalesced, see dvc_server.py),
+# when the feature of the color map changes, and when the selection changes.
+# A lasso (or a box) on the image selects no glyphs, the points inside its outline
+# (sent with the SelectionGeometry event in data coordinates) are found on the server
+# with the spatial index of the principal components (see spatial_index.py),
+# which only tests the points in the grid cells crossed by the outline.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/events.html#bokeh.events.SelectionGeometry
+
+
+def update_raster():
+    work.submit(
+        "raster",
+        partial(
+            raster_data,
+            raster_view(p_pca),
+            df[select_col_pca.value].to_numpy(),
+            raster_color_mapper(p_pca),
+            points_selected,
+        ),
+        apply_raster,
+    )
 
 
-p_pca.renderers[0].data_source.selected.on_change("indices", lasso_update)
+def apply_raster(data):
+    p_pca_raster_source.data = data
+
+
+def rerender_raster(*args):
+    update_raster()
+
+
+def select_raster(event):
+    if event.final:
+        spatial_index = get_shared_state().spatial_index
+        work.submit("raster selection", partial(spatial_index.select, event.geometry), apply_raster_selection)
+
+
+def apply_raster_selection(indices):
+    lasso_update("indices", points_selected, indices)
+    update_raster()
+
+
+if raster:
+    rerender = Debounced(curdoc(), rerender_raster, max_wait_ms=300)
+    p_pca.on_event(RangesUpdate, rerender.event)
+    p_pca.on_change("inner_width", rerender.change)
+    p_pca.on_change("inner_height", rerender.change)
+    p_pca.on_event(SelectionGeometry, select_raster)
+
+## 3.5 Load the rows of the PCA plot progressively
+
+# The PCA plot is first drawn with a sample of the rows (see `stratified_order` in pca_state.py),
+# so the first plot doesn't wait for all the rows.
+# Once the browser has drawn it (the DocumentReady event), the other rows are streamed
+# into the data source in chunks (`ColumnDataSource.stream` only sends the new rows).
+# Each chunk is prepared in the background (see 3.1.1), together with the counts
+# of the 'all' bins of the subplot and the dashboard for the rows loaded with it,
+# and the next chunk is prepared once the chunk has been applied.
+# The selection (positions in the data source) stays valid, since rows are only appended.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/models/sources.html#bokeh.models.ColumnDataSource.stream
+# https://docs.bokeh.org/en/3.1.0/docs/reference/events.html#bokeh.events.DocumentReady
+
+loading = False
+
+
+def chunk_update(start, end, columns, label_col, sub_col, features):
+    rows = row_order[start:end]
+    data = {c: df[label_col if c == "label" else c].to_numpy()[rows] for c in columns}
+    state = get_shared_state()
+    hist_all = state.binned(sub_col).counts(row_order[:end]) if is_numeric_dtype(df[sub_col]) else None
+    dashboard_all = state.crossfilter.selected_counts(features, row_order[:end]) if SHOW_DASHBOARD else None
+    return data, hist_all, dashboard_all
+
+
+def load_next_chunk():
+    end = min(n_loaded + PROGRESSIVE_CHUNK, len(row_order))
+    if end <= n_loaded:
+        return
+    args = (n_loaded, end, list(p_pca_source.data), select_col_pca.value, sub_ft_shown, dashboard_features)
+    work.submit("loading", partial(chunk_update, *args), partial(apply_chunk, *args))
+
+
+def apply_chunk(start, end, columns, label_col, sub_col, features, result):
+    global n_loaded
+    data, hist_all, dashboard_all = result
+    # the features may have changed while the chunk was prepared
+    # (and the columns added since then must be streamed too)
+    if label_col != select_col_pca.value:
+        data["label"] = df[select_col_pca.value].to_numpy()[row_order[start:end]]
+    for c in p_pca_source.data:
+        if c not in data:
+            data[c] = df[c].to_numpy()[row_order[start:end]]
+    p_pca_source.stream(data)
+    n_loaded = end
+    state = get_shared_state()
+    if is_numeric_dtype(df[sub_ft_shown]):
+        if sub_col != sub_ft_shown:
+            hist_all = all_counts(state.binned(sub_ft_shown))
+        p_sub.renderers[0].data_source.data["hist_v"] = hist_all
+        p_sub.y_range.end = 1.1 * hist_all.max()
+    if SHOW_DASHBOARD:
+        if features != dashboard_features:
+            dashboard_all = state.crossfilter.selected_counts(dashboard_features, row_order[:n_loaded])
+        for col, child in zip(dashboard_features, p_dashboard.children):
+            ph = child[0]
+            ph.renderers[0].data_source.data["hist_v"] = dashboard_all[col]
+            ph.y_range.end = 1.1 * max(dashboard_all[col].max(), 1)
+    load_next_chunk()
+
+
+def start_loading(event):
+    global loading
+    # the event comes again when the layout changes
+    if not loading:
+        loading = True
+        load_next_chunk()
+
+
+if progressive:
+    curdoc().on_event(DocumentReady, start_loading)
 
 curdoc().add_root(layout)
 curdoc().title = "PCA"
@@ -0,0 +1,9 @@
+# Entry point of the PCA app as a directory application:
+#   bokeh serve --show ex03
+# Bokeh runs this file for every new session (like a single-file app)
+# and additionally installs the lifecycle hooks in app_hooks.py.
+
+import os
+import runpy
+
+runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dvc_ex3_18919688.py"))
@@ -0,0 +1,247 @@
+# ====================================================================
+# Process-wide state of the PCA app
+
+# Bokeh server executes the app script once for every new session.
+# The data, the principal components and the cluster labels
+# are the same for all the sessions, so they are computed only once
+# per server process and kept in this module,
+# which (like any imported module) outlives the sessions.
+# Each session gets a shallow view of the shared frame
+# and only adds its own per-session columns (e.g. 'label') to that view.
+# ====================================================================
+
+# The state is built either
+# 1) when the server starts, by the `on_server_loaded` lifecycle hook
+#    (see app_hooks.py, used with `bokeh serve --show ex03`), or
+# 2) lazily by the first session that asks for it
+#    (used with `bokeh serve --show dvc_ex3_18919688.py`).
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/server/app.html#lifecycle-hooks
+
+import os
+import sys
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# import packages for principal component analysis and clustering
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import MinMaxScaler
+from sklearn import cluster
+from sklearn.impute import SimpleImputer
+
+# import the shared data access layer from the repository root,
+# which keeps a local snapshot of the remote CSV
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_data import read_csv_cached
+from dvc_shm import shared_frame
+
+from crossfilter import Crossfilter
+from spatial_index import GridIndex
+
+# Read the raw data and inspect the rows and columns.
+# There are 5 categorical columns (Country, Industry, Company, Symbol, Recommendation)
+# and 102 numerical columns (i.e. features).
+
+pca_data_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQFGt2FAUh_Fb7XAtYasA95ut8X_4a6sqizwcF-QFHdxULsPCf0kXhqn3wJdxNE2Ogf-f1qwyeOIySw/pub?gid=1323235&single=true&output=csv"
+
+## 1.1 Principal component analysis (PCA)
+
+# You'll project the 102 numeric features to 2 dimensions using PCA.
+# Reference:
+# https://scikit-learn.org/stable/modules/generated/sklearn.decomposition.PCA.html
+
+
+def pca(df):
+
+    # select the numeric features
+    X = df.iloc[:, 5:]  # 5th to last cols
+    # use MinMaxScaler to scale the features
+    X_scaled = MinMaxScaler().fit_transform(X)
+    # use SimpleImputer to fill in the missing values with the mean value
+    imp = SimpleImputer(strategy="mean")
+    X_imp = imp.fit_transform(X_scaled)
+    # perform PCA to project the features into 2 components
+    pca = PCA(n_components=2)
+    X_pca = pca.fit_transform(X_imp)
+    # append the 2 principal components to the dataframe
+    df["PCA 1"] = X_pca[:, 0]
+    df["PCA 2"] = X_pca[:, 1]
+
+    return df
+
+
+# 1.2 Clustering
+
+# You'll divide the data points into 2 (or more) clusters
+# based on the principal components and assign a cluster label to each point.
+# Reference:
+# https://scikit-learn.org/stable/modules/clustering.html#clustering
+# https://github.com/bokeh/bokeh/tree/branch-3.1/examples/server/app/clustering
+
+
+def clustering(df, n_clusters=2):
+
+    # select the principal components
+    X_pca = df[["PCA 1", "PCA 2"]]
+    # sets the random seed to 0 so that the result is reproducible
+    np.random.seed(0)
+    # use MiniBatchKMeans to perform the clustering
+    model = cluster.MiniBatchKMeans(n_clusters=n_clusters, n_init=2)
+    model.fit(X_pca)
+    # append the cluster labels to the dataframe
+    y_pred = model.labels_.astype(str)
+    df["Cluster"] = y_pred
+
+    return df
+
+
+# 1.3 Shared state
+
+# The immutable pieces of the app: the data frame with
+# the principal components and the cluster labels,
+# the crossfilter over the numeric features for the histograms (see crossfilter.py),
+# the spatial index of the principal components for the selections (see spatial_index.py),
+# and the order in which the rows are sent to the browser (see `stratified_order`).
+# Sessions must not modify `df` in place, use `session_view` instead.
+
+
+@dataclass(frozen=True)
+class SharedState:
+    df: pd.DataFrame
+    n_clusters: int
+    _lazy: dict = field(default_factory=dict, repr=False)
+    _lazy_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def session_view(self):
+        # A shallow copy shares the column data with the shared frame,
+        # while the columns added by a session stay in that session.
+        return self.df.copy(deep=False)
+
+    @property
+    def numeric_columns(self):
+        return [c for c in self.df.columns if is_numeric_dtype(self.df[c])]
+
+    @property
+    def crossfilter(self):
+        # The bin codes of all the numeric features,
+        # computed when the first histogram is drawn
+        if "crossfilter" not in self._lazy:
+            with self._lazy_lock:
+                if "crossfilter" not in self._lazy:
+                    self._lazy["crossfilter"] = Crossfilter(self.df, self.numeric_columns)
+        return self._lazy["crossfilter"]
+
+    def binned(self, col):
+        return self.crossfilter.feature(col)
+
+    def load_order(self, n_first):
+        # The rows in the order they are loaded into the PCA plot,
+        # the first `n_first` are a sample stratified by 'Cluster'
+        key = ("load_order", n_first)
+        if key not in self._lazy:
+            with self._lazy_lock:
+                if key not in self._lazy:
+                    self._lazy[key] = stratified_order(self.df["Cluster"].to_numpy(), n_first)
+        return self._lazy[key]
+
+    @property
+    def spatial_index(self):
+        # The grid of the points of the PCA plot,
+        # built on the first selection of the image of the PCA plot
+        if "spatial_index" not in self._lazy:
+            with self._lazy_lock:
+                if "spatial_index" not in self._lazy:
+                    self._lazy["spatial_index"] = GridIndex(self.df["PCA 1"], self.df["PCA 2"])
+        return self._lazy["spatial_index"]
+
+
+# The number of rows of each label in a sample of `n_first` rows (exactly),
+# in proportion to the `counts` of the labels (largest remainders first),
+# and at least one row of each label: the rows given to the small labels
+# are taken from the largest quotas.
+# With more labels than `n_first`, the largest labels get one row each.
+def stratified_quota(counts, n_first):
+    n = counts.sum()
+    if len(counts) > n_first:
+        quota = np.zeros(len(counts), dtype=np.int64)
+        quota[np.argsort(-counts, kind="stable")[:n_first]] = 1
+        return quota
+    exact = counts * (n_first / n)
+    quota = np.floor(exact).astype(np.int64)
+    quota[np.argsort(quota - exact, kind="stable")[: n_first - quota.sum()]] += 1
+    quota = np.maximum(quota, 1)
+    for _ in range(quota.sum() - n_first):
+        quota[np.argmax(quota)] -= 1
+    return quota
+
+
+# A permutation of the rows, for loading the rows progressively:
+# the first `n_first` rows are a random sample with the same share of each label
+# (e.g. each cluster) as all the rows (see stratified_quota),
+# the other rows follow in random order,
+# so that the rows loaded so far always look like a smaller version of all of them.
+def stratified_order(labels, n_first, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(labels)
+    if n_first >= n:
+        return rng.permutation(n)
+    order = rng.permutation(n)
+    _, codes = np.unique(labels[order], return_inverse=True)
+    quota = stratified_quota(np.bincount(codes), n_first)
+    # the rank of each row among the rows of its label (in the random order)
+    rank = np.empty(n, dtype=np.int64)
+    by_label = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[by_label], np.arange(len(quota)))
+    rank[by_label] = np.arange(n) - np.repeat(starts, np.bincount(codes))
+    first = rank < quota[codes]
+    return np.concatenate([order[first], order[~first]])
+
+
+# With several server processes (`bokeh serve --num-procs N` and DVC_SHARED_MEMORY=1),
+# the numeric part of the frame (the 102 features, 'PCA 1', 'PCA 2' and 'Cluster')
+# is computed by one process and mapped from shared memory by the others (see dvc_shm.py).
+# Only the 5 categorical columns are kept per process.
+
+
+def build_state(n_clusters=2):
+    pca_data = read_csv_cached(pca_data_url)
+    categorical = pca_data.iloc[:, :5]
+
+    def build_numeric():
+        df = clustering(pca(pca_data.copy()), n_clusters)
+        numeric = df.iloc[:, 5:].copy()
+        # store the cluster labels as numbers, they are turned back into strings below
+        numeric["Cluster"] = numeric["Cluster"].astype(int)
+        return numeric
+
+    numeric = shared_frame(f"pca:{pca_data_url}:{n_clusters}", build_numeric)
+    # 'Cluster' is the last column, slicing the other columns keeps them views of
+    # the (shared) numeric block, unlike dropping 'Cluster'
+    df = pd.concat([categorical, numeric.iloc[:, :-1]], axis=1, copy=False)
+    df["Cluster"] = numeric["Cluster"].astype(int).astype(str).to_numpy()
+    return SharedState(df=df, n_clusters=n_clusters)
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    # Build the state on the first call, later calls return the same object.
+    # The lock makes sure that concurrent first sessions don't build it twice.
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = build_state()
+    return _state
+
+
+def on_server_loaded(server_context):
+    # Build the state when the server starts,
+    # so that even the first session doesn't wait for the download and the PCA
+    get_shared_state()
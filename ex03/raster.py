@@ -0,0 +1,159 @@
+# ====================================================================
+# Server-side rasterization of the PCA scatter plot
+
+# A scatter plot with one glyph per point sends every point to the browser
+# and draws every one of them, which doesn't work for millions of points.
+# Instead, the points in view are binned into a grid of pixels on the server,
+# and the grid is sent as a single RGBA image (`image_rgba`).
+# Each pixel is colored by
+# - the mean of a numeric feature of its points, or
+# - the most frequent category (mode) of a categorical feature of its points,
+# with the same palette, range and scale as the color mapper of the scatter plot
+# (see create_cmap in dvc_ex3_18919688.py),
+# and its opacity grows with the log of the number of its points,
+# so that dense regions stand out like overlapping transparent circles do.
+# The image is rendered again for the new view when the plot is panned or zoomed,
+# so its size (and the payload) depends on the size of the plot, not on the number of points.
+# ====================================================================
+
+# The pixel of each point is a flat index (row * width + column) into the grid,
+# the rows count from the bottom like the rows of an image glyph.
+# Counts, sums and modes are np.bincount over these indices.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/models/glyphs/image_rgba.html
+# https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+
+import numpy as np
+from bokeh.colors import named
+from bokeh.models import CategoricalColorMapper, LogColorMapper
+
+# the opacity of a pixel with a single point and of the densest pixel
+MIN_ALPHA = 0.25
+MAX_ALPHA = 0.9
+# the opacity of the pixels without selected points (while there is a selection)
+NONSELECTION_ALPHA = 0.2
+
+
+def pixel_codes(x, y, x0, x1, y0, y1, width, height):
+    # The pixel of each point in the view (x0, x1) x (y0, y1) of `width` x `height` pixels,
+    # -1 for the points outside of the view (and for missing coordinates)
+    col = np.floor((x - x0) * (width / (x1 - x0)))
+    row = np.floor((y - y0) * (height / (y1 - y0)))
+    inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+    codes = np.full(len(x), -1, dtype=np.int64)
+    codes[inside] = row[inside].astype(np.int64) * width + col[inside].astype(np.int64)
+    return codes
+
+
+def count(codes, n_pixels, subset=None):
+    # The number of points in each pixel (of the points in `subset`, all by default)
+    if subset is not None:
+        codes = codes[subset]
+    return np.bincount(codes[codes >= 0], minlength=n_pixels)
+
+
+def mean(codes, values, n_pixels):
+    # The mean of the (non-missing) values of the points in each pixel, nan for none
+    keep = (codes >= 0) & np.isfinite(values)
+    sums = np.bincount(codes[keep], values[keep], minlength=n_pixels)
+    n = np.bincount(codes[keep], minlength=n_pixels)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / n
+
+
+def mode(codes, categories, n_categories, n_pixels):
+    # The most frequent category (0 ... n_categories - 1) of the points in each pixel, -1 for none
+    keep = (codes >= 0) & (categories >= 0)
+    counts = np.bincount(
+        codes[keep] * n_categories + categories[keep], minlength=n_pixels * n_categories
+    ).reshape(n_pixels, n_categories)
+    return np.where(counts.max(axis=1) > 0, counts.argmax(axis=1), -1)
+
+
+def palette_rgb(palette):
+    # The (r, g, b) of each color of a palette of '#rrggbb' strings or named colors
+    rgb = np.empty((len(palette), 3), dtype=np.uint8)
+    for i, color in enumerate(palette):
+        if color.startswith("#"):
+            rgb[i] = [int(color[k : k + 2], 16) for k in (1, 3, 5)]
+        else:
+            c = getattr(named, color)
+            rgb[i] = [c.r, c.g, c.b]
+    return rgb
+
+
+def category_codes(values, factors):
+    # The index of each value in the (sorted) `factors` of a categorical color mapper, -1 if missing
+    factors = np.asarray(factors)
+    values = np.asarray(values).astype(str)
+    codes = np.searchsorted(factors, values)
+    codes[codes == len(factors)] = 0
+    return np.where(factors[codes] == values, codes, -1)
+
+
+def color_index(agg, mapper):
+    # The palette index of each pixel of `agg` under a continuous color mapper, -1 for nan
+    n = len(mapper.palette)
+    low, high = float(mapper.low), float(mapper.high)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if isinstance(mapper, LogColorMapper):
+            # like Bokeh, values below low (e.g. 0) take the first color
+            low, high = np.log(max(low, np.finfo(float).tiny)), np.log(high)
+            agg = np.log(agg)
+        scaled = (agg - low) / (high - low) if high > low else np.zeros_like(agg)
+    index = np.clip(np.floor(np.nan_to_num(scaled, nan=0.0, neginf=0.0) * n), 0, n - 1).astype(np.int64)
+    return np.where(np.isnan(agg), -1, index)
+
+
+def rgba_image(counts, index, rgb, width, height, selected=None):
+    # The image of `width` x `height` pixels as uint32 (RGBA bytes),
+    # colored by the palette `rgb` at `index` (-1 transparent), opacity by `counts`,
+    # and faded where there are no points of the `selected` counts
+    rgba = np.zeros((width * height, 4), dtype=np.uint8)
+    colored = (counts > 0) & (index >= 0)
+    alpha = np.zeros(len(counts))
+    if colored.any():
+        density = np.log1p(counts) / np.log1p(counts.max())
+        alpha = np.where(colored, MIN_ALPHA + (MAX_ALPHA - MIN_ALPHA) * density, 0.0)
+    if selected is not None and selected.any():
+        alpha = np.where(selected > 0, alpha, alpha * NONSELECTION_ALPHA)
+    rgba[colored, :3] = rgb[index[colored]]
+    rgba[:, 3] = (alpha * 255).astype(np.uint8)
+    # the 4 bytes of a pixel are one uint32 of the image
+    return rgba.view(np.uint32).reshape(height, width)
+
+
+class Rasterizer:
+    # The points (`x`, `y`) of a scatter plot, rendered into images of any view.
+    # `render` only works on arrays, it can run outside of the event loop.
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+
+    def bounds(self, padding=0.05):
+        # The (x0, x1, y0, y1) of all the points with a margin of `padding` times their extent
+        x0, x1 = np.nanmin(self.x), np.nanmax(self.x)
+        y0, y1 = np.nanmin(self.y), np.nanmax(self.y)
+        dx, dy = (x1 - x0) * padding or 1.0, (y1 - y0) * padding or 1.0
+        return x0 - dx, x1 + dx, y0 - dy, y1 + dy
+
+    def render(self, x0, x1, y0, y1, width, height, values, mapper, selected=None):
+        # The RGBA image of the view (x0, x1) x (y0, y1) with `width` x `height` pixels.
+        # `values` is the feature of each point, colored by `mapper`
+        # (the color mapper, i.e. the 'transform', of `create_cmap`):
+        # the mode of the categories for a CategoricalColorMapper, the mean otherwise.
+        # `selected` are the indices of the selected points (highlighted if not empty).
+        width, height = max(int(width), 1), max(int(height), 1)
+        n_pixels = width * height
+        codes = pixel_codes(self.x, self.y, x0, x1, y0, y1, width, height)
+        counts = count(codes, n_pixels)
+        if isinstance(mapper, CategoricalColorMapper):
+            factors = list(mapper.factors)
+            index = mode(codes, category_codes(values, factors), len(factors), n_pixels)
+        else:
+            index = color_index(mean(codes, np.asarray(values, dtype=np.float64), n_pixels), mapper)
+        selected_counts = None
+        if selected is not None and len(selected):
+            selected_counts = count(codes, n_pixels, np.asarray(selected, dtype=np.int64))
+        return rgba_image(counts, index, palette_rgb(mapper.palette), width, height, selected_counts)
@@ -0,0 +1,177 @@
+# ====================================================================
+# Spatial index of the points of the PCA plot
+
+# When the PCA plot is drawn as an image (see raster.py),
+# the browser has no points to select, it only sends the outline
+# of a lasso or a box in data coordinates (the SelectionGeometry event),
+# and the points inside are found on the server.
+# Testing every point against every edge of the lasso costs
+# O(points * edges), about a second for a million points and a long lasso.
+# The GridIndex divides the plane into a uniform grid of cells
+# and keeps the points sorted by cell, so that a selection only tests
+# the points in the cells crossed by the outline:
+# - the cells an edge of the outline passes through (and their neighbors) are boundary cells,
+#   their points are tested one by one,
+# - every other cell is either completely inside or completely outside,
+#   which is decided by its center, and its points are taken (or skipped) as a whole.
+# ====================================================================
+
+# The index is built once per process from the shared principal components (see pca_state.py).
+# The points of cell i are order[offsets[i] : offsets[i + 1]].
+# reference:
+# https://en.wikipedia.org/wiki/Point_in_polygon#Ray_casting_algorithm
+# https://numpy.org/doc/stable/reference/generated/numpy.argsort.html
+
+import numpy as np
+
+# the average number of points per cell
+POINTS_PER_CELL = 64
+MAX_CELLS_PER_AXIS = 1024
+
+
+def points_in_polygon(x, y, px, py):
+    # Which of the points (x, y) are inside the polygon with the vertices (px, py),
+    # by the even-odd rule: a ray from the point to the right crosses an odd number of edges.
+    # The points are sorted by y, so the points whose ray can cross an edge
+    # (min(ya, yb) <= y < max(ya, yb)) are a slice, and each edge only tests its slice.
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    px, py = np.asarray(px, dtype=np.float64), np.asarray(py, dtype=np.float64)
+    order = np.argsort(y, kind="stable")
+    xs, ys = x[order], y[order]
+    lo_y, hi_y = np.minimum(py, np.roll(py, -1)), np.maximum(py, np.roll(py, -1))
+    starts = np.searchsorted(ys, lo_y, side="left")
+    ends = np.searchsorted(ys, hi_y, side="left")
+    inside = np.zeros(len(x), dtype=bool)
+    for xa, ya, xb, yb, start, end in zip(px, py, np.roll(px, -1), np.roll(py, -1), starts, ends):
+        if start < end:
+            inside[start:end] ^= xs[start:end] < xa + (ys[start:end] - ya) * (xb - xa) / (yb - ya)
+    # back to the order of the points
+    result = np.empty(len(x), dtype=bool)
+    result[order] = inside
+    return result
+
+
+class GridIndex:
+    # The points (`x`, `y`) in a grid of about `points_per_cell` points per cell
+    # (on average), points with missing coordinates are never selected.
+
+    def __init__(self, x, y, points_per_cell=POINTS_PER_CELL):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        valid = np.isfinite(self.x) & np.isfinite(self.y)
+        n = max(int(valid.sum()), 1)
+        self.n_cols = self.n_rows = int(np.clip(np.sqrt(n / points_per_cell), 1, MAX_CELLS_PER_AXIS))
+        if valid.any():
+            self.x0, self.x1 = self.x[valid].min(), self.x[valid].max()
+            self.y0, self.y1 = self.y[valid].min(), self.y[valid].max()
+        else:
+            self.x0 = self.x1 = self.y0 = self.y1 = 0.0
+        # cells of a positive size, also for a single point
+        self.cell_width = (self.x1 - self.x0) / self.n_cols or 1.0
+        self.cell_height = (self.y1 - self.y0) / self.n_rows or 1.0
+
+        n_cells = self.n_cols * self.n_rows
+        cells = np.full(len(self.x), n_cells, dtype=np.int64)
+        cells[valid] = self._cell(self.x[valid], self.y[valid])
+        self.order = np.argsort(cells, kind="stable")
+        # the cell of each point in `order`, and the first position of each cell
+        self.sorted_cells = cells[self.order]
+        self.offsets = np.searchsorted(self.sorted_cells, np.arange(n_cells + 1))
+
+    def _cell(self, x, y):
+        col = np.clip(((x - self.x0) / self.cell_width).astype(np.int64), 0, self.n_cols - 1)
+        row = np.clip(((y - self.y0) / self.cell_height).astype(np.int64), 0, self.n_rows - 1)
+        return row * self.n_cols + col
+
+    def _points_of(self, cell_mask):
+        # The indices of the points in the cells of the boolean `cell_mask`
+        # (one entry per cell, plus one for the points without a cell)
+        return self.order[cell_mask[self.sorted_cells]]
+
+    def _clip(self, xa, ya, xb, yb):
+        # The parts of the edges (xa, ya) -> (xb, yb) inside the grid (plus a cell on each side),
+        # as the parameters t0 <= t1 along each edge (t0 > t1 for an edge outside of the grid)
+        # reference: https://en.wikipedia.org/wiki/Liang%E2%80%93Barsky_algorithm
+        dx, dy = xb - xa, yb - ya
+        t0, t1 = np.zeros(len(xa)), np.ones(len(xa))
+        box = (
+            (-dx, xa - (self.x0 - self.cell_width)),
+            (dx, self.x1 + self.cell_width - xa),
+            (-dy, ya - (self.y0 - self.cell_height)),
+            (dy, self.y1 + self.cell_height - ya),
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for p, q in box:
+                r = q / p
+                t0 = np.where(p < 0, np.maximum(t0, r), t0)
+                t1 = np.where(p > 0, np.minimum(t1, r), t1)
+                # parallel to this side of the box and outside of it
+                t1 = np.where((p == 0) & (q < 0), -1.0, t1)
+        return t0, t1
+
+    def boundary_cells(self, px, py):
+        # The cells crossed by the edges of the closed polygon (px, py), and their neighbors.
+        # The edges are clipped to the grid and sampled at half the size of a cell,
+        # so every cell an edge touches is a sampled cell or a neighbor of one,
+        # and an edge has at most about 2 * (n_cols + n_rows) samples however long it is.
+        n_cells = self.n_cols * self.n_rows
+        xa, ya = px, py
+        xb, yb = np.roll(px, -1), np.roll(py, -1)
+        t0, t1 = self._clip(xa, ya, xb, yb)
+        inside = t0 <= t1
+        xa, ya, xb, yb = (
+            xa + t0 * (xb - xa), ya + t0 * (yb - ya),
+            xa + t1 * (xb - xa), ya + t1 * (yb - ya),
+        )
+        steps = np.ceil(
+            2 * np.maximum(np.abs(xb - xa) / self.cell_width, np.abs(yb - ya) / self.cell_height)
+        )
+        # edges outside of the grid have no samples
+        steps = np.where(inside, np.nan_to_num(steps) + 1, -1).astype(np.int64)
+        # the samples of all the edges at once: edge e has steps[e] + 1 samples
+        edge = np.repeat(np.arange(len(px)), steps + 1)
+        t = (np.arange(len(edge)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)) / steps[edge]
+        sx = xa[edge] + t * (xb - xa)[edge]
+        sy = ya[edge] + t * (yb - ya)[edge]
+        col = np.floor((sx - self.x0) / self.cell_width).astype(np.int64)
+        row = np.floor((sy - self.y0) / self.cell_height).astype(np.int64)
+        boundary = np.zeros(n_cells + 1, dtype=bool)
+        for dc in (-1, 0, 1):
+            for dr in (-1, 0, 1):
+                c, r = col + dc, row + dr
+                inside = (c >= 0) & (c < self.n_cols) & (r >= 0) & (r < self.n_rows)
+                boundary[r[inside] * self.n_cols + c[inside]] = True
+        return boundary
+
+    def in_polygon(self, px, py):
+        # The indices (sorted) of the points inside the polygon with the vertices (px, py)
+        px, py = np.asarray(px, dtype=np.float64), np.asarray(py, dtype=np.float64)
+        if len(px) < 3:
+            return np.array([], dtype=np.int64)
+        boundary = self.boundary_cells(px, py)
+        # the other cells are inside or outside as a whole, like their center
+        n_cells = self.n_cols * self.n_rows
+        cols, rows = np.arange(n_cells) % self.n_cols, np.arange(n_cells) // self.n_cols
+        centers_x = self.x0 + (cols + 0.5) * self.cell_width
+        centers_y = self.y0 + (rows + 0.5) * self.cell_height
+        inner = np.zeros(n_cells + 1, dtype=bool)
+        inner[:n_cells] = ~boundary[:n_cells] & points_in_polygon(centers_x, centers_y, px, py)
+
+        candidates = self._points_of(boundary)
+        hits = candidates[points_in_polygon(self.x[candidates], self.y[candidates], px, py)]
+        return np.sort(np.concatenate([self._points_of(inner), hits]))
+
+    def in_box(self, x0, x1, y0, y1):
+        # The indices (sorted) of the points in the box [x0, x1] x [y0, y1]
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        return self.in_polygon([x0, x1, x1, x0], [y0, y0, y1, y1])
+
+    def select(self, geometry):
+        # The indices of the points in the `geometry` of a SelectionGeometry event
+        # (in data coordinates): a lasso or polygon ('poly') or a box ('rect')
+        if geometry.get("type") == "rect":
+            return self.in_box(geometry["x0"], geometry["x1"], geometry["y0"], geometry["y1"])
+        if geometry.get("type") == "poly":
+            return self.in_polygon(geometry["x"], geometry["y"])
+        return np.array([], dtype=np.int64)
@@ -0,0 +1,86 @@
+# ====================================================================
+# Company x year x metric cube of the map app
+
+# The table of the companies has one column per metric and year
+# ('Market Cap 2019', ..., 'Employees 2022', ...).
+# The cube keeps these columns once as a dense float64 array,
+# so that the values of a metric in a year are a contiguous slice
+# (the per-city sums above the market cap threshold are built from these slices
+# and the city codes in company_index.py),
+# instead of selecting, renaming and grouping columns of the data frame.
+# The years and the metrics are discovered from the column names,
+# any number of years (and other yearly metrics) work without changes.
+# ====================================================================
+
+# The values are stored as values[year, metric, company]
+# (the same layout as the frames of dvc_shm.py with the columns ordered by year and metric),
+# so the cube can be a view of a frame in shared memory.
+# Missing combinations of a year and a metric are all nan.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# e.g. 'Market Cap 2021' -> ('Market Cap', 2021)
+YEAR_COLUMN = re.compile(r"^(?P<metric>.+) (?P<year>\d{4})$")
+
+
+def discover_year_columns(columns):
+    # The years (sorted), the metrics (in the order of the columns)
+    # and the column name of each (year, metric)
+    found = {}
+    metrics = []
+    for col in columns:
+        match = YEAR_COLUMN.match(str(col))
+        if match is None:
+            continue
+        metric = match.group("metric")
+        found[(int(match.group("year")), metric)] = col
+        if metric not in metrics:
+            metrics.append(metric)
+    years = sorted({year for year, _ in found})
+    return years, metrics, found
+
+
+def cube_frame(df, years, metrics, found):
+    # The year columns of `df` ordered by year and metric,
+    # named like the original columns, nan for the missing ones
+    columns = {}
+    for year in years:
+        for metric in metrics:
+            name = found.get((year, metric))
+            columns[f"{metric} {year}"] = df[name].to_numpy(dtype=np.float64) if name else np.nan
+    return pd.DataFrame(columns, index=df.index)
+
+
+class CompanyCube:
+    # `frame` holds the columns of `cube_frame(...)` (e.g. mapped from shared memory),
+    # `city` the city of each company (missing cities are left out of the sums).
+    # The cities are numbered in sorted order, like the groups of `groupby('City')`.
+
+    def __init__(self, frame, years, metrics, city):
+        self.years = list(years)
+        self.metrics = list(metrics)
+        self._year = {year: i for i, year in enumerate(self.years)}
+        self._metric = {metric: i for i, metric in enumerate(self.metrics)}
+        # The frame keeps its columns as rows of a 2D block,
+        # so the transpose and the reshape are views in the usual case
+        values = frame.to_numpy(dtype=np.float64).T
+        self.values = values.reshape(len(self.years), len(self.metrics), len(frame))
+
+        city = pd.Series(city).astype("category")
+        self.cities = city.cat.categories
+        self.city_codes = city.cat.codes.to_numpy(dtype=np.int64)
+
+    def __len__(self):
+        return self.values.shape[2]
+
+    @property
+    def n_cities(self):
+        return len(self.cities)
+
+    def column(self, year, metric):
+        # The values of `metric` in `year` of all the companies (a view)
+        return self.values[self._year[year], self._metric[metric]]
+
@@ -0,0 +1,123 @@
+# ====================================================================
+# Index of the companies for the market cap threshold of the map app
+
+# The main plot shows, per city, the sums of 'Market Cap' and 'Employees'
+# and the number of the companies with a market cap of at least the threshold.
+# Instead of filtering and grouping all the companies for every threshold,
+# the companies of each city are sorted by market cap once per year,
+# and the cumulative sums along this order are kept.
+# The companies of a city above a threshold are then a suffix of its block,
+# found with a binary search, and their sums are
+# the difference of two cumulative sums.
+# A threshold costs O(cities * log(companies)) instead of a full groupby.
+# The index also keeps the row indices of the companies of each city
+# ("posting lists"), so that the companies of a city are found
+# in time proportional to their number instead of by a scan of the 'City' column.
+# ====================================================================
+
+# Like the filtering in dvc_ex4_18919688.py,
+# companies without a market cap (nan) are never filtered out,
+# and missing values count as 0 in the sums.
+# reference:
+# https://numpy.org/doc/stable/reference/generated/numpy.searchsorted.html
+# https://numpy.org/doc/stable/reference/generated/numpy.lexsort.html
+
+import numpy as np
+
+
+class ThresholdIndex:
+    # The index of one year.
+    # `city_codes` are the codes 0 ... n_cities - 1 of the city of each company (-1 for none),
+    # `market_cap`, `employees` and `has_symbol` are the columns of this year.
+
+    def __init__(self, city_codes, n_cities, market_cap, employees, has_symbol):
+        city_codes = np.asarray(city_codes, dtype=np.int64)
+        market_cap = np.asarray(market_cap, dtype=np.float64)
+        employees = np.nan_to_num(np.asarray(employees, dtype=np.float64))
+        has_symbol = np.asarray(has_symbol, dtype=np.float64)
+        self.n_cities = n_cities
+
+        # the companies without a market cap are always counted
+        known = np.isfinite(market_cap) & (city_codes >= 0)
+        always = ~np.isfinite(market_cap) & (city_codes >= 0)
+        self.always_employees = np.bincount(city_codes[always], employees[always], minlength=n_cities)
+        self.always_count = np.bincount(city_codes[always], has_symbol[always], minlength=n_cities)
+
+        # The companies with a market cap, sorted by city and then by market cap.
+        # The market caps are replaced by their ranks among all the market caps,
+        # so that (city, rank) is a single exact integer key.
+        codes, caps = city_codes[known], market_cap[known]
+        self.caps = np.unique(caps)
+        ranks = np.searchsorted(self.caps, caps)
+        self.stride = len(self.caps) + 1
+        keys = codes * self.stride + ranks
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        # the first position of the block of each city
+        self.city_starts = np.searchsorted(self.keys, np.arange(n_cities + 1) * self.stride)
+
+        # cumulative sums with a leading 0, the sum of the positions i ... j - 1 is cum[j] - cum[i]
+        def cumsum(values):
+            return np.concatenate([[0.0], np.cumsum(values[order])])
+
+        self.cum_market_cap = cumsum(caps)
+        self.cum_employees = cumsum(employees[known])
+        self.cum_count = cumsum(has_symbol[known])
+
+    def aggregate(self, market_cap_lower):
+        # The sums of 'Market Cap' and 'Employees' and the number of companies ('Symbol')
+        # per city, over the companies with a market cap of at least `market_cap_lower`
+        rank = np.searchsorted(self.caps, market_cap_lower, side="left")
+        cities = np.arange(self.n_cities)
+        # the first position in the block of each city with a market cap >= the threshold
+        first = np.searchsorted(self.keys, cities * self.stride + rank)
+        end = self.city_starts[1:]
+        return {
+            "Market Cap": self.cum_market_cap[end] - self.cum_market_cap[first],
+            "Employees": self.cum_employees[end] - self.cum_employees[first] + self.always_employees,
+            "Symbol": (self.cum_count[end] - self.cum_count[first] + self.always_count).astype(np.int64),
+        }
+
+
+class CompanyIndex:
+    # The threshold indexes of all the years of a CompanyCube (see company_cube.py),
+    # built when a year is first asked for.
+    # `has_symbol` tells which companies are counted.
+    # The cities are numbered like in the cube, in sorted order.
+
+    def __init__(self, cube, has_symbol):
+        self.cube = cube
+        self.cities = cube.cities
+        self.city_codes = cube.city_codes
+        self.has_symbol = np.asarray(has_symbol, dtype=bool)
+        self._years = {}
+
+        # The row indices of the companies of city i are
+        # city_rows[city_offsets[i] : city_offsets[i + 1]], in the order of the table.
+        # Companies without a city (code -1) sort first and are left out.
+        self.city_rows = np.argsort(self.city_codes, kind="stable")
+        self.city_offsets = np.searchsorted(
+            self.city_codes[self.city_rows], np.arange(len(self.cities) + 1)
+        )
+
+    def rows(self, city):
+        # The row indices (positions) of the companies in `city`
+        try:
+            code = self.cities.get_loc(city)
+        except KeyError:
+            return self.city_rows[:0]
+        return self.city_rows[self.city_offsets[code] : self.city_offsets[code + 1]]
+
+    def year(self, year):
+        if year not in self._years:
+            self._years[year] = ThresholdIndex(
+                self.city_codes,
+                len(self.cities),
+                self.cube.column(year, "Market Cap"),
+                self.cube.column(year, "Employees"),
+                self.has_symbol,
+            )
+        return self._years[year]
+
+    def aggregate(self, year, market_cap_lower):
+        return self.year(year).aggregate(market_cap_lower)
@@ -0,0 +1,153 @@
+# ====================================================================
+# Process-wide state of the company map app
+
+# Bokeh server runs the app script again for every new session,
+# so anything the script builds is rebuilt on every connection.
+# The table of the companies, the company cube, the threshold index,
+# the grid pyramid of the cities and the memoized data frames
+# don't depend on the session, they are built once per server process
+# in this module and shared by all the sessions.
+# ====================================================================
+
+# The state is built by the first session that asks for it (`get_shared_state`),
+# or when the server starts if `on_server_loaded` is used as a lifecycle hook.
+# Everything in it is read-only for the sessions:
+# the memoized data frames must not be modified,
+# assigning them to `ColumnDataSource.data` copies them.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/server/app.html#lifecycle-hooks
+# https://docs.python.org/3/library/functools.html#functools.lru_cache
+
+import os
+import sys
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# import the shared data access layer from the repository root,
+# which keeps a local snapshot of the remote CSV
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_data import read_csv_cached
+from dvc_shm import shared_frame
+
+from company_cube import CompanyCube, cube_frame, discover_year_columns
+from company_index import CompanyIndex
+from map_pyramid import MapPyramid
+
+company_data_url = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vStUglUExt-kL-fVYcit-h4-V1Vg3HUkvDEV6KwZGw_6r46duWKYx9ZGI5Bctkrv05DF0nEWYqR14Qb/pub?gid=860901304&single=true&output=csv'
+
+# Earth radius in meters (web Mercator)
+k = 6378137
+
+
+class CompanyState:
+
+    def __init__(self, url=company_data_url):
+        us_company_map = read_csv_cached(url)
+
+        # The yearly columns ('Market Cap YYYY', 'Employees YYYY', ...) are the bulk of the table.
+        # They are found by their names and kept once as a dense
+        # company x year x metric cube (see company_cube.py),
+        # so the values of any year are a slice of the cube;
+        # `companies` only keeps the other columns.
+        # When the app runs in several server processes (`bokeh serve --num-procs N`
+        # with DVC_SHARED_MEMORY=1), the cube is published once into shared memory
+        # and every process maps it instead of keeping its own copy (see dvc_shm.py).
+        self.years, self.metrics, year_columns = discover_year_columns(us_company_map.columns)
+        self.cube = CompanyCube(
+            shared_frame(f"companies:{url}", lambda: cube_frame(us_company_map, self.years, self.metrics, year_columns)),
+            self.years, self.metrics, us_company_map["City"])
+        companies = us_company_map.drop(columns=list(year_columns.values()))
+
+        # Convert the longitude and latitude (degrees) of the cities
+        # in the columns 'lng' and 'lat' to web Mercator coordinates (meters)
+        # in the columns 'x' and 'y'.
+        # https://stackoverflow.com/questions/14329691/convert-latitude-longitude-point-to-a-pixels-x-y-on-mercator-projection
+        companies["x"] = companies.lng * (k * np.pi/180.0)
+        companies["y"] = np.log(np.tan((90 + companies.lat) * np.pi/360.0)) * k
+        self.companies = companies
+
+        # The location of a city doesn't depend on the filter, it is averaged once.
+        # The sums and counts above the market cap threshold come from
+        # the sorted cumulative sums of the companies of each city (see company_index.py),
+        # so moving the slider doesn't group all the companies again.
+        self.company_index = CompanyIndex(self.cube, companies["Symbol"].notna())
+        self.city_xy = companies.groupby('City')[['x', 'y']].mean()
+
+        # The cities close to each other are merged into one marker (see map_pyramid.py),
+        # the cities are in the same order in `city_xy` and in `company_index`.
+        self.city_pyramid = MapPyramid(
+            self.city_xy['x'], self.city_xy['y'], weight=np.diff(self.company_index.city_offsets))
+
+        # The memoized data frames of this state
+        # (the same (year, city, market_cap_lower) come back again and again,
+        # e.g. every loop of the animation, in every session)
+        self.aggregate_cities = lru_cache(maxsize=64)(self._aggregate_cities)
+        self.create_dfs = lru_cache(maxsize=256)(self._create_dfs)
+
+    def filter_companies(self, rows, year, market_cap_lower):
+
+        # Take 'Symbol', 'City', 'x', 'y', and Market Cap, Employees in this `year`
+        # of the companies in the `rows` (positions).
+        # Market Cap and Employees in this `year` are slices of the cube,
+        # in the columns 'Market Cap' and 'Employees'.
+        df = self.companies.iloc[rows][["Symbol", "City", "x", "y"]]
+        df['Market Cap'] = self.cube.column(year, 'Market Cap')[rows]
+        df['Employees'] = self.cube.column(year, 'Employees')[rows]
+
+        # Find the companies with Market Cap below `market_cap_lower` (note the nan values)
+        # and replace their 'Symbol', 'Market Cap', and 'Employees' with `np.nan`.
+        # A nan Market Cap is not below the lower bound, so these companies are kept.
+        below = (df['Market Cap'] < market_cap_lower).to_numpy()
+        df.loc[below, ['Symbol', 'Market Cap', 'Employees']] = np.nan
+        # Calculate 'circle_size' which is proportional to the log of 'Employees'
+        # (no employees give no circle)
+        with np.errstate(divide='ignore'):
+            df['circle_size'] = np.log10(df['Employees'])
+
+        return df
+
+    # For the main plot, the companies are grouped by 'City':
+    # 'Market Cap' and 'Employees' are summed up,
+    # 'x' and 'y' are averaged, and 'Symbol' is counted.
+    def _aggregate_cities(self, year, market_cap_lower):
+        sums = self.company_index.aggregate(year, market_cap_lower)
+        main_df = pd.DataFrame({
+            'Market Cap': sums['Market Cap'],
+            'Employees': sums['Employees'],
+            'x': self.city_xy['x'].to_numpy(),
+            'y': self.city_xy['y'].to_numpy(),
+            'Symbol': sums['Symbol']},
+            index=self.city_xy.index)
+        # ('circle_size' of the markers is computed in `main_data` of the app,
+        # after the cities are merged into the markers of the map view)
+        return main_df
+
+    def _create_dfs(self, year, city, market_cap_lower):
+        main_df = self.aggregate_cities(year, market_cap_lower)
+        # For the subplot, find the companies in the selected `city`.
+        # Only these companies are taken and filtered, by their row indices
+        # (see company_index.py) instead of a scan of the 'City' column.
+        sub_df = self.filter_companies(self.company_index.rows(city), year, market_cap_lower)
+        return main_df, sub_df
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    # Build the state on the first call, later calls return the same object
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = CompanyState()
+    return _state
+
+
+def on_server_loaded(server_context):
+    # Build the state when the server starts, before the first session is opened
+    get_shared_state()
@@ -24,8 +24,13 @@
 # Setting up:
 # This script runs with Bokeh version 3.1.0
 
+import os
+import sys
+from functools import partial
+
 import pandas as pd
 import numpy as np
+from bokeh.events import RangesUpdate
 from bokeh.io import curdoc
 from bokeh.layouts import column, row
 from bokeh.models import ColorBar, Div, Range1d, WMTSTileSource
@@ -33,15 +38,27 @@ from bokeh.plotting import figure
 from bokeh.transform import log_cmap
 from bokeh.palettes import Turbo256
 from bokeh.models import (ColumnDataSource, NumeralTickFormatter, 
-                          HoverTool, Label, Button, Slider, Text, LogTicker)
+                          HoverTool, LabelSet, Button, Slider, Text, LogTicker,
+                          CustomJS, CDSView, CustomJSFilter)
+
+# import the server helpers from the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_server import BackgroundWork, Debounced, FrameScheduler, format_stats, on_settled_change
+
+from company_state import get_shared_state
+from tile_cache import local_tile_url
 
 # ====================================================================
 # Task 1: Data Processing
 # ====================================================================
 
-# Read the raw data and inspect the rows and columns
-url = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vStUglUExt-kL-fVYcit-h4-V1Vg3HUkvDEV6KwZGw_6r46duWKYx9ZGI5Bctkrv05DF0nEWYqR14Qb/pub?gid=860901304&single=true&output=csv'
-us_company_map = pd.read_csv(url)
+# The data, the company cube, the index of the market cap threshold
+# and the grid pyramid of the cities are the same for all the sessions.
+# They are built once per server process in company_state.py,
+# which also memoizes the data frames of the plots for all the sessions.
+state = get_shared_state()
+us_company_map = state.companies
+years, cube, company_index = state.years, state.cube, state.company_index
 
 # The part of plotting the map is not required in the tasks.
 # To learn more about it, you are recommended to go through the contents in
@@ -49,15 +66,8 @@ us_company_map = pd.read_csv(url)
 # https://nbviewer.org/github/bokeh/bokeh-notebooks/blob/master/tutorial/09%20-%20Geographic%20Plots.ipynb
 
 # The longitude and latitude (degrees) of the cities
-# are in the column 'lng' and 'lat' respectively.
-# In order to plot the cities on the map,
-# You need to convert them to web Mercator coordinates (meters)
-# and store them in the columns 'x' and 'y' respectively.
-# A brief explanation of web Mercator projection:
-# https://stackoverflow.com/questions/14329691/convert-latitude-longitude-point-to-a-pixels-x-y-on-mercator-projection
-k = 6378137 # Earth radius in meters
-us_company_map["x"] = us_company_map.lng * (k * np.pi/180.0)
-us_company_map["y"] = np.log(np.tan((90 + us_company_map.lat) * np.pi/360.0)) * k
+# are converted to web Mercator coordinates (meters)
+# in the columns 'x' and 'y' of `us_company_map` (see company_state.py).
 
 # Specify the WMTS (Web Map Tile Service) Tile Source to create the map
 # reference:
@@ -72,15 +82,33 @@ tile_options = {
         under <a href="http://www.openstreetmap.org/copyright">ODbL</a>.
     """
 }
+# The browser loads the tiles through a local tile cache (see tile_cache.py),
+# which prefetches the tiles around the cities in the background.
+offset = 200 * 1000
+tile_options['url'] = local_tile_url(
+    tile_options['url'],
+    bbox=(us_company_map.x.min() - offset, us_company_map.y.min() - offset,
+          us_company_map.x.max() + offset, us_company_map.y.max() + offset))
 tile_source = WMTSTileSource(**tile_options)
 
 # Set the initial values of the `year``, 
 # the `city`` to show in the subplot,
 # and the lower bound of market cap in the slide.
-year = 2022
+# (the last year of the data, the years are found from the columns, see company_cube.py)
+year = years[-1]
 city = 'San Jose'
 market_cap_lower = 0
 
+# SLIDER_MODE = 'server': every move of the slider is sent to the server,
+# which filters the companies and sends the new data back (3.3).
+# SLIDER_MODE = 'client': the data of all the companies is sent to the browser once,
+# and the browser filters and sums them up itself (3.4).
+# With more than CLIENT_FILTER_MAX_VALUES values (companies x years)
+# the server filters them anyway.
+SLIDER_MODE = 'client'
+CLIENT_FILTER_MAX_VALUES = 500_000
+client_filter = SLIDER_MODE == 'client' and len(cube) * len(years) <= CLIENT_FILTER_MAX_VALUES
+
 ## 1.1 Define a function create the data frames for the main plot and subplot.
 
 # According to the specified `year`, `city`, and `market_cap_lower`,
@@ -88,50 +116,67 @@ market_cap_lower = 0
 # do processing and calculation, and return the data frames for the plots.
 # When these values change, this function will be called to create new data frames. 
 
-def set_nan(row):
-    if row['Market Cap'] < market_cap_lower:
-        row['Symbol'] = np.nan
-        row['Market Cap'] = np.nan
-        row['Employees'] = np.nan
-    return row
+# The filtering is done on whole columns at once (instead of `df.apply` row by row),
+# and the sums of the cities come from the sorted cumulative sums of
+# the companies of each city (see company_index.py).
+# The results are memoized for all the sessions of the server process,
+# since the same (year, city, market_cap_lower) come back again and again
+# (e.g. every loop of the animation), see company_state.py.
+# The cached data frames must not be modified,
+# assigning them to `ColumnDataSource.data` copies them.
+aggregate_cities = state.aggregate_cities
+create_dfs = state.create_dfs
+city_xy = state.city_xy
 
 def create_df(year, city, market_cap_lower, main=True):
-    
-    # Take 'Symbol', 'City', 'x', 'y', and Market Cap, Employees in this `year`.
-    # Rename the columns of Market Cap and Employees in this `year` 
-    # to 'Market Cap' and 'Employees'.
-    df = us_company_map[["Symbol", "City", "x", "y", f"Market Cap {year}", f"Employees {year}"]]
-    df = df.rename(columns={f"Market Cap {year}": 'Market Cap', f"Employees {year}": 'Employees'})
-
-
-    # Find the companies with Market Cap below `market_cap_lower` (note the nan values)
-    # and replace their 'Symbol', 'Market Cap', and 'Employees' with `np.nan`.
-    df = df.apply(set_nan)
-    
-    # For the main plot, group the companies by 'City' and aggregate the data.
-    # 'Market Cap' and 'Employees' are summed up,
-    # 'x' and 'y' are averaged, and 'Symbol' is counted.
-    # reference:
-    # https://stackoverflow.com/questions/70879727/apply-same-aggregation-on-multiple-columns-when-using-groupby-python    
-    if main:
-        df_plot = df.groupby('City').agg({
-            'Market Cap': 'sum',
-            'Employees': 'sum',
-            'x': 'mean',
-            'y': 'mean',
-            'Symbol': 'count'})
-
-    # For the subplot, find the companies in the selected `city`
-    else:
-        df_plot = df.loc[df["City"] == city]
-    # Calculate 'circle_size' which is proportional to the log of 'Employees'
-    df['circle_size'] = np.log10(df['Employees']) # TODO: Change log scale?
-    
-    return df_plot
+    main_df, sub_df = create_dfs(year, city, market_cap_lower)
+    return main_df if main else sub_df
+
+# The data frames shown in `year` for `city` and `market_cap_lower`.
+# With the client-side filter (3.4), the subplot gets all the companies of the city
+# and the browser hides the ones below the threshold.
+def plot_dfs(year, city, market_cap_lower):
+    main_df, sub_df = create_dfs(year, city, market_cap_lower)
+    if client_filter:
+        sub_df = create_dfs(year, city, -np.inf)[1]
+    return main_df, sub_df
 
 # Create the initial data frames for the main and subplot
-main_df = create_df(year, city, market_cap_lower)
-sub_df = create_df(year, city, market_cap_lower, main=False)
+main_df, sub_df = plot_dfs(year, city, market_cap_lower)
+
+## 1.2 Define a function to create the markers of the main plot from the data frame.
+
+# With many cities, the circles of the cities close to each other
+# are merged into one (see map_pyramid.py): the sums of 'Market Cap', 'Employees'
+# and 'Symbol' (the number of companies) of the cities in a cell of a grid,
+# at the mean location of these cities.
+# The size of the cells depends on the visible part of the map (`map_view`),
+# so that at most MAX_MARKERS circles are in view.
+# 'City' is the city with the most companies in the cell (which is shown when it is tapped),
+# 'Cities' the number of cities in the cell.
+# The cities are in the same order in `city_xy` and in `company_index`.
+# `view` is `map_view` or a copy of it (for the updates computed in the background, see 3.0).
+city_pyramid = state.city_pyramid
+
+# The initial view shows all the cities, with a margin of 200 km
+offset = 200 * 1000
+map_view = dict(zip(['level', 'cells', 'covered'], city_pyramid.view(
+    main_df["x"].min() - offset, main_df["y"].min() - offset,
+    main_df["x"].max() + offset, main_df["y"].max() + offset)))
+
+def main_data(main_df, view=map_view):
+    level, cells = view['level'], view['cells']
+    data = city_pyramid.aggregate(level, cells, {
+        col: main_df[col].to_numpy() for col in ['Market Cap', 'Employees', 'Symbol']})
+    data['Symbol'] = data['Symbol'].astype(np.int64)
+    data['City'] = city_xy.index.to_numpy()[level.representative[cells]]
+    data['Cities'] = level.n_cities[cells]
+    data['x'] = level.x[cells]
+    data['y'] = level.y[cells]
+    # Calculate 'circle_size' which is proportional to the log of 'Employees'
+    with np.errstate(divide='ignore'):
+        data['circle_size'] = np.log10(data['Employees'])
+    return data
 
 # ====================================================================
 # Task 2: Visualization
@@ -147,7 +192,7 @@ sub_df = create_df(year, city, market_cap_lower, main=False)
 
 def plot_city(main_df, tile_source):
 
-    main_source = ColumnDataSource(main_df)
+    main_source = ColumnDataSource(main_data(main_df))
     
     # Set the x and y ranges of the map initially shown in the main plot
     # to be slightly larger (e.g. 200 km) than the (min, max) of 'x' and 'y'.
@@ -193,7 +238,7 @@ def plot_city(main_df, tile_source):
     # Note that each of these companies has a market cap in the current `year` 
     # larger than the lower bound set by the slider.
     hover_city = HoverTool()
-    hover_city.tooltips= [ ('City', '@City'), ('Number of Companies', '@Symbol')]
+    hover_city.tooltips= [ ('City', '@City'), ('Number of Cities', '@Cities'), ('Number of Companies', '@Symbol')]
     hover_city.renderers = [c]        
     p.add_tools(hover_city)
 
@@ -204,9 +249,12 @@ main_plot = plot_city(main_df, tile_source)
 # Add the label on the left bottom corner of the main plot
 # that shows the current `year`.
 # It will be updated when the `year` changes.
-label = Label(x=0, y=0, x_units='screen', y_units='screen',
-              text=f"Year: {year}",
-              text_font_size='10pt', text_color='black')
+# The text is kept in a data source, so that the client-side animation (4.3)
+# can change it without sending the change back to the server.
+year_source = ColumnDataSource(data={'x': [0], 'y': [0], 'text': [f"Year: {year}"], 'year': [year]})
+label = LabelSet(x='x', y='y', x_units='screen', y_units='screen',
+                 text='text', source=year_source,
+                 text_font_size='10pt', text_color='black')
 
 main_plot.add_layout(label)
 
@@ -220,8 +268,8 @@ main_plot.add_layout(label)
 # of the company respectively.
 
 # Find the (min, max) of 'Market Cap' and 'Employees' in us_company_map
-markt_max, markt_min = np.nanmax(us_company_map[f"Market Cap {year}"]), np.nanmin(us_company_map[f"Market Cap {year}"])
-emp_max, emp_min = np.nanmax(us_company_map[f"Employees {year}"]), np.nanmin(us_company_map[f"Employees {year}"])
+markt_max, markt_min = np.nanmax(cube.column(year, 'Market Cap')), np.nanmin(cube.column(year, 'Market Cap'))
+emp_max, emp_min = np.nanmax(cube.column(year, 'Employees')), np.nanmin(cube.column(year, 'Employees'))
 
 def plot_company(sub_df):
     
@@ -295,6 +343,55 @@ subplot = plot_company(sub_df)
 # Task 3: Interaction
 # ====================================================================
 
+## 3.0 Compute the updates in the background
+
+# The data of the plots is computed in a thread pool (see dvc_server.py),
+# not in the callbacks, so a slow update of one session
+# doesn't hold up the other sessions of the server process.
+# A computation gets the state it depends on as arguments (not the globals,
+# which may change while it runs), and its result is applied to the data sources
+# on the event loop, unless a newer update of the same plot has been submitted in the meantime.
+
+work = BackgroundWork(curdoc())
+
+# The version of the data of each plot: it changes with everything the rows
+# of the plot depend on except the year (the map view and the threshold for the main plot,
+# the city and the threshold for the subplot).
+# The data sources of the plots and the frames of the animation (4.3) are stamped
+# with the version they were computed for (in `tags`),
+# so the browser only swaps in the frames of the rows it shows.
+versions = {'main': 0, 'sub': 0}
+
+def new_version(*plots):
+    for plot in plots:
+        versions[plot] += 1
+
+def compute_main(year, market_cap_lower, view):
+    return main_data(aggregate_cities(year, market_cap_lower), view), marker_data(view)
+
+def apply_main(version, result):
+    data, markers = result
+    main_plot.renderers[1].data_source.data = data
+    main_plot.renderers[1].data_source.tags = [version]
+    if client_filter:
+        company_markers.data = markers
+
+def update_main():
+    work.submit('main', partial(compute_main, year, market_cap_lower, dict(map_view)),
+                partial(apply_main, versions['main']))
+
+def compute_sub(year, city, market_cap_lower):
+    return plot_dfs(year, city, market_cap_lower)[1]
+
+def apply_sub(city, version, sub_df):
+    subplot.renderers[0].data_source.data = sub_df
+    subplot.renderers[0].data_source.tags = [version]
+    subplot.title.text = f"Companies in {city}"
+
+def update_sub():
+    work.submit('sub', partial(compute_sub, year, city, market_cap_lower),
+                partial(apply_sub, city, versions['sub']))
+
 ## 3.1 Define a callback function for the tap tool in the main plot
 
 # When a city is selected on the main plot by the tap tool, 
@@ -308,23 +405,48 @@ def tap_update(attr, old, new):
     if new:
         global city
         # get the selected city name from the main plot
-        city = main_plot.renderers[1].data_source.selected['1d']['indices'][0]
-        # update the data source of the glyphs in the subplot
-        sub_df = create_df(year, city, market_cap_lower, False)
-        subplot.renderers[1].data_source.data = sub_df
-        # update the title of the subplot
-        subplot.title.text = f"Companies in {city}"
+        city = main_plot.renderers[1].data_source.data['City'][new[0]]
+        # update the data source of the glyphs in the subplot and its title
+        new_version('sub')
+        update_sub()
+        update_frames()
 
 main_plot.renderers[1].data_source.selected.on_change("indices", tap_update)
 
-## 3.2 Add a slider and define a callback function for it to filter companies by the market cap
+## 3.2 Define a callback function for the zoom and pan of the main plot
+
+# When the visible part of the map changes,
+# the markers of the level of the grid that fits this part are shown (see 1.2).
+# Nothing is sent while the level stays the same
+# and the visible part stays inside the part that is already covered.
+# The range updates of a pan or zoom are coalesced (see dvc_server.py),
+# during a long pan the markers are still updated twice a second.
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/reference/events.html#bokeh.events.RangesUpdate
+
+def update_map_view(event):
+    x0, y0, x1, y1 = event.x0, event.y0, event.x1, event.y1
+    cx0, cy0, cx1, cy1 = map_view['covered']
+    level = city_pyramid.level_for(x0, y0, x1, y1)
+    if level is map_view['level'] and cx0 <= x0 and x1 <= cx1 and cy0 <= y0 and y1 <= cy1:
+        return
+    level, cells, covered = city_pyramid.view(x0, y0, x1, y1)
+    map_view.update(level=level, cells=cells, covered=covered)
+    new_version('main')
+    update_main()
+    update_frames()
+
+main_plot.on_event(RangesUpdate, Debounced(curdoc(), update_map_view, max_wait_ms=500).event)
+
+## 3.3 Add a slider and define a callback function for it to filter companies by the market cap
 
 # When the user changes the value of the lower bound of the market cap,
 # the companies will be filtered by the new value,
 # so that only those with a market cap larger than 
 # the lower bound are included.
 # The data source of the glyphs in the main plot 
-# and the subplot will be updated accordingly.
+# and the subplot will be updated accordingly,
+# once the slider is released (`value_throttled`), not for every value while dragging.
 # reference:
 # https://github.com/bokeh/bokeh/blob/branch-3.1/examples/server/app/sliders.py
 
@@ -338,14 +460,112 @@ slider = Slider(
 
 def slider_update(attr, old, new):
     global market_cap_lower
-    market_cap_lower = new,
-    main_df = create_df(year, city, market_cap_lower),
-    main_plot.renderers[1].data_source.data = main_df
-    sub_df = create_df(year, city, market_cap_lower, False),
-    subplot.renderers[1].data_source.data = sub_df
-
-
-slider.on_change("value", slider_update)
+    market_cap_lower = new
+    new_version('main', 'sub')
+    update_main()
+    update_sub()
+    update_frames()
+
+
+## 3.4 Client-side filtering
+
+# The market cap and the number of employees of all the companies in all the years
+# are sent to the browser once (`companies_source`), together with the marker
+# of the main plot that each company belongs to (`company_markers`, -1 if not shown,
+# sent again when the markers change).
+# When the slider moves, a JavaScript callback sums up the companies above the threshold
+# per marker and a JavaScript filter hides the companies below it in the subplot,
+# so moving the slider doesn't wait for the server.
+# When the slider is released, the server takes over the threshold
+# (for the next tap, zoom or year).
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/basic/data.html#customjsfilter
+
+companies_source = ColumnDataSource()
+company_markers = ColumnDataSource()
+
+def marker_data(view=map_view):
+    if not client_filter:
+        return None
+    level, cells = view['level'], view['cells']
+    marker_of_cell = np.full(len(level), -1)
+    marker_of_cell[cells] = np.arange(len(cells))
+    codes = cube.city_codes
+    return {'marker': np.where(codes >= 0, marker_of_cell[level.codes[codes]], -1)}
+
+if client_filter:
+    companies_source.data = {'Symbol': company_index.has_symbol.astype(np.int8)}
+    for y in years:
+        companies_source.data[f'Market Cap {y}'] = cube.column(y, 'Market Cap')
+        companies_source.data[f'Employees {y}'] = cube.column(y, 'Employees')
+    company_markers.data = marker_data()
+
+filter_markers = CustomJS(
+    args=dict(
+        companies=companies_source,
+        markers=company_markers,
+        main_source=main_plot.renderers[1].data_source,
+        sub_source=subplot.renderers[0].data_source,
+        year_source=year_source,
+    ),
+    code="""
+    const threshold = cb_obj.value
+    const year = year_source.data.year[0]
+    const cap = companies.data[`Market Cap ${year}`]
+    const emp = companies.data[`Employees ${year}`]
+    const symbol = companies.data.Symbol
+    const marker = markers.data.marker
+    const n = main_source.get_length()
+    const market_cap = new Float64Array(n)
+    const employees = new Float64Array(n)
+    const count = new Float64Array(n)
+    for (let i = 0; i < marker.length; i++) {
+        const m = marker[i]
+        // like on the server, the companies without a market cap are kept
+        if (m < 0 || m >= n || cap[i] < threshold)
+            continue
+        if (!isNaN(cap[i]))
+            market_cap[m] += cap[i]
+        if (!isNaN(emp[i]))
+            employees[m] += emp[i]
+        count[m] += symbol[i]
+    }
+    main_source.data['Market Cap'] = market_cap
+    main_source.data['Employees'] = employees
+    main_source.data['Symbol'] = count
+    main_source.data['circle_size'] = employees.map(Math.log10)
+    main_source.change.emit()
+    // recompute the filter of the subplot
+    sub_source.change.emit()
+    """)
+
+filter_companies_js = CustomJSFilter(
+    args=dict(slider=slider),
+    code="""
+    const threshold = slider.value
+    const cap = source.data['Market Cap']
+    const indices = []
+    for (let i = 0; i < cap.length; i++)
+        if (!(cap[i] < threshold))
+            indices.push(i)
+    return indices
+    """)
+
+# (the sums of the main plot in the browser are already the ones of the new threshold,
+# and the subplot has all the companies of the city, whatever the threshold)
+def slider_release(attr, old, new):
+    global market_cap_lower
+    market_cap_lower = new
+    new_version('main')
+    main_plot.renderers[1].data_source.tags = [versions['main']]
+    update_frames()
+
+if client_filter:
+    subplot.renderers[0].view = CDSView(filter=filter_companies_js)
+    slider.js_on_change('value', filter_markers)
+    slider.on_change('value_throttled', slider_release)
+else:
+    on_settled_change(slider, slider_update)
 
 # ====================================================================
 # Task 4: Animation
@@ -357,25 +577,32 @@ slider.on_change("value", slider_update)
 # https://github.com/bokeh/bokeh/tree/branch-3.1/examples/server/app/gapminder
 
 btn = Button(
-    label = "► Play'"
+    label = "► Play"
 )
 
+# ANIMATION_MODE = 'server': the server updates the plots every second (4.1, 4.2).
+# ANIMATION_MODE = 'client': all the years are sent to the browser once,
+# and the browser steps through them (4.3).
+ANIMATION_MODE = 'client'
+ANIMATION_INTERVAL = 1000 # ms
+
 ## 4.1 Define a function to update the elements that change along with the year.
 
-# The `year` will be incremented by 1 till the last year (2022), 
-# then go back to the first year (2019).
+# The `year` will be incremented by 1 till the last year (e.g. 2022), 
+# then go back to the first year (e.g. 2019).
 # The year in the main plot and the title of the subplot will be updated accordingly.
 # The data source of the glyphs in the main plot and subplot will be updated accordingly.
+# The frames are computed in the callback (the FrameScheduler measures and paces them),
+# the updates of the previous year still computed in the background (3.0) are discarded.
 
 def update_year():
     global year
-    year += 1
-    year = 2019 if year == 2023 else year
-    label.text = f'Year: {year}'
-    main_df = create_df(year, city, market_cap_lower)
-    main_plot.renderers[1].data_source.data = main_df
-    sub_df = create_df(year, city, market_cap_lower, False)
-    subplot.renderers[1].data_source.data = sub_df
+    year = years[(years.index(year) + 1) % len(years)]
+    year_source.data.update(text=[f'Year: {year}'], year=[year])
+    work.cancel('main', 'sub')
+    main_df, sub_df = plot_dfs(year, city, market_cap_lower)
+    main_plot.renderers[1].data_source.data = main_data(main_df)
+    subplot.renderers[0].data_source.data = sub_df
     subplot.title.text = f'Companies in {city}'
 
 
@@ -386,22 +613,126 @@ def update_year():
 # The callback will be invoked to execute `update_year` periodically at an interval of 1 second.
 # When the user clicks on '❚❚ Pause', the button label will change back to '► Play'.
 # The callback will be removed and the execution of `update_year` will stop.
+# Instead of a plain periodic callback, the FrameScheduler (see dvc_server.py)
+# skips frames while the browser hasn't drawn the previous one,
+# so a slow server or browser doesn't build up a backlog of updates.
+# The configured and the achieved frame rate are shown in the div below the button.
 # reference:
 # https://docs.bokeh.org/en/latest/docs/reference/server/callbacks.html#bokeh-server-callbacks
 # https://docs.bokeh.org/en/3.1.0/docs/reference/document.html#bokeh.document.Document.add_periodic_callback       
 
-callback = None
+def show_stats(stats):
+    div.text = format_stats(stats)
+
+scheduler = FrameScheduler(curdoc(), update_year, ANIMATION_INTERVAL, on_stats=show_stats)
+
 def play():
-    global callback
     if btn.label == '► Play':
         btn.label = '❚❚ Pause'
-        callback = curdoc().add_periodic_callback(update_year, 1000)
+        scheduler.start()
     else:
         btn.label = '► Play'
-        curdoc().remove_periodic_callback(callback)
-
-
-btn.on_click(play)
+        scheduler.stop()
+
+
+## 4.3 Client-side animation
+
+# Each year is a "frame": the columns that change with the year
+# ('Market Cap', 'Employees', 'Symbol', 'circle_size')
+# of the main plot and the subplot, stored as columns named e.g. 'Market Cap 2021'
+# in the data sources `main_frames` and `sub_frames`.
+# The frames are sent to the browser once (and again only when
+# the city or the threshold changes), then a JavaScript timer
+# swaps the columns of the frame into the data sources of the plots.
+# Changing the columns of `data` in place (instead of assigning a new `data`)
+# and emitting `change` redraws the plots without syncing anything to the server,
+# so the animation costs no server CPU and no network traffic per frame.
+# When the animation is paused, the year is sent back once (in `btn.tags`).
+# The frames of a new city, threshold or map view are computed in the background (3.0).
+# reference:
+# https://docs.bokeh.org/en/3.1.0/docs/user_guide/interaction/js_callbacks.html
+
+FRAME_COLUMNS = ['Market Cap', 'Employees', 'Symbol', 'circle_size']
+
+def create_frames(city, market_cap_lower, view=map_view):
+    main_frames, sub_frames = {}, {}
+    for y in years:
+        main_df, sub_df = plot_dfs(y, city, market_cap_lower)
+        main = main_data(main_df, view)
+        for col in FRAME_COLUMNS:
+            main_frames[f'{col} {y}'] = main[col]
+            sub_frames[f'{col} {y}'] = sub_df[col].to_numpy()
+    return main_frames, sub_frames
+
+main_frames = ColumnDataSource()
+sub_frames = ColumnDataSource()
+
+def apply_frames(main_version, sub_version, frames):
+    main_frames.data, sub_frames.data = frames
+    main_frames.tags, sub_frames.tags = [main_version], [sub_version]
+
+def update_frames():
+    if ANIMATION_MODE == 'client':
+        work.submit('frames', partial(create_frames, city, market_cap_lower, dict(map_view)),
+                    partial(apply_frames, versions['main'], versions['sub']))
+
+animate = CustomJS(
+    args=dict(
+        btn=btn,
+        years=years,
+        year=year,
+        columns=FRAME_COLUMNS,
+        interval=ANIMATION_INTERVAL,
+        main_source=main_plot.renderers[1].data_source,
+        sub_source=subplot.renderers[0].data_source,
+        main_frames=main_frames,
+        sub_frames=sub_frames,
+        year_source=year_source,
+    ),
+    code="""
+    // the state of the animation of this button
+    const state = ((window.dvc_animation ??= {})[btn.id] ??= {year: year})
+    if (state.timer != null) {
+        clearInterval(state.timer)
+        state.timer = null
+        btn.label = '► Play'
+        btn.tags = [state.year]
+        return
+    }
+    btn.label = '❚❚ Pause'
+    state.timer = setInterval(() => {
+        state.year = years[(years.indexOf(state.year) + 1) % years.length]
+        for (const [source, frames] of [[main_source, main_frames], [sub_source, sub_frames]]) {
+            // the frames of another city, threshold or map view may not have arrived yet
+            if (frames.tags[0] !== source.tags[0] || frames.get_length() !== source.get_length())
+                continue
+            for (const col of columns)
+                source.data[col] = frames.data[`${col} ${state.year}`]
+            source.change.emit()
+        }
+        year_source.data.text[0] = `Year: ${state.year}`
+        year_source.data.year[0] = state.year
+        year_source.change.emit()
+    }, interval)
+    """)
+
+# When the animation is paused, continue from the year shown in the browser
+def sync_year(attr, old, new):
+    global year
+    if new and new[0] in years:
+        year = new[0]
+        year_source.data.update(text=[f'Year: {year}'], year=[year])
+        update_main()
+        update_sub()
+
+if ANIMATION_MODE == 'client':
+    main_plot.renderers[1].data_source.tags = [versions['main']]
+    subplot.renderers[0].data_source.tags = [versions['sub']]
+    apply_frames(versions['main'], versions['sub'], create_frames(city, market_cap_lower))
+    btn.js_on_click(animate)
+    btn.on_change('tags', sync_year)
+else:
+    btn.on_click(play)
 
 # (Optional) Add a text div to explain your app to the user.
 div = Div()
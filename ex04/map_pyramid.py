@@ -0,0 +1,109 @@
+# ====================================================================
+# Grid pyramid for the markers of the company map
+
+# The main plot draws one circle per city.
+# With thousands of cities the map becomes an unreadable cloud of circles,
+# and every update sends all of them to the browser.
+# The grid pyramid divides the web Mercator plane into square cells,
+# from coarse (a few cells for the whole world) to fine,
+# and the cities in a cell are merged into one marker:
+# 'Market Cap', 'Employees' and the number of companies are summed up,
+# the location is the mean location of the cities.
+# For the visible part of the map, the finest level with at most
+# `max_markers` markers in view is shown, so the number of circles
+# sent to the browser is bounded by the viewport, not by the data.
+# ====================================================================
+
+# The cell of each city at each level never changes, so it is computed once.
+# The sums depend on the year and the market cap threshold,
+# they are a single np.bincount over the cells of the level.
+# The markers (rows) shown only depend on the level and the viewport,
+# so they stay the same when the year or the threshold changes.
+# reference:
+# https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+
+import math
+
+import numpy as np
+
+# the width of the web Mercator world in meters
+WORLD_WIDTH = 2 * math.pi * 6378137
+MAX_MARKERS = 300
+# the level with cells of WORLD_WIDTH / 2**zoom for each zoom
+ZOOMS = range(2, 16)
+
+
+class GridLevel:
+    # The cells of one level.
+    # `codes` is the cell of each city, numbered 0 ... n_cells - 1,
+    # `x`, `y` the mean location of the cities in each cell, and
+    # `representative` the city with the most companies in each cell.
+
+    def __init__(self, x, y, cell_size, weight):
+        self.cell_size = cell_size
+        if cell_size is None:
+            # the finest level: every city is its own cell
+            self.codes = np.arange(len(x))
+        else:
+            col = np.floor(x / cell_size).astype(np.int64)
+            row = np.floor(y / cell_size).astype(np.int64)
+            _, self.codes = np.unique(np.stack([col, row]), axis=1, return_inverse=True)
+            self.codes = self.codes.ravel()
+        self.n_cells = int(self.codes.max(initial=-1)) + 1
+        self.n_cities = np.bincount(self.codes, minlength=self.n_cells)
+        self.x = np.bincount(self.codes, x, minlength=self.n_cells) / np.maximum(self.n_cities, 1)
+        self.y = np.bincount(self.codes, y, minlength=self.n_cells) / np.maximum(self.n_cities, 1)
+        # sort by cell and then by weight, the last city of each cell is the heaviest
+        order = np.lexsort([weight, self.codes])
+        last = np.r_[self.codes[order][1:] != self.codes[order][:-1], True]
+        self.representative = order[last]
+
+    def __len__(self):
+        return self.n_cells
+
+    def in_view(self, x0, y0, x1, y1):
+        # the cells with their location inside the box
+        return np.flatnonzero((self.x >= x0) & (self.x <= x1) & (self.y >= y0) & (self.y <= y1))
+
+
+class MapPyramid:
+    # `x`, `y` are the locations of the cities,
+    # `weight` decides the representative city of a cell (e.g. the number of companies)
+
+    def __init__(self, x, y, weight=None, zooms=ZOOMS, max_markers=MAX_MARKERS):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        weight = np.ones(len(x)) if weight is None else np.asarray(weight, dtype=np.float64)
+        self.max_markers = max_markers
+        # from coarse to fine, levels that merge nothing are left out
+        self.levels = []
+        for zoom in zooms:
+            level = GridLevel(x, y, WORLD_WIDTH / 2**zoom, weight)
+            if len(level) < len(x):
+                self.levels.append(level)
+        self.levels.append(GridLevel(x, y, None, weight))
+
+    def level_for(self, x0, y0, x1, y1):
+        # The finest level with at most `max_markers` markers in the box
+        for level in reversed(self.levels):
+            if len(level.in_view(x0, y0, x1, y1)) <= self.max_markers:
+                return level
+        return self.levels[0]
+
+    def view(self, x0, y0, x1, y1, margin=0.5):
+        # The level for the box and its cells in the box plus a margin
+        # of `margin` times the size of the box on each side (so that small pans need no new rows).
+        # Returns the level, the cells and the covered box.
+        level = self.level_for(x0, y0, x1, y1)
+        dx, dy = margin * (x1 - x0), margin * (y1 - y0)
+        covered = (x0 - dx, y0 - dy, x1 + dx, y1 + dy)
+        return level, level.in_view(*covered), covered
+
+    @staticmethod
+    def aggregate(level, cells, values):
+        # The sums of the per-city `values` (a dict of arrays) for the `cells` of `level`,
+        # missing values count as 0
+        return {
+            col: np.bincount(level.codes, np.nan_to_num(np.asarray(v, dtype=np.float64)), minlength=len(level))[cells]
+            for col, v in values.items()
+        }
@@ -0,0 +1,298 @@
+# ====================================================================
+# Local tile cache for the map of the company app
+
+# The map tiles of the main plot are loaded by the browser from a tile server.
+# Instead of the remote server, the browser loads them from a small local proxy,
+# which keeps every tile it has served on disk (by z/x/y),
+# so that a tile is only downloaded once and the map also works offline.
+# The tiles of the area of the data can be prefetched for a range of zoom levels,
+# and a generated stand-in tile set can replace the remote server (e.g. for tests).
+# ====================================================================
+
+# The proxy is an HTTP server in a background thread of the Bokeh server process,
+# one thread per request, started once per process.
+# If it can't listen on its port (e.g. the port is used by another program,
+# or by the proxy of another worker of `bokeh serve --num-procs N`),
+# the browser loads the tiles from the remote server instead.
+# Environment variables:
+# - DVC_TILES=proxy (default): serve the tiles through the cache,
+#   DVC_TILES=direct: load the tiles from the remote server as before,
+#   DVC_TILES=standin: serve generated tiles instead of the remote ones
+# - DVC_TILE_BIND / DVC_TILE_PORT: the address the proxy listens on (127.0.0.1:8765)
+# - DVC_TILE_HOST: the host of the proxy in the tile URLs (127.0.0.1),
+#   it must be reachable from the browser (e.g. the public name of the server
+#   when the proxy listens on 0.0.0.0)
+# - DVC_OFFLINE=1: only serve the tiles that are already on disk
+# reference:
+# https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+# https://docs.python.org/3/library/http.server.html
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dvc_data import CACHE_DIR
+
+TILE_DIR = os.path.join(CACHE_DIR, "tiles")
+BIND_HOST = os.environ.get("DVC_TILE_BIND", "127.0.0.1")
+HOST = os.environ.get("DVC_TILE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("DVC_TILE_PORT", "8765"))
+TIMEOUT = 10  # seconds per upstream request
+PREFETCH_ZOOMS = range(3, 8)
+PREFETCH_WORKERS = 8
+
+# half the width of the web Mercator world in meters
+ORIGIN_SHIFT = math.pi * 6378137
+
+log = logging.getLogger(__name__)
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+# ====================================================================
+# Tiles
+# ====================================================================
+
+
+# The tiles of zoom level `z` that cover the web Mercator box (x0, y0, x1, y1) in meters
+def tiles_for_bbox(x0, y0, x1, y1, z):
+    n = 2**z
+
+    def tile(v):
+        return min(max(int(v * n), 0), n - 1)
+
+    tx0, tx1 = tile((x0 + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT)), tile((x1 + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT))
+    # the tile rows count from the top
+    ty0, ty1 = tile((ORIGIN_SHIFT - y1) / (2 * ORIGIN_SHIFT)), tile((ORIGIN_SHIFT - y0) / (2 * ORIGIN_SHIFT))
+    return [(z, tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)]
+
+
+def _png(width, height, rgb_rows):
+    # A minimal RGB PNG encoder, `rgb_rows` are the bytes of each row
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = b"".join(b"\x00" + row for row in rgb_rows)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def standin_tile(z, x, y, size=256):
+    # A generated tile: a checkerboard in a color that depends on z,
+    # with a dark border, so that the tile grid is visible on the map
+    base = (90 + 20 * (z % 8), 160, 200 - 15 * (z % 8))
+    light = bytes(base)
+    dark = bytes(int(c * 0.85) for c in base)
+    border = bytes((60, 60, 60))
+    half = size // 2
+    rows = []
+    for row in range(size):
+        if row == 0 or row == size - 1:
+            rows.append(border * size)
+            continue
+        first, second = (light, dark) if ((row < half) ^ ((x + y) % 2 == 1)) else (dark, light)
+        rows.append(border + first * (half - 1) + second * (half - 1) + border)
+    return _png(size, size, rows)
+
+
+# ====================================================================
+# Cache
+# ====================================================================
+
+
+# The name of a tile source in the cache directory and in the URLs of the proxy
+def source_key(upstream):
+    name = upstream if isinstance(upstream, str) else getattr(upstream, "__name__", "tiles")
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+
+
+class TileCache:
+    # The tiles of one tile source on disk, in `cache_dir`/z/x/y.png.
+    # `upstream` is a URL template with {Z}, {X}, {Y} (like WMTSTileSource),
+    # or a function (z, x, y) -> PNG bytes, e.g. `standin_tile`.
+
+    def __init__(self, upstream, cache_dir=None, offline=None):
+        self.upstream = upstream
+        self.cache_dir = cache_dir or os.path.join(TILE_DIR, source_key(upstream))
+        self.offline = _env_flag("DVC_OFFLINE") if offline is None else offline
+        # one lock per tile that is being fetched, so concurrent requests fetch it only once
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def path(self, z, x, y):
+        return os.path.join(self.cache_dir, str(z), str(x), f"{y}.png")
+
+    def get(self, z, x, y):
+        # The PNG bytes of a tile, None if it is not cached and can't be fetched
+        path = self.path(z, x, y)
+        data = self._read(path)
+        if data is not None:
+            return data
+        with self._lock:
+            lock = self._fetching.setdefault((z, x, y), threading.Lock())
+        with lock:
+            # another thread may have fetched it in the meantime
+            data = self._read(path)
+            if data is None:
+                data = self._fetch(z, x, y)
+                if data is not None:
+                    self._store(path, data)
+            # the lock of the tile is only dropped once the tile is on disk (or can't be fetched),
+            # a request that comes later reads the file instead of fetching the tile again
+            with self._lock:
+                if self._fetching.get((z, x, y)) is lock:
+                    del self._fetching[(z, x, y)]
+        return data
+
+    def prefetch(self, bbox, zooms=PREFETCH_ZOOMS, workers=PREFETCH_WORKERS):
+        # Fetch the tiles covering `bbox` (web Mercator x0, y0, x1, y1) at the `zooms`,
+        # returns the number of tiles that are available
+        tiles = [t for z in zooms for t in tiles_for_bbox(*bbox, z)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(data is not None for data in pool.map(lambda t: self.get(*t), tiles))
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _fetch(self, z, x, y):
+        if callable(self.upstream):
+            return self.upstream(z, x, y)
+        if self.offline:
+            return None
+        url = self.upstream.replace("{Z}", str(z)).replace("{X}", str(x)).replace("{Y}", str(y))
+        request = urllib.request.Request(url, headers={"User-Agent": "dvc-tile-cache"})
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                return response.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _store(path, data):
+        # written to a temporary file first, a concurrent reader never sees half a tile
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+# ====================================================================
+# Proxy
+# ====================================================================
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    # GET /<source>/<z>/<x>/<y>.png
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        cache = self.server.caches.get(parts[0]) if len(parts) == 4 else None
+        data = None
+        if cache is not None and parts[3].endswith(".png"):
+            try:
+                z, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-4])
+            except ValueError:
+                z = None
+            if z is not None:
+                data = cache.get(z, x, y)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # a browser requests many tiles at once, the default backlog of 5 connections
+    # makes the others wait for a TCP retransmit (about a second)
+    request_queue_size = 128
+
+    def __init__(self, host=BIND_HOST, port=PORT):
+        # the caches by the name of their source in the URL
+        self.caches = {}
+        super().__init__((host, port), _TileHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="TileServer", daemon=True).start()
+        return self
+
+
+_server = None
+_prefetched = set()
+_lock = threading.Lock()
+
+
+def local_tile_url(upstream, bbox=None, zooms=PREFETCH_ZOOMS):
+    # The URL template of the tiles of `upstream` served through the local proxy.
+    # The proxy is started on the first call,
+    # and the tiles of `bbox` are prefetched in the background.
+    # If the proxy can't be started, `upstream` itself is returned.
+    global _server
+    mode = os.environ.get("DVC_TILES", "proxy").lower()
+    if mode == "direct":
+        return upstream
+    source = standin_tile if mode == "standin" else upstream
+
+    name = source_key(source)
+    with _lock:
+        if _server is None:
+            try:
+                _server = TileServer(BIND_HOST, PORT).start()
+            except OSError as e:
+                # whatever listens on this port is not known to serve these tiles
+                log.warning(
+                    "can't start the tile proxy on %s:%s (%s), loading the tiles from %s",
+                    BIND_HOST, PORT, e, upstream)
+                _server = False
+        if not _server:
+            return upstream
+        cache = _server.caches.setdefault(name, TileCache(source))
+        if bbox is not None and (name, tuple(bbox)) not in _prefetched:
+            _prefetched.add((name, tuple(bbox)))
+            threading.Thread(target=cache.prefetch, args=(bbox, zooms), daemon=True).start()
+    return f"http://{HOST}:{PORT}/{name}/{{Z}}/{{X}}/{{Y}}.png"
+
+
+if __name__ == "__main__":
+    # Fill the cache without starting the app, e.g.
+    #   python tile_cache.py --bbox -14000000 2800000 -7400000 6300000 --zoom 3 8
+    parser = argparse.ArgumentParser(description="Prefetch map tiles into the local tile cache")
+    parser.add_argument("--url", default="http://tile.stamen.com/terrain/{Z}/{X}/{Y}.png")
+    parser.add_argument("--standin", action="store_true", help="generate stand-in tiles instead")
+    parser.add_argument("--bbox", nargs=4, type=float, required=True, metavar=("X0", "Y0", "X1", "Y1"))
+    parser.add_argument("--zoom", nargs=2, type=int, default=[3, 7], metavar=("MIN", "MAX"))
+    args = parser.parse_args()
+    cache = TileCache(standin_tile if args.standin else args.url)
+    n = cache.prefetch(args.bbox, range(args.zoom[0], args.zoom[1] + 1))
+    print(f"{n} tiles in {cache.cache_dir}")
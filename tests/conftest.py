@@ -0,0 +1,10 @@
+# The exercises import their modules from their own directory
+# (like `bokeh serve` runs them) and the shared modules from the repository root.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, *(os.path.join(ROOT, ex) for ex in ("ex02", "ex03", "ex04"))):
+    if path not in sys.path:
+        sys.path.insert(0, path)
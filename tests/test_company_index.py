@@ -0,0 +1,75 @@
+# Tests of the market cap threshold index of the company map (ex04/company_index.py)
+# against the pandas groupby + threshold filter it replaces.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from company_cube import CompanyCube, cube_frame, discover_year_columns
+from company_index import CompanyIndex, ThresholdIndex
+
+
+def companies(n=500, n_cities=12, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Symbol": rng.choice(["A", "B", "C", None], n),
+        "City": rng.choice([f"City {i:02d}" for i in range(n_cities)] + [None], n),
+        # few distinct values, so that many companies are exactly at a threshold
+        "Market Cap 2021": rng.choice([np.nan, 0.0, 1.0, 5.0, 10.0, 50.0, 1e3], n),
+        "Employees 2021": rng.choice([np.nan, 0.0, 10.0, 200.0], n),
+        "Market Cap 2022": rng.lognormal(3, 2, n),
+        "Employees 2022": rng.integers(0, 1000, n).astype(float),
+    })
+    return df
+
+
+def groupby_filter(df, year, market_cap_lower, cities):
+    # the filter of the original app: the companies below the threshold are dropped
+    # (a nan market cap is not below it), then the companies are grouped by city
+    df = df.rename(columns={f"Market Cap {year}": "Market Cap", f"Employees {year}": "Employees"})
+    kept = df[~(df["Market Cap"] < market_cap_lower)]
+    grouped = kept.groupby("City").agg({"Market Cap": "sum", "Employees": "sum", "Symbol": "count"})
+    return grouped.reindex(cities, fill_value=0)
+
+
+def company_index(df):
+    years, metrics, found = discover_year_columns(df.columns)
+    cube = CompanyCube(cube_frame(df, years, metrics, found), years, metrics, df["City"])
+    return CompanyIndex(cube, df["Symbol"].notna())
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("year", [2021, 2022])
+def test_aggregate_like_groupby(seed, year):
+    df = companies(seed=seed)
+    index = company_index(df)
+    caps = np.sort(df[f"Market Cap {year}"].dropna().unique())
+    caps = caps[:: max(len(caps) // 30, 1)]
+    # every distinct value (exactly at the threshold), values in between,
+    # and thresholds below and above all the values (an empty result)
+    thresholds = [-np.inf, -1.0, 0.0, *caps, *(caps + 1e-9), caps.max() + 1, np.inf]
+    for market_cap_lower in thresholds:
+        expected = groupby_filter(df, year, market_cap_lower, index.cities)
+        sums = index.aggregate(year, market_cap_lower)
+        assert np.allclose(sums["Market Cap"], expected["Market Cap"]), market_cap_lower
+        assert np.allclose(sums["Employees"], expected["Employees"]), market_cap_lower
+        assert np.array_equal(sums["Symbol"], expected["Symbol"]), market_cap_lower
+
+
+def test_no_company_above_the_threshold():
+    codes = np.array([0, 0, 1])
+    index = ThresholdIndex(codes, 3, np.array([1.0, 2.0, 3.0]), np.array([10.0, 20.0, 30.0]), np.ones(3))
+    sums = index.aggregate(10.0)
+    assert not sums["Market Cap"].any() and not sums["Employees"].any() and not sums["Symbol"].any()
+    # exactly at the threshold is kept
+    sums = index.aggregate(2.0)
+    assert list(sums["Market Cap"]) == [2.0, 3.0, 0.0]
+    assert list(sums["Symbol"]) == [1, 1, 0]
+
+
+def test_rows_of_a_city():
+    df = companies()
+    index = company_index(df)
+    for city in index.cities:
+        assert list(index.rows(city)) == list(np.flatnonzero(df["City"].to_numpy() == city))
+    assert len(index.rows("Nowhere")) == 0
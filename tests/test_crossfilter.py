@@ -0,0 +1,66 @@
+# Tests of the binned features and the crossfilter of the PCA app (ex03/crossfilter.py)
+# against np.histogram and pandas value_counts of the selected rows.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from crossfilter import BinnedFeature, Crossfilter, bin_edges
+
+
+def features(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "normal": rng.normal(size=n),
+        "skewed": rng.lognormal(size=n),
+        "integers": rng.integers(0, 5, n).astype(float),
+        "constant": np.full(n, 3.0),
+    })
+    # missing values are left out of the counts
+    df.loc[rng.choice(n, 50, replace=False), "normal"] = np.nan
+    return df
+
+
+def value_counts(values, edges):
+    # the counts per bin like np.histogram: [a, b) bins, the last bin includes its right edge
+    bins = np.append(edges[:-1], np.nextafter(edges[-1], np.inf))
+    cut = pd.cut(pd.Series(values).dropna(), bins=bins, right=False)
+    return cut.value_counts(sort=False).to_numpy()
+
+
+@pytest.mark.parametrize("col", ["normal", "skewed", "integers", "constant"])
+def test_binned_feature_counts_like_np_histogram(col):
+    values = features()[col].to_numpy()
+    binned = BinnedFeature(values)
+    finite = values[np.isfinite(values)]
+    assert np.array_equal(binned.counts_all, np.histogram(finite, binned.edges)[0])
+    rows = np.arange(0, len(values), 7)
+    selected = values[rows]
+    assert np.array_equal(binned.counts(rows), np.histogram(selected[np.isfinite(selected)], binned.edges)[0])
+    assert binned.counts([]).sum() == 0
+
+
+def test_bin_edges_are_capped():
+    values = np.concatenate([np.zeros(10_000), [1e9]])
+    assert len(bin_edges(values, max_bins=50)) <= 51
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_selected_counts_like_value_counts(seed):
+    df = features(seed=seed)
+    crossfilter = Crossfilter(df, df.columns)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(df), rng.integers(0, len(df)), replace=False)
+    counts = crossfilter.selected_counts(list(df.columns), rows)
+    for col in df.columns:
+        expected = value_counts(df[col].to_numpy()[rows], crossfilter.feature(col).edges)
+        assert np.array_equal(counts[col], expected), col
+        assert np.array_equal(crossfilter.feature(col).counts(rows), expected)
+
+
+def test_selected_counts_of_a_subset_of_the_features():
+    df = features()
+    crossfilter = Crossfilter(df, df.columns)
+    counts = crossfilter.selected_counts(["skewed"], np.arange(100))
+    assert list(counts) == ["skewed"]
+    assert counts["skewed"].sum() == 100
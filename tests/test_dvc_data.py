@@ -0,0 +1,147 @@
+# Tests of read_csv_cached (dvc_data.py) against a local stand-in
+# of the Google Sheets CSV export, which answers conditional requests
+# (If-None-Match / If-Modified-Since) with 304 Not Modified.
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import dvc_data
+
+
+class Sheet:
+    # The CSV served by the stand-in server and the requests it received
+    def __init__(self):
+        self.body = b"Symbol,Close\nAAA,1.5\nBBB,2.5\n"
+        self.version = 1
+        self.requests = []
+
+    @property
+    def etag(self):
+        return f'"v{self.version}"'
+
+    @property
+    def last_modified(self):
+        return f"Mon, 0{self.version} Jan 2024 00:00:00 GMT"
+
+    def change(self, body):
+        self.body = body
+        self.version += 1
+
+
+@pytest.fixture
+def sheet():
+    sheet = Sheet()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            sheet.requests.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == sheet.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("ETag", sheet.etag)
+            self.send_header("Last-Modified", sheet.last_modified)
+            self.send_header("Content-Length", str(len(sheet.body)))
+            self.end_headers()
+            self.wfile.write(sheet.body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    sheet.url = f"http://127.0.0.1:{server.server_address[1]}/sheet.csv"
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+
+    sheet.stop = stop
+    yield sheet
+    stop()
+
+
+@pytest.fixture(autouse=True)
+def no_env_flags(monkeypatch):
+    monkeypatch.delenv("DVC_REVALIDATE", raising=False)
+    monkeypatch.delenv("DVC_OFFLINE", raising=False)
+
+
+def test_first_download_stores_a_snapshot(sheet, tmp_path):
+    df = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    assert list(df["Symbol"]) == ["AAA", "BBB"]
+    assert len(sheet.requests) == 1
+    # later calls are served from the snapshot without a request
+    again = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    assert again.equals(df)
+    assert len(sheet.requests) == 1
+
+
+def test_revalidation_not_modified_reuses_the_snapshot(sheet, tmp_path, monkeypatch):
+    df = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    # a 304 must not parse anything
+    monkeypatch.setattr(dvc_data.pd, "read_csv", None)
+    again = dvc_data.read_csv_cached(sheet.url, revalidate=True, cache_dir=str(tmp_path))
+    assert again.equals(df)
+    assert len(sheet.requests) == 2
+    assert sheet.requests[1].get("If-None-Match") == sheet.etag
+    assert sheet.requests[1].get("If-Modified-Since") == sheet.last_modified
+
+
+def test_revalidation_downloads_a_changed_sheet(sheet, tmp_path):
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    sheet.change(b"Symbol,Close\nCCC,3.5\n")
+    df = dvc_data.read_csv_cached(sheet.url, revalidate=True, cache_dir=str(tmp_path))
+    assert list(df["Symbol"]) == ["CCC"]
+    # the new snapshot replaced the old one
+    cached = dvc_data.read_csv_cached(sheet.url, offline=True, cache_dir=str(tmp_path))
+    assert list(cached["Symbol"]) == ["CCC"]
+
+
+def test_revalidation_env_flag(sheet, tmp_path, monkeypatch):
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    monkeypatch.setenv("DVC_REVALIDATE", "1")
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    assert len(sheet.requests) == 2
+
+
+def test_offline_with_a_snapshot(sheet, tmp_path):
+    df = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    cached = dvc_data.read_csv_cached(sheet.url, revalidate=True, offline=True, cache_dir=str(tmp_path))
+    assert cached.equals(df)
+    assert len(sheet.requests) == 1
+
+
+def test_offline_without_a_snapshot(sheet, tmp_path, monkeypatch):
+    monkeypatch.setenv("DVC_OFFLINE", "1")
+    with pytest.raises(FileNotFoundError):
+        dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    assert sheet.requests == []
+
+
+def test_unreachable_server_falls_back_to_the_snapshot(sheet, tmp_path):
+    df = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    sheet.stop()
+    cached = dvc_data.read_csv_cached(sheet.url, revalidate=True, cache_dir=str(tmp_path))
+    assert cached.equals(df)
+
+
+def test_read_csv_kwargs_are_part_of_the_key(sheet, tmp_path):
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    df = dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path), usecols=["Symbol"])
+    assert list(df.columns) == ["Symbol"]
+    assert len(sheet.requests) == 2
+
+
+def test_clear_cache_keeps_subdirectories(sheet, tmp_path):
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    (tmp_path / "tiles" / "abc").mkdir(parents=True)
+    dvc_data.clear_cache(str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == ["tiles"]
+    dvc_data.read_csv_cached(sheet.url, cache_dir=str(tmp_path))
+    assert len(sheet.requests) == 2
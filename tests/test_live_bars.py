@@ -0,0 +1,84 @@
+# Tests of the bars of the live candlestick chart (ex02/live_bars.py)
+# against a pandas OHLC resample of the same ticks.
+
+import numpy as np
+import pandas as pd
+import pytest
+from bokeh.models import ColumnDataSource
+
+from live_bars import LiveBars
+
+BAR_MS = 5000
+COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume", "color"]
+
+
+def random_ticks(n, seed=0):
+    rng = np.random.default_rng(seed)
+    times = 1_700_000_000_000 + np.sort(rng.uniform(0, 300_000, n)).round()
+    prices = 100 + np.cumsum(rng.normal(0, 0.1, n))
+    sizes = rng.integers(1, 50, n) * 10.0
+    return times, prices, sizes
+
+
+def resampled(times, prices, sizes, bar_ms=BAR_MS):
+    ticks = pd.DataFrame({"price": prices, "size": sizes}, index=pd.to_datetime(times, unit="ms"))
+    bars = ticks.resample(f"{bar_ms}ms", origin="epoch")
+    ohlc = bars["price"].ohlc()
+    ohlc["volume"] = bars["size"].sum()
+    ohlc = ohlc.dropna()
+    ohlc["date"] = ohlc.index.to_numpy("datetime64[ms]").astype(np.int64).astype(float)
+    return ohlc
+
+
+def live_bars(rollover=1000):
+    source = ColumnDataSource({col: [] for col in COLUMNS})
+    return source, LiveBars(source, BAR_MS, rollover)
+
+
+def assert_bars_equal(source, expected):
+    data = source.data
+    assert np.array_equal(np.asarray(data["Date"], dtype=float), expected["date"].to_numpy())
+    for col, exp in [("Open", "open"), ("High", "high"), ("Low", "low"), ("Close", "close"), ("Volume", "volume")]:
+        assert np.allclose(np.asarray(data[col], dtype=float), expected[exp].to_numpy()), col
+    colors = np.select(
+        [expected["close"] > expected["open"], expected["close"] < expected["open"]], ["green", "red"], "black"
+    )
+    assert list(data["color"]) == list(colors)
+
+
+@pytest.mark.parametrize("batch", [1, 7, 100, 10_000])
+def test_bars_like_pandas_resample(batch):
+    times, prices, sizes = random_ticks(3000)
+    source, bars = live_bars()
+    # the ticks arrive in batches, the bar in progress is patched between them
+    for start in range(0, len(times), batch):
+        bars.update(times[start : start + batch], prices[start : start + batch], sizes[start : start + batch])
+    assert_bars_equal(source, resampled(times, prices, sizes))
+
+
+def test_ticks_of_a_batch_in_any_order():
+    times, prices, sizes = random_ticks(500, seed=1)
+    source, bars = live_bars()
+    order = np.random.default_rng(2).permutation(len(times))
+    bars.update(times[order], prices[order], sizes[order])
+    assert_bars_equal(source, resampled(times, prices, sizes))
+
+
+def test_rollover_keeps_the_last_bars():
+    times, prices, sizes = random_ticks(3000, seed=3)
+    source, bars = live_bars(rollover=10)
+    for start in range(0, len(times), 50):
+        bars.update(times[start : start + 50], prices[start : start + 50], sizes[start : start + 50])
+    expected = resampled(times, prices, sizes)
+    assert len(expected) > 10
+    assert bars.rows == 10
+    assert_bars_equal(source, expected.iloc[-10:])
+
+
+def test_late_ticks_of_closed_bars_are_dropped():
+    source, bars = live_bars()
+    bars.update([0, 1000, BAR_MS], [1.0, 2.0, 3.0], [10, 10, 10])
+    bars.update([500, BAR_MS + 1], [9.0, 4.0], [10, 10])
+    assert list(source.data["Open"]) == [1.0, 3.0]
+    assert list(source.data["High"]) == [2.0, 4.0]
+    assert list(source.data["Volume"]) == [20.0, 20.0]
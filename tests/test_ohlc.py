@@ -0,0 +1,63 @@
+# Tests of the sparse tables and the OHLC levels of the candlestick charts (ex02/ohlc.py)
+# against brute-force min / max over the same windows.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ohlc import OHLCPyramid, SparseTable
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 7, 8, 9, 100, 257])
+def test_range_min_max_like_brute_force(n):
+    rng = np.random.default_rng(n)
+    values = rng.normal(size=n)
+    low, high = SparseTable(values, np.fmin), SparseTable(values, np.fmax)
+    for lo in range(n):
+        for hi in range(lo + 1, n + 1):
+            assert low.query(lo, hi) == values[lo:hi].min()
+            assert high.query(lo, hi) == values[lo:hi].max()
+
+
+def test_missing_values_are_ignored():
+    values = np.array([np.nan, 3.0, np.nan, 1.0, 2.0])
+    table = SparseTable(values, np.fmin)
+    assert table.query(0, 5) == 1.0
+    assert table.query(1, 3) == 3.0
+    assert np.isnan(table.query(0, 1))
+
+
+def test_empty_range():
+    table = SparseTable(np.arange(5.0))
+    assert np.isnan(table.query(3, 3))
+    assert np.isnan(table.query(4, 2))
+
+
+def daily_prices(n=800, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    open_ = close + rng.normal(size=n)
+    return pd.DataFrame({
+        "Date": pd.bdate_range("2018-01-01", periods=n),
+        "Open": open_,
+        "High": np.maximum(open_, close) + rng.random(n),
+        "Low": np.minimum(open_, close) - rng.random(n),
+        "Close": close,
+        "Volume": rng.integers(1_000, 100_000, n).astype(float),
+    })
+
+
+def test_level_extent_like_brute_force():
+    df = daily_prices()
+    pyramid = OHLCPyramid(df)
+    rng = np.random.default_rng(1)
+    for level in pyramid.levels:
+        dates = level.dates_ms
+        for _ in range(50):
+            start, end = np.sort(rng.uniform(dates[0] - 1e10, dates[-1] + 1e10, 2))
+            bars = level.df[(dates >= start) & (dates <= end)]
+            extent = level.extent(start, end)
+            if bars.empty:
+                assert extent is None
+                continue
+            assert extent == (bars["Low"].min(), bars["High"].max(), bars["Volume"].min(), bars["Volume"].max())
@@ -0,0 +1,103 @@
+# Tests of the lasso and box selection of the PCA plot (ex03/spatial_index.py)
+# against a point by point ray casting, also for outlines far outside of the points.
+
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex, points_in_polygon
+
+
+def ray_cast(x, y, px, py):
+    # The indices of the points inside the polygon, one point and one edge at a time
+    # reference: https://en.wikipedia.org/wiki/Point_in_polygon#Ray_casting_algorithm
+    hits = []
+    n = len(px)
+    for i, (xi, yi) in enumerate(zip(x, y)):
+        inside = False
+        for j in range(n):
+            xa, ya, xb, yb = px[j], py[j], px[(j + 1) % n], py[(j + 1) % n]
+            if (ya <= yi) != (yb <= yi) and xi < xa + (yi - ya) * (xb - xa) / (yb - ya):
+                inside = not inside
+        if inside:
+            hits.append(i)
+    return np.array(hits, dtype=np.int64)
+
+
+def points(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 1, n)
+    y = rng.normal(0, 2, n)
+    # a few points without coordinates are never selected
+    x[::97] = np.nan
+    y[::89] = np.nan
+    return x, y
+
+
+def lasso(center, radius, n=40, seed=1):
+    # a closed, self-intersecting "star" with vertices at random radii
+    rng = np.random.default_rng(seed)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    r = radius * rng.uniform(0.2, 1.0, n)
+    return center[0] + r * np.cos(angles), center[1] + r * np.sin(angles)
+
+
+POLYGONS = {
+    "lasso": lasso((0.3, -0.5), 2.0),
+    "small lasso": lasso((-0.1, 0.2), 0.05),
+    "self-intersecting": ([-2, 2, -2, 2], [-3, 3, 3, -3]),
+    # the vertices are far outside of the grid, only the clipped edges cross it
+    "huge triangle": ([-1e9, 1e9, 0], [-1e9, -1e9, 1e9]),
+    "band through the grid": ([-1e6, 1e6, 1e6, -1e6], [-1e5 - 0.5, 1e5 - 0.5, 1e5 + 0.5, -1e5 + 0.5]),
+    "wedge with a vertex inside": ([0.1, 1e7, 1e7], [0.2, -1e7, 1e7]),
+    "outside": ([10, 20, 15], [50, 50, 60]),
+    "around the grid": ([-100, 100, 100, -100], [-100, -100, 100, 100]),
+}
+
+
+@pytest.fixture(scope="module")
+def grid():
+    x, y = points()
+    return GridIndex(x, y, points_per_cell=16)
+
+
+@pytest.mark.parametrize("name", POLYGONS)
+def test_in_polygon_matches_ray_casting(grid, name):
+    px, py = map(np.asarray, POLYGONS[name])
+    expected = ray_cast(grid.x, grid.y, px, py)
+    np.testing.assert_array_equal(grid.in_polygon(px, py), expected)
+    np.testing.assert_array_equal(np.flatnonzero(points_in_polygon(grid.x, grid.y, px, py)), expected)
+
+
+def test_clipped_polygons_select_something(grid):
+    # (so that the cases above don't pass by both selecting nothing)
+    valid = np.isfinite(grid.x) & np.isfinite(grid.y)
+    assert len(grid.in_polygon(*POLYGONS["around the grid"])) == valid.sum()
+    assert len(grid.in_polygon(*POLYGONS["huge triangle"])) == valid.sum()
+    assert 0 < len(grid.in_polygon(*POLYGONS["band through the grid"])) < valid.sum()
+    assert 0 < len(grid.in_polygon(*POLYGONS["wedge with a vertex inside"])) < valid.sum()
+
+
+@pytest.mark.parametrize("box", [(-0.5, 1.0, -2.0, 0.5), (1.0, -0.5, 0.5, -2.0), (-1e9, 0.0, -1e9, 1e9)])
+def test_in_box(grid, box):
+    x0, x1, y0, y1 = box
+    with np.errstate(invalid="ignore"):
+        inside = (grid.x >= min(x0, x1)) & (grid.x <= max(x0, x1)) & (grid.y >= min(y0, y1)) & (grid.y <= max(y0, y1))
+    np.testing.assert_array_equal(grid.in_box(*box), np.flatnonzero(inside))
+
+
+def test_select(grid):
+    px, py = POLYGONS["lasso"]
+    poly = {"type": "poly", "x": list(px), "y": list(py)}
+    np.testing.assert_array_equal(grid.select(poly), ray_cast(grid.x, grid.y, px, py))
+    rect = {"type": "rect", "x0": -0.5, "x1": 1.0, "y0": -2.0, "y1": 0.5}
+    np.testing.assert_array_equal(grid.select(rect), grid.in_box(-0.5, 1.0, -2.0, 0.5))
+    assert len(grid.select({"type": "point", "x": 0, "y": 0})) == 0
+    assert len(grid.in_polygon([0, 1], [0, 1])) == 0
+
+
+def test_single_point_and_no_points():
+    grid = GridIndex([1.0], [2.0])
+    np.testing.assert_array_equal(grid.in_box(0, 2, 1, 3), [0])
+    assert len(grid.in_box(2, 3, 3, 4)) == 0
+    grid = GridIndex([np.nan], [np.nan])
+    assert len(grid.in_polygon(*POLYGONS["around the grid"])) == 0
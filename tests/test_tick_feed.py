@@ -0,0 +1,145 @@
+# Tests of the tick feeds (ex02/tick_feed.py): following a file of ticks,
+# and reading the ticks of the stand-in TickServer over TCP.
+
+import time
+
+import pytest
+
+import tick_feed
+from tick_feed import FileTailFeed, SocketFeed, TickServer, format_tick, parse_tick
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(tick_feed, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(tick_feed, "RECONNECT_INTERVAL", 0.05)
+
+
+def wait_for(feed, n, timeout=5.0):
+    # the ticks drained from `feed` once there are at least `n` of them
+    ticks = []
+    deadline = time.monotonic() + timeout
+    while len(ticks) < n and time.monotonic() < deadline:
+        ticks += feed.drain()
+        time.sleep(0.01)
+    return ticks
+
+
+def write(path, text, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_parse_tick():
+    assert parse_tick(format_tick("AAA", 1_700_000_000_000, 1.5, 100)) == ("AAA", 1_700_000_000_000, 1.5, 100)
+    assert parse_tick("AAA,1,2") is None
+    assert parse_tick("AAA,x,2,3") is None
+
+
+def test_file_feed_reads_appended_ticks(tmp_path):
+    path = tmp_path / "ticks.csv"
+    write(path, format_tick("OLD", 1, 1.0, 1), "w")
+    feed = FileTailFeed(str(path)).start()
+    try:
+        time.sleep(0.1)
+        # a line is only read once it is complete
+        write(path, format_tick("AAA", 2, 2.0, 10) + "BBB,3,")
+        assert wait_for(feed, 1) == [("AAA", 2, 2.0, 10)]
+        write(path, "3.0,20\n")
+        assert wait_for(feed, 1) == [("BBB", 3, 3.0, 20)]
+    finally:
+        feed.stop()
+
+
+def test_file_feed_from_start(tmp_path):
+    path = tmp_path / "ticks.csv"
+    write(path, format_tick("OLD", 1, 1.0, 1), "w")
+    feed = FileTailFeed(str(path), from_start=True).start()
+    try:
+        assert wait_for(feed, 1) == [("OLD", 1, 1.0, 1)]
+    finally:
+        feed.stop()
+
+
+def test_file_feed_reads_a_truncated_file_from_its_start(tmp_path):
+    path = tmp_path / "ticks.csv"
+    write(path, "".join(format_tick("AAA", t, 1.0, 1) for t in range(20)), "w")
+    feed = FileTailFeed(str(path), from_start=True).start()
+    try:
+        assert len(wait_for(feed, 20)) == 20
+        write(path, "", "w")
+        time.sleep(0.1)
+        write(path, format_tick("NEW", 1, 2.0, 1))
+        assert wait_for(feed, 1) == [("NEW", 1, 2.0, 1)]
+    finally:
+        feed.stop()
+
+
+def test_file_feed_waits_for_a_file_created_later(tmp_path):
+    path = tmp_path / "ticks.csv"
+    feed = FileTailFeed(str(path)).start()
+    try:
+        time.sleep(0.1)
+        assert feed._thread.is_alive()
+        # the ticks written before the feed finds the file are not lost
+        write(path, format_tick("AAA", 1, 1.0, 1), "w")
+        assert wait_for(feed, 1) == [("AAA", 1, 1.0, 1)]
+    finally:
+        feed.stop()
+
+
+def test_file_feed_stops_promptly(tmp_path):
+    path = tmp_path / "ticks.csv"
+    write(path, "", "w")
+    feed = FileTailFeed(str(path)).start()
+    time.sleep(0.05)
+    feed.stop()
+    feed._thread.join(1.0)
+    assert not feed._thread.is_alive()
+
+
+def test_socket_feed_reads_ticks_from_the_tick_server():
+    server = TickServer(symbols=["AAA", "BBB"], rate=2000).start()
+    host, port = server.server_address
+    feed = SocketFeed(host, port).start()
+    try:
+        ticks = wait_for(feed, 50)
+        assert len(ticks) >= 50
+        assert {tick[0] for tick in ticks} <= {"AAA", "BBB"}
+        assert all(tick[2] > 0 and tick[3] > 0 for tick in ticks)
+    finally:
+        feed.stop()
+        server.stop()
+
+
+def test_socket_feed_reconnects():
+    server = TickServer(rate=2000).start()
+    host, port = server.server_address
+    feed = SocketFeed(host, port).start()
+    try:
+        assert len(wait_for(feed, 10)) >= 10
+        server.stop()
+        time.sleep(0.2)
+        feed.drain()
+        # a new server on the same port
+        server = TickServer(host, port, rate=2000).start()
+        assert len(wait_for(feed, 10)) >= 10
+    finally:
+        feed.stop()
+        server.stop()
+
+
+def test_file_feed_follows_a_replaced_file(tmp_path):
+    path = tmp_path / "ticks.csv"
+    write(path, format_tick("AAA", 1, 1.0, 1) * 5, "w")
+    feed = FileTailFeed(str(path), from_start=True).start()
+    try:
+        assert len(wait_for(feed, 5)) == 5
+        # e.g. log rotation: a new, longer file is moved to the path
+        rotated = tmp_path / "new.csv"
+        write(rotated, "".join(format_tick("NEW", t, 2.0, 1) for t in range(10)), "w")
+        rotated.replace(path)
+        ticks = wait_for(feed, 10)
+        assert [tick[1] for tick in ticks] == list(range(10))
+    finally:
+        feed.stop()
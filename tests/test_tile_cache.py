@@ -0,0 +1,153 @@
+# Tests of the local tile cache (ex04/tile_cache.py) with the generated stand-in tiles
+# as the upstream, so that no remote tile server is needed.
+
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import dvc_data
+import tile_cache
+from tile_cache import TileCache, standin_tile, tiles_for_bbox
+
+
+class Upstream:
+    # `standin_tile` that counts the tiles it is asked for
+    __name__ = "counting standin"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, z, x, y):
+        with self._lock:
+            self.calls.append((z, x, y))
+        time.sleep(self.delay)
+        return standin_tile(z, x, y, size=16)
+
+
+@pytest.fixture
+def upstream():
+    return Upstream()
+
+
+@pytest.fixture
+def no_proxy(monkeypatch):
+    # a fresh proxy state for `local_tile_url`, the proxy started by a test is shut down
+    monkeypatch.setattr(tile_cache, "_server", None)
+    monkeypatch.setattr(tile_cache, "_prefetched", set())
+    monkeypatch.delenv("DVC_TILES", raising=False)
+    yield
+    if tile_cache._server:
+        tile_cache._server.shutdown()
+        tile_cache._server.server_close()
+
+
+def test_miss_then_hit(upstream, tmp_path):
+    cache = TileCache(upstream, cache_dir=str(tmp_path))
+    first = cache.get(3, 1, 2)
+    assert first == standin_tile(3, 1, 2, size=16)
+    assert (tmp_path / "3" / "1" / "2.png").read_bytes() == first
+    assert cache.get(3, 1, 2) == first
+    assert upstream.calls == [(3, 1, 2)]
+    # another cache on the same directory (e.g. after a restart) doesn't fetch it again
+    assert TileCache(upstream, cache_dir=str(tmp_path)).get(3, 1, 2) == first
+    assert upstream.calls == [(3, 1, 2)]
+
+
+def test_concurrent_requests_fetch_a_tile_once(tmp_path):
+    upstream = Upstream(delay=0.05)
+    cache = TileCache(upstream, cache_dir=str(tmp_path))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(5, 3, 4))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upstream.calls == [(5, 3, 4)]
+    assert results == [standin_tile(5, 3, 4, size=16)] * 8
+    assert cache._fetching == {}
+
+
+def test_missing_upstream_tile_is_not_stored(tmp_path):
+    cache = TileCache(lambda z, x, y: None, cache_dir=str(tmp_path))
+    assert cache.get(1, 0, 0) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_offline_serves_only_cached_tiles(tmp_path):
+    cache = TileCache("http://127.0.0.1:9/{Z}/{X}/{Y}.png", cache_dir=str(tmp_path), offline=True)
+    assert cache.get(2, 1, 1) is None
+    TileCache._store(cache.path(2, 1, 1), b"png")
+    assert cache.get(2, 1, 1) == b"png"
+
+
+def test_prefetch_counts(upstream, tmp_path):
+    bbox = (-14000000, 2800000, -7400000, 6300000)
+    zooms = range(2, 6)
+    tiles = [t for z in zooms for t in tiles_for_bbox(*bbox, z)]
+    cache = TileCache(upstream, cache_dir=str(tmp_path))
+    assert cache.prefetch(bbox, zooms, workers=4) == len(tiles)
+    assert sorted(upstream.calls) == sorted(tiles)
+    assert len(list(tmp_path.rglob("*.png"))) == len(tiles)
+    # the second time, everything comes from disk
+    assert cache.prefetch(bbox, zooms, workers=4) == len(tiles)
+    assert len(upstream.calls) == len(tiles)
+
+
+def test_tiles_for_bbox_covers_the_world():
+    half = tile_cache.ORIGIN_SHIFT
+    for z in range(4):
+        assert len(tiles_for_bbox(-half, -half, half, half, z)) == 4**z
+
+
+def test_proxy_serves_the_tiles(no_proxy, monkeypatch, tmp_path):
+    monkeypatch.setattr(tile_cache, "TILE_DIR", str(tmp_path))
+    monkeypatch.setattr(tile_cache, "PORT", 0)
+    monkeypatch.setenv("DVC_TILES", "standin")
+    upstream = "http://tile.example.org/{Z}/{X}/{Y}.png"
+    url = tile_cache.local_tile_url(upstream)
+    # port 0 lets the system pick a free port, the URL of the tiles uses it
+    # (`local_tile_url` is only meant to be used with a fixed port)
+    port = tile_cache._server.server_address[1]
+    url = url.replace(":0/", f":{port}/")
+    with urllib.request.urlopen(url.format(Z=4, X=3, Y=5), timeout=5) as response:
+        assert response.read() == standin_tile(4, 3, 5)
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(url.replace(".png", ".jpg").format(Z=4, X=3, Y=5), timeout=5)
+    assert e.value.code == 404
+
+
+def test_proxy_fallback_when_the_port_is_taken(no_proxy, monkeypatch, caplog):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        monkeypatch.setattr(tile_cache, "BIND_HOST", "127.0.0.1")
+        monkeypatch.setattr(tile_cache, "PORT", taken.getsockname()[1])
+        upstream = "http://tile.example.org/{Z}/{X}/{Y}.png"
+        assert tile_cache.local_tile_url(upstream) == upstream
+        assert tile_cache._server is False
+        assert "can't start the tile proxy" in caplog.text
+        # it isn't tried again on every session
+        assert tile_cache.local_tile_url(upstream, bbox=(0, 0, 1, 1)) == upstream
+
+
+def test_direct_mode(no_proxy, monkeypatch):
+    monkeypatch.setenv("DVC_TILES", "direct")
+    upstream = "http://tile.example.org/{Z}/{X}/{Y}.png"
+    assert tile_cache.local_tile_url(upstream) == upstream
+    assert tile_cache._server is None
+
+
+def test_clear_cache_keeps_the_tiles(upstream, tmp_path):
+    (tmp_path / "snapshot.csv").write_text("Symbol\nAAA\n")
+    cache = TileCache(upstream, cache_dir=str(tmp_path / "tiles" / "standin"))
+    tile = cache.get(3, 2, 1)
+    dvc_data.clear_cache(str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == ["tiles"]
+    assert cache.get(3, 2, 1) == tile
+    assert upstream.calls == [(3, 2, 1)]